@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+#
+# Bounding Box Editor and Exporter (BBoxEE)
+# Author: Peter Ersts (ersts@amnh.org)
+#
+# --------------------------------------------------------------------------
+#
+# This file is part of Animal Detection Network's (Andenet)
+# Bounding Box Editor and Exporter (BBoxEE)
+#
+# BBoxEE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BBoxEE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# --------------------------------------------------------------------------
+import os
+import copy
+import json
+from collections.abc import MutableMapping
+from PyQt5 import QtCore
+
+# Annotation files are either a single JSON document or, for large
+# projects, JSON Lines: a header line with everything but the images, one
+# line per image, an index line and a trailer holding the index offset.
+LINES_FORMAT = 'bbx-lines'
+
+
+def is_lines(file_name):
+    """Check if an annotation file uses the JSON Lines layout."""
+    with open(file_name, 'rb') as file:
+        line = file.readline()
+    try:
+        header = json.loads(line)
+    except ValueError:
+        return False
+    return isinstance(header, dict) and header.get('format') == LINES_FORMAT
+
+
+class LazyImages(MutableMapping):
+    """Image entries of a JSON Lines annotation file.
+
+    Entries are read from disk the first time they are accessed, the
+    index keeps the annotation count of every image and the labels used
+    in the file so that navigation and label lists do not need the
+    entries themselves.
+    """
+
+    def __init__(self, file_name, index):
+        """Class init function.
+
+        Args:
+            file_name (str): JSON Lines annotation file
+            index (dict): Image names, line offsets, annotation counts
+                and labels
+        """
+        self.file = open(file_name, 'rb')
+        self.rebind(index)
+        self.entries = {}
+
+    def __getitem__(self, name):
+        if name not in self.entries:
+            line = self.raw(name)
+            self.entries[name] = json.loads(line)['entry']
+            del self.index[name]
+        return self.entries[name]
+
+    def __setitem__(self, name, entry):
+        self.index.pop(name, None)
+        self.entries[name] = entry
+
+    def __delitem__(self, name):
+        if name in self.index:
+            del self.index[name]
+        else:
+            del self.entries[name]
+
+    def __contains__(self, name):
+        return name in self.entries or name in self.index
+
+    def __iter__(self):
+        for name in list(self.index):
+            yield name
+        for name in list(self.entries):
+            yield name
+
+    def __len__(self):
+        return len(self.index) + len(self.entries)
+
+    def rebind(self, index):
+        """Point the entries still on disk at a new index."""
+        self.index = dict(zip(index['names'], range(len(index['names']))))
+        self.offsets = index['offsets']
+        self.counts = index['counts']
+        self.file_labels = set(index['labels'])
+
+    def reopen(self, file_name, index):
+        """Read the entries still on disk from a newly written copy of
+        the file, entries read or deleted since it was written stay so."""
+        unread = self.index
+        self.file.close()
+        self.file = open(file_name, 'rb')
+        self.rebind(index)
+        self.index = {n: p for n, p in self.index.items() if n in unread}
+
+    def snapshot(self):
+        """A copy sharing the entries that can be read with its own file
+        handle so that it can be saved from another thread."""
+        images = LazyImages.__new__(LazyImages)
+        images.file = open(self.file.name, 'rb')
+        images.index = dict(self.index)
+        images.offsets = self.offsets
+        images.counts = self.counts
+        images.file_labels = set(self.file_labels)
+        images.entries = dict(self.entries)
+        return images
+
+    def adopt(self, images):
+        """Take the entries still on disk from images that have read them,
+        this file is no longer needed afterwards."""
+        for name in list(self.index):
+            self.entries[name] = images.entries[name]
+        self.index = {}
+
+    def raw(self, name):
+        """The line of an entry that has not been read."""
+        position = self.index[name]
+        offset = self.offsets[position]
+        self.file.seek(offset)
+        return self.file.read(self.offsets[position + 1] - offset)
+
+    def count(self, name):
+        """Number of annotations on an image without reading its entry."""
+        if name in self.entries:
+            return len(self.entries[name]['annotations'])
+        return self.counts[self.index[name]]
+
+    def labels(self):
+        """Labels used on any image."""
+        label_set = set(self.file_labels)
+        for entry in self.entries.values():
+            for annotation in entry['annotations']:
+                label_set.add(annotation['label'])
+        return label_set
+
+    def close(self):
+        self.file.close()
+
+
+def annotation_count(images, name):
+    """Number of annotations on an image, 0 when it has no entry."""
+    if name not in images:
+        return 0
+    if isinstance(images, LazyImages):
+        return images.count(name)
+    return len(images[name]['annotations'])
+
+
+def labels(images):
+    """Set of labels used in the image entries."""
+    if isinstance(images, LazyImages):
+        return images.labels()
+    label_set = set()
+    for entry in images.values():
+        for annotation in entry['annotations']:
+            label_set.add(annotation['label'])
+    return label_set
+
+
+def snapshot(data, detach=[]):
+    """Copy annotation data for saving in the background.
+
+    Only the containers are copied, image entries are shared. Entries that
+    may still be edited in place must be listed in detach or replaced in
+    data by a copy before they are edited.
+
+    Args:
+        data (dict): Annotation file data
+        detach (list): Names of images to deep copy
+
+    Returns:
+        dict: Annotation file data
+    """
+    snapshot = dict(data)
+    snapshot['analysts'] = list(data['analysts'])
+    if isinstance(data['images'], LazyImages):
+        images = data['images'].snapshot()
+    else:
+        images = dict(data['images'])
+    for name in detach:
+        if name in images:
+            images[name] = copy.deepcopy(images[name])
+    snapshot['images'] = images
+    return snapshot
+
+
+def load(file_name, lazy=False):
+    """Load an annotation file in either layout.
+
+    Args:
+        file_name (str): Path of the .bbx file
+        lazy (bool): Read JSON Lines image entries on demand
+
+    Returns:
+        dict: Annotation file data
+    """
+    if not is_lines(file_name):
+        with open(file_name, 'r') as file:
+            return json.load(file)
+    with open(file_name, 'rb') as file:
+        data = json.loads(file.readline())
+        del data['format']
+        if lazy:
+            file.seek(-min(os.path.getsize(file_name), 64), os.SEEK_END)
+            offset = json.loads(file.read().splitlines()[-1])['index_offset']
+            file.seek(offset)
+            index = json.loads(file.readline())['index']
+            data['images'] = LazyImages(file_name, index)
+        else:
+            data['images'] = {}
+            for line in file:
+                record = json.loads(line)
+                if 'name' not in record:
+                    break
+                data['images'][record['name']] = record['entry']
+    return data
+
+
+def write(data, file_name, lines=False):
+    """Write annotation data to a temporary file beside the annotation
+    file, see replace().
+
+    Args:
+        data (dict): Annotation file data
+        file_name (str): Path of the .bbx file
+        lines (bool): Use the JSON Lines layout
+
+    Returns:
+        tuple: Name of the temporary file and the index of the JSON Lines
+            file, None for a single document
+    """
+    temp_name = file_name + '.tmp'
+    images = data['images']
+    if lines:
+        with open(temp_name, 'wb') as file:
+            header = {'format': LINES_FORMAT}
+            for key in data:
+                if key != 'images':
+                    header[key] = data[key]
+            file.write(json.dumps(header).encode('utf-8') + b'\n')
+            index = {'names': [], 'offsets': [], 'counts': [], 'labels': set()}
+            for name in images:
+                index['names'].append(name)
+                index['offsets'].append(file.tell())
+                if isinstance(images, LazyImages) and name in images.index:
+                    # Untouched entries are copied without parsing
+                    file.write(images.raw(name))
+                    index['counts'].append(images.count(name))
+                else:
+                    entry = images[name]
+                    line = {'name': name, 'entry': entry}
+                    file.write(json.dumps(line).encode('utf-8') + b'\n')
+                    index['counts'].append(len(entry['annotations']))
+                    for annotation in entry['annotations']:
+                        index['labels'].add(annotation['label'])
+            if isinstance(images, LazyImages):
+                index['labels'].update(images.file_labels)
+            index['labels'] = sorted(index['labels'])
+            offset = file.tell()
+            # The offset of the index closes the last entry
+            index['offsets'].append(offset)
+            file.write(json.dumps({'index': index}).encode('utf-8') + b'\n')
+            file.write(json.dumps({'index_offset': offset}).encode('utf-8') + b'\n')
+            file.flush()
+            os.fsync(file.fileno())
+    else:
+        if isinstance(images, LazyImages):
+            data = dict(data)
+            data['images'] = dict(images)
+        with open(temp_name, 'w') as file:
+            json.dump(data, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+    return (temp_name, index if lines else None)
+
+
+def replace(temp_name, file_name, images=None, index=None, written=None):
+    """Move a file written by write() over the annotation file.
+
+    Lazily read images are released first when they read from the file
+    being replaced, an open file can not be replaced on Windows. They read
+    the entries still on disk from the new file if it is a JSON Lines file,
+    otherwise they take the entries read while writing it.
+
+    Args:
+        temp_name (str): Temporary file returned by write()
+        file_name (str): Path of the .bbx file
+        images (LazyImages): Images being edited, if lazily read
+        index (dict): Index returned by write()
+        written (LazyImages): Images that were written, when a snapshot
+    """
+    lazy = isinstance(images, LazyImages)
+    if lazy and os.path.abspath(images.file.name) == os.path.abspath(file_name):
+        if index is None:
+            images.adopt(written if written is not None else images)
+        images.close()
+    os.replace(temp_name, file_name)
+    if lazy and index is not None:
+        # Entries that are still on disk are read from the new file
+        images.reopen(file_name, index)
+
+
+def save(data, file_name, lines=False):
+    """Write annotation data through a temporary file so that the
+    annotation file is either the old or the new version, never partial.
+
+    Args:
+        data (dict): Annotation file data
+        file_name (str): Path of the .bbx file
+        lines (bool): Use the JSON Lines layout
+
+    Returns:
+        dict: Index of the JSON Lines file, None for a single document
+    """
+    temp_name, index = write(data, file_name, lines)
+    replace(temp_name, file_name, data['images'], index)
+    return index
+
+
+class Saver(QtCore.QThread):
+    """Threaded worker that writes a snapshot of annotation data so that
+    the interface stays responsive while saving. The written file is moved
+    over the annotation file by commit() once the thread has finished."""
+
+    def __init__(self):
+        """Class init function."""
+        QtCore.QThread.__init__(self)
+        self.data = None
+        self.file_name = ''
+        self.lines = False
+        self.temp_name = None
+        self.index = None
+        self.written = None
+        self.error = None
+
+    def commit(self, images):
+        """Replace the annotation file with the written file.
+
+        Args:
+            images (dict | LazyImages): Images being edited, released from
+                the file being replaced if they read from it
+        """
+        if self.error is None and self.temp_name is not None:
+            try:
+                replace(self.temp_name, self.file_name, images, self.index,
+                        self.written)
+            except OSError as error:
+                self.error = str(error)
+        self.temp_name = None
+        self.written = None
+
+    def run(self):
+        """The starting point for the thread."""
+        self.temp_name = None
+        self.index = None
+        self.error = None
+        images = self.data['images']
+        try:
+            self.temp_name, self.index = write(self.data, self.file_name, self.lines)
+        except (OSError, ValueError, TypeError) as error:
+            self.error = str(error)
+        if isinstance(images, LazyImages):
+            images.close()
+            self.written = images
+        self.data = None
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#
+# Bounding Box Editor and Exporter (BBoxEE)
+# Author: Peter Ersts (ersts@amnh.org)
+#
+# --------------------------------------------------------------------------
+#
+# This file is part of Animal Detection Network's (Andenet)
+# Bounding Box Editor and Exporter (BBoxEE)
+#
+# BBoxEE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BBoxEE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# --------------------------------------------------------------------------
+import os
+import json
+import sqlite3
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from PyQt5 import QtCore
+from bboxee import bbx
+
+# Bump when the summary fields change so old caches are ignored
+SUMMARY_VERSION = 2
+# Below this many files to parse a process pool costs more than it saves
+MIN_POOL_FILES = 8
+CHUNK_SIZE = 4
+
+
+def default_cache_file():
+    cache_dir = QtCore.QStandardPaths.writableLocation(
+        QtCore.QStandardPaths.GenericCacheLocation)
+    return os.path.join(cache_dir, 'bboxee', 'summaries.sqlite')
+
+
+def summarize(file_name):
+    """Read an annotation file and summarize labels and exclusions by
+    image and for the whole file. Annotations, licenses and the mask are
+    left out, they are read again from the files that are exported.
+
+    Args:
+        file_name (str): Path of the .bbx file
+
+    Returns:
+        dict: summary text, label counts, labels and exclusions by image,
+        image_count and mask_name
+    """
+    contents = bbx.load(file_name)
+    summary = {}
+    images = {}
+    for entry in contents['images']:
+        record = contents['images'][entry]
+        labels = {}
+        exclusions = {}
+        for annotation in record['annotations']:
+            label = annotation['label']
+            labels[label] = labels.get(label, 0) + 1
+            summary[label] = summary.get(label, 0) + 1
+            if annotation['truncated'] == "Y":
+                exclusions['truncated'] = True
+            if annotation['occluded'] == "Y":
+                exclusions['occluded'] = True
+            if annotation['difficult'] == "Y":
+                exclusions['difficult'] = True
+        images[entry] = {'labels': labels, 'exclusions': exclusions}
+    string = ''
+    for label in summary:
+        string += label + ': ' + str(summary[label]) + "\n"
+    return {'summary': string,
+            'labels': summary,
+            'images': images,
+            'image_count': len(images),
+            'mask_name': contents['mask_name']}
+
+
+class SummaryCache(object):
+    """Summaries of annotation files in a SQLite database keyed by path,
+    size and modification time so unchanged files are not parsed again.
+
+    The connection belongs to the thread that created the cache."""
+
+    def __init__(self, file_name=None):
+        """Class init function.
+
+        Args:
+            file_name (str): Database file, in the user cache when None
+        """
+        if file_name is None:
+            file_name = default_cache_file()
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        self.connection = sqlite3.connect(file_name)
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != SUMMARY_VERSION:
+            self.connection.execute('DROP TABLE IF EXISTS summaries')
+            self.connection.execute('PRAGMA user_version = {}'.format(SUMMARY_VERSION))
+        self.connection.execute('CREATE TABLE IF NOT EXISTS summaries '
+                                '(path TEXT PRIMARY KEY, size INTEGER, '
+                                'mtime_ns INTEGER, summary TEXT)')
+        self.connection.commit()
+
+    def get(self, file_name, stat):
+        """Cached summary of an annotation file, None if the file changed
+        or has not been summarized."""
+        row = self.connection.execute('SELECT summary FROM summaries '
+                                      'WHERE path = ? AND size = ? AND mtime_ns = ?',
+                                      (os.path.abspath(file_name),
+                                       stat.st_size,
+                                       stat.st_mtime_ns)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put(self, file_name, stat, summary):
+        """Store the summary of an annotation file, call commit() to write."""
+        self.connection.execute('INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?)',
+                                (os.path.abspath(file_name),
+                                 stat.st_size,
+                                 stat.st_mtime_ns,
+                                 json.dumps(summary)))
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+def summarize_all(file_list, workers=None):
+    """Summarize annotation files, in a pool of worker processes when
+    there are enough of them.
+
+    Args:
+        file_list (list): Paths of .bbx files
+        workers (int): Number of processes, one per CPU when None
+
+    Yields:
+        dict: Summary of each file in the order of file_list
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers == 1 or len(file_list) < MIN_POOL_FILES:
+        for file_name in file_list:
+            yield summarize(file_name)
+        return
+    # Spawn rather than fork, the globber runs beside Qt threads
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        for summary in executor.map(summarize, file_list, chunksize=CHUNK_SIZE):
+            yield summary
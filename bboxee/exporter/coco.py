@@ -24,12 +24,15 @@
 # --------------------------------------------------------------------------
 import os
 import json
-import random
 import datetime
-import numpy as np
-from shutil import copyfile
 from PIL import Image
 from PyQt5 import QtCore
+from bboxee.mask import Regions
+from bboxee.exporter import pipeline
+from bboxee.exporter.split import RANDOM
+from bboxee.exporter.manifest import ExportManifest, VALIDATION
+from bboxee.exporter.manifest import annotation_hash, image_key, can_export
+from bboxee.image_metadata import index_images
 
 
 class Exporter(QtCore.QThread):
@@ -44,7 +47,9 @@ class Exporter(QtCore.QThread):
                  label_map,
                  validation_split,
                  masks={},
-                 strip_metadata=False):
+                 strip_metadata=False,
+                 placement=pipeline.COPY,
+                 split_mode=RANDOM):
         """
         Class init function.
 
@@ -55,20 +60,35 @@ class Exporter(QtCore.QThread):
             validation_split (float): Percent to use for validation
             masks (dict): Binary arrays for masking metadata
             strip_metadata (bool): Flag for stripping metadata
+            placement (str): How images that are not stripped are placed,
+                one of pipeline.PLACEMENTS
+            split_mode (str): How examples are split, one of
+                split.SPLIT_MODES
+
+        Raises:
+            ValueError: The directory is not empty and holds no earlier
+                export
         """
         QtCore.QThread.__init__(self)
+        # Files of an unrelated export or anything else would be
+        # overwritten or left mixed in with the new export
+        if not can_export(directory):
+            raise ValueError('{} is not empty and does not hold an earlier '
+                             'export'.format(directory))
         self.info = {}
         self.directory = directory
         self.images = images
         self.label_map = label_map
-        self.train_size = int((1.0 - validation_split) * len(self.images))
+        self.validation_split = validation_split
 
-        self.masks = masks
         self.strip_metadata = strip_metadata
+        self.placement = placement
+        self.split_mode = split_mode
 
+        # Reduce each mask to the regions it zeroes
+        self.masks = {}
         for mask in masks:
-            m = np.array(masks[mask], dtype='uint8')
-            self.masks[mask] = np.dstack((m, m, m))
+            self.masks[mask] = Regions(masks[mask])
 
         self.labels = []
         for label in label_map:
@@ -84,8 +104,6 @@ class Exporter(QtCore.QThread):
         After creating and instance of the class, calling start() will call
         this function which exports all of the annotaiton examples to disk.
         """
-        random.shuffle(self.images)
-
         license_name = ['No License']
         licenses = [{'id': 0, 'name': 'No License', 'url': ''}]
 
@@ -95,14 +113,12 @@ class Exporter(QtCore.QThread):
                        "supercategory": "none"} for i, l in enumerate(
                            self.labels)]
 
-        # Create new directories
+        # Create new directories, or update an earlier export
         image_train_path = os.path.join(self.directory, 'train')
         image_val_path = os.path.join(self.directory, 'validation')
-        os.makedirs(image_train_path)
-        os.makedirs(image_val_path)
+        os.makedirs(image_train_path, exist_ok=True)
+        os.makedirs(image_val_path, exist_ok=True)
 
-        prefix = 'train_'
-        img_path = os.path.join(image_train_path, prefix)
         train = {'info': self.info,
                  'images': [],
                  'annotations': [],
@@ -114,32 +130,67 @@ class Exporter(QtCore.QThread):
                'licenses': [],
                'categories': categories}
 
-        current = train
+        # Examples keep their id and split across exports into the same
+        # directory
+        export = ExportManifest(self.directory)
+        plan = export.update(self.images, self.validation_split,
+                             self.split_mode)
+        export.save()
+
+        # Dimensions and capture times come from the image headers
+        metadata = index_images(self.images)
+
+        # Copy or strip new and changed images in worker processes
+        tasks = []
+        placed = []
+        keys = []
+        for rec, entry in plan:
+            if entry['split'] == VALIDATION:
+                img_file = os.path.join(image_val_path, 'val_{:010d}.jpg'.format(entry['id']))
+            else:
+                img_file = os.path.join(image_train_path, 'train_{:010d}.jpg'.format(entry['id']))
+            task = {'source': os.path.join(rec['directory'], rec['file_name']),
+                    'destination': img_file,
+                    'mask_name': rec['mask_name'],
+                    'strip': self.strip_metadata,
+                    'placement': self.placement}
+            placed.append(task)
+            entry['files'] = [export.relative(img_file)]
+            keys.append(image_key(rec, self.strip_metadata, self.placement))
+            if entry['image'] != keys[-1]:
+                tasks.append(task)
+        results = pipeline.run(tasks, self.masks)
+
         annotation_count = 0
-        for count, rec in enumerate(self.images):
-            if count > self.train_size:
+        for count, (rec, entry) in enumerate(plan):
+            result = {'size': None}
+            if entry['image'] != keys[count]:
+                result = next(results)
+                entry['image'] = keys[count]
+                export.completed()
+            entry['annotations'] = annotation_hash(rec)
+            current = train
+            prefix = 'train_'
+            if entry['split'] == VALIDATION:
                 current = val
                 prefix = 'val_'
-                img_path = os.path.join(image_val_path, prefix)
-            img_file = img_path + '{:010d}.jpg'.format(count)
 
             src_file = os.path.join(rec['directory'], rec['file_name'])
-            timestamp = os.path.getctime(src_file)
-            timestamp = datetime.datetime.fromtimestamp(timestamp)
-            rec['date_captured'] = str(timestamp)
-            img = Image.open(src_file)
-            size = img.size  # PIL (width, height)
-            if self.strip_metadata:
-                array = np.array(img)
-                img.close()
-                if rec['mask_name'] in self.masks:
-                    array = array * self.masks[rec['mask_name']]
-                img = Image.fromarray(array)
-                img.save(img_file)
-                img.close()
+            info = metadata[rec['directory']].get(rec['file_name'])
+            if info is None or info['date_captured'] is None:
+                timestamp = os.path.getctime(src_file)
+                timestamp = datetime.datetime.fromtimestamp(timestamp)
+                rec['date_captured'] = str(timestamp)
+            else:
+                rec['date_captured'] = info['date_captured']
+            if result['size'] is not None:
+                size = result['size']  # PIL (width, height)
+            elif info is not None:
+                size = (info['width'], info['height'])
             else:
+                img = Image.open(src_file)
+                size = img.size
                 img.close()
-                copyfile(src_file, img_file)
 
             # Build license object
             if rec['license'] != '' and rec['license'] not in license_name:
@@ -154,10 +205,10 @@ class Exporter(QtCore.QThread):
 
             # Store image entry
             image_rec = {}
-            image_rec['id'] = count
+            image_rec['id'] = entry['id']
             image_rec['width'] = size[0]
             image_rec['height'] = size[1]
-            image_rec['file_name'] = prefix + '{:010d}.jpg'.format(count)
+            image_rec['file_name'] = prefix + '{:010d}.jpg'.format(entry['id'])
             image_rec['license'] = license_num
             image_rec['attribution'] = rec['attribution']
             image_rec['flickr_url'] = ''
@@ -172,7 +223,7 @@ class Exporter(QtCore.QThread):
                 height = (bbox['ymax'] - bbox['ymin']) * size[1]
                 annotation = {}
                 annotation['id'] = annotation_count
-                annotation['image_id'] = count
+                annotation['image_id'] = entry['id']
                 remap = self.label_map[ann['label']]
                 annotation['category_id'] = self.labels.index(remap)
                 annotation['segmentation'] = []
@@ -194,4 +245,7 @@ class Exporter(QtCore.QThread):
         file = open(os.path.join(self.directory, 'validation.json'), 'w')
         json.dump(val, file, indent=4)
         file.close()
+        if self.placement == pipeline.MANIFEST and not self.strip_metadata:
+            pipeline.write_manifest(self.directory, placed)
+        export.save()
         self.exported.emit()
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+#
+# Bounding Box Editor and Exporter (BBoxEE)
+# Author: Peter Ersts (ersts@amnh.org)
+#
+# --------------------------------------------------------------------------
+#
+# This file is part of Animal Detection Network's (Andenet)
+# Bounding Box Editor and Exporter (BBoxEE)
+#
+# BBoxEE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BBoxEE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# --------------------------------------------------------------------------
+import os
+import json
+import random
+import hashlib
+from bboxee.exporter.split import RANDOM, dataset_directory, is_validation
+
+# Kept in the export directory, lists what was exported from where so the
+# export can be updated. The image names of the manifest placement are
+# in pipeline.PLACEMENT_FILE.
+MANIFEST_FILE = 'export_manifest.json'
+MANIFEST_VERSION = 2
+# Examples exported between saves of the manifest
+SAVE_INTERVAL = 100
+TRAIN = 'train'
+VALIDATION = 'validation'
+
+
+def image_key(rec, strip_metadata, placement):
+    """What an exported image depends on, the image is exported again when
+    any of it changes."""
+    stat = os.stat(os.path.join(rec['directory'], rec['file_name']))
+    return {'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'mask': rec['mask_name'],
+            'strip': strip_metadata,
+            'placement': placement}
+
+
+def annotation_hash(rec, extra=None):
+    """Hash of the annotation data of an image and anything else, such as
+    the label list, that the exported annotations depend on."""
+    content = {'annotations': rec['annotations'],
+               'license': rec.get('license'),
+               'license_url': rec.get('license_url'),
+               'attribution': rec.get('attribution'),
+               'extra': extra}
+    text = json.dumps(content, sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def source_key(rec):
+    """Key of an example in the manifest, the .bbx file and image name
+    relative to the root of the dataset. The same image listed by two
+    .bbx files is two examples, and the key survives moving the dataset."""
+    return '/'.join([dataset_directory(rec), rec.get('bbx_file', ''), rec['file_name']])
+
+
+def can_export(directory):
+    """Can an export be written to directory without overwriting files
+    of something else? True if it is missing, empty or holds an earlier
+    export."""
+    if not os.path.isdir(directory):
+        return True
+    return (len(os.listdir(directory)) == 0 or
+            os.path.exists(os.path.join(directory, MANIFEST_FILE)))
+
+
+class ExportManifest(object):
+    """Record of an export used to update it incrementally.
+
+    Every exported example is keyed by source_key() and keeps its id,
+    split and output files across runs. A re-run exports only examples
+    that were added or changed, removes the files of examples that are
+    gone, and picks up where an interrupted run stopped.
+    """
+
+    def __init__(self, directory):
+        """Class init function.
+
+        Args:
+            directory (str): Export directory
+        """
+        self.directory = directory
+        self.file_name = os.path.join(directory, MANIFEST_FILE)
+        self.entries = {}
+        # Entries of a manifest written by an earlier version, their files
+        # are removed and everything is exported again
+        self.outdated = {}
+        self.exported = 0
+        try:
+            with open(self.file_name, 'r') as file:
+                manifest = json.load(file)
+            if manifest['version'] == MANIFEST_VERSION:
+                self.entries = manifest['entries']
+            else:
+                self.outdated = manifest['entries']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def update(self, images, validation_split, split_mode=RANDOM):
+        """Match the images to export against the manifest.
+
+        Examples no longer exported are dropped from the manifest and
+        their files removed. New examples get the next free ids. With the
+        random split they are taken in random order and assigned to the
+        validation set until it holds the requested share of the
+        examples, with a hashed split their set comes from their name and
+        examples whose set changed are exported again.
+
+        Args:
+            images (list): Image records to export
+            validation_split (float): Share of examples for validation
+            split_mode (str): One of split.SPLIT_MODES
+
+        Returns:
+            list: (record, entry) of every image in id order
+        """
+        for entry in self.outdated.values():
+            self.remove_files(entry)
+        self.outdated = {}
+        current = {}
+        for rec in images:
+            current[source_key(rec)] = rec
+        hashed = {}
+        if split_mode != RANDOM:
+            for source in current:
+                hashed[source] = VALIDATION if is_validation(
+                    current[source], validation_split, split_mode) else TRAIN
+        for source in [s for s in self.entries if s not in current or
+                       (s in hashed and self.entries[s]['split'] != hashed[s])]:
+            self.remove_files(self.entries.pop(source))
+
+        next_id = max([e['id'] for e in self.entries.values()], default=-1) + 1
+        validation = sum(1 for e in self.entries.values() if e['split'] == VALIDATION)
+        target = int(round(validation_split * len(current)))
+        added = [s for s in current if s not in self.entries]
+        if split_mode == RANDOM:
+            random.shuffle(added)
+        for source in added:
+            split = TRAIN
+            if source in hashed:
+                split = hashed[source]
+            elif validation < target:
+                split = VALIDATION
+                validation += 1
+            self.entries[source] = {'id': next_id,
+                                    'split': split,
+                                    'image': None,
+                                    'annotations': None,
+                                    'files': []}
+            next_id += 1
+
+        plan = [(current[s], self.entries[s]) for s in current]
+        plan.sort(key=lambda item: item[1]['id'])
+        return plan
+
+    def completed(self):
+        """Count an exported example, the manifest is saved regularly so an
+        interrupted export can resume."""
+        self.exported += 1
+        if self.exported % SAVE_INTERVAL == 0:
+            self.save()
+
+    def remove_files(self, entry):
+        for name in entry['files']:
+            path = os.path.join(self.directory, name)
+            if os.path.lexists(path):
+                os.remove(path)
+
+    def relative(self, path):
+        return os.path.relpath(path, self.directory).replace(os.path.sep, '/')
+
+    def save(self):
+        """Write the manifest, atomically so an interrupted export leaves
+        the previous state."""
+        manifest = {'version': MANIFEST_VERSION, 'entries': self.entries}
+        temp_name = self.file_name + '.tmp'
+        with open(temp_name, 'w') as file:
+            json.dump(manifest, file)
+        os.replace(temp_name, self.file_name)
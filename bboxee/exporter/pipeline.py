@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+#
+# Bounding Box Editor and Exporter (BBoxEE)
+# Author: Peter Ersts (ersts@amnh.org)
+#
+# --------------------------------------------------------------------------
+#
+# This file is part of Animal Detection Network's (Andenet)
+# Bounding Box Editor and Exporter (BBoxEE)
+#
+# BBoxEE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BBoxEE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# --------------------------------------------------------------------------
+import io
+import os
+import json
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from shutil import copyfile
+import numpy as np
+from PIL import Image
+from bboxee import jpeg
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
+# Images queued or being processed per worker, bounds the memory held by
+# results that wait to be written in order
+PENDING_PER_WORKER = 4
+
+# Masks handed to each worker once when the pool starts
+MASKS = {}
+
+# Ways to place images that are not stripped in the export directory,
+# in the order they are offered in the export widget
+COPY = 'copy'
+HARDLINK = 'hardlink'
+REFLINK = 'reflink'
+SYMLINK = 'symlink'
+MANIFEST = 'manifest'
+PLACEMENTS = [COPY, HARDLINK, REFLINK, SYMLINK, MANIFEST]
+# Written by the MANIFEST placement, maps exported image names to their
+# sources. Not to be confused with manifest.MANIFEST_FILE, the record of
+# an export used to update it incrementally.
+PLACEMENT_FILE = 'placement_manifest.json'
+
+# Linux ioctl sharing the extents of one file with another (Btrfs, XFS)
+FICLONE = 0x40049409
+
+
+def init_worker(masks):
+    global MASKS
+    MASKS = masks
+
+
+def reflink(source, destination):
+    """Clone a file without copying its data."""
+    if fcntl is None:
+        raise OSError('Reflinks are not supported on this platform')
+    try:
+        with open(source, 'rb') as src, open(destination, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError:
+        if os.path.exists(destination):
+            os.remove(destination)
+        raise
+
+
+def place(source, destination, placement=COPY):
+    """Place an image in the export directory.
+
+    Links that can not be made, across devices or on file systems without
+    support, fall back on a copy.
+
+    Returns:
+        str: The placement used
+    """
+    try:
+        if placement == HARDLINK:
+            os.link(source, destination)
+            return HARDLINK
+        if placement == REFLINK:
+            reflink(source, destination)
+            return REFLINK
+        if placement == SYMLINK:
+            os.symlink(os.path.abspath(source), destination)
+            return SYMLINK
+    except OSError:
+        pass
+    copyfile(source, destination)
+    return COPY
+
+
+def write_manifest(directory, tasks):
+    """Write the source of every exported image, relative to the export
+    directory, to PLACEMENT_FILE."""
+    manifest = {}
+    for task in tasks:
+        name = os.path.relpath(task['destination'], directory)
+        manifest[name.replace(os.path.sep, '/')] = os.path.abspath(task['source'])
+    with open(os.path.join(directory, PLACEMENT_FILE), 'w') as file:
+        json.dump(manifest, file, indent=4)
+
+
+def process(task):
+    """Copy or re-encode one image, runs in a worker process.
+
+    Args:
+        task (dict): source (str), destination (str or None to return the
+            encoded image instead of writing it), mask_name (str),
+            strip (bool) to remove metadata and apply the mask and
+            placement (str) of images that are not stripped
+
+    Returns:
+        dict: size (PIL (width, height) or None when the image was copied
+            without being read), format (str or None) and encoded (bytes
+            or None)
+
+    When stripping, JPEG images are stripped losslessly when possible and
+    decoded, masked and re-encoded otherwise.
+    """
+    source = task['source']
+    destination = task['destination']
+    if destination is not None and os.path.lexists(destination):
+        # Never write through a link from an earlier export to its source
+        os.remove(destination)
+    if not task['strip']:
+        if destination is not None:
+            placement = task.get('placement', COPY)
+            if placement != MANIFEST:
+                place(source, destination, placement)
+            return {'size': None, 'format': None, 'encoded': None}
+        with open(source, 'rb') as file:
+            encoded = file.read()
+        img = Image.open(io.BytesIO(encoded))
+        result = {'size': img.size, 'format': img.format, 'encoded': encoded}
+        img.close()
+        return result
+
+    # Drop the metadata segments and blank masked MCUs without decoding
+    with open(source, 'rb') as file:
+        encoded = jpeg.strip(file.read(), MASKS.get(task['mask_name']))
+    if encoded is not None:
+        img = Image.open(io.BytesIO(encoded))
+        result = {'size': img.size, 'format': img.format, 'encoded': encoded}
+        img.close()
+        if destination is not None:
+            with open(destination, 'wb') as file:
+                file.write(encoded)
+            result['encoded'] = None
+        return result
+
+    img = Image.open(source)
+    size = img.size
+    image_format = img.format
+    array = np.array(img)
+    img.close()
+    if task['mask_name'] in MASKS:
+        MASKS[task['mask_name']].apply(array)
+    img = Image.fromarray(array)
+    encoded = None
+    if destination is None:
+        buf = io.BytesIO()
+        img.save(buf, format='JPEG')
+        encoded = buf.getvalue()
+        buf.close()
+    else:
+        img.save(destination)
+    img.close()
+    return {'size': size, 'format': image_format, 'encoded': encoded}
+
+
+def run(tasks, masks={}, workers=None):
+    """Process images in a pool of worker processes.
+
+    At most PENDING_PER_WORKER tasks per worker are in flight, results are
+    yielded in the order of the tasks so exports are written the same way
+    whatever the number of workers.
+
+    Args:
+        tasks (list): Tasks as described in process()
+        masks (dict): Regions keyed by mask name
+        workers (int): Number of processes, one per CPU when None
+
+    Yields:
+        dict: Result of each task, see process()
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    # Spawn rather than fork, the exporters run beside Qt threads
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=context,
+                             initializer=init_worker,
+                             initargs=(masks,)) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(process, task))
+            if len(pending) >= workers * PENDING_PER_WORKER:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
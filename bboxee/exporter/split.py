@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+# Bounding Box Editor and Exporter (BBoxEE)
+# Author: Peter Ersts (ersts@amnh.org)
+#
+# --------------------------------------------------------------------------
+#
+# This file is part of Animal Detection Network's (Andenet)
+# Bounding Box Editor and Exporter (BBoxEE)
+#
+# BBoxEE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BBoxEE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# --------------------------------------------------------------------------
+import os
+import hashlib
+
+# How examples are assigned to the training and validation sets, in the
+# order they are offered in the export widget
+RANDOM = 'random'
+HASHED = 'hashed'
+HASHED_FOLDER = 'hashed_folder'
+SPLIT_MODES = [RANDOM, HASHED, HASHED_FOLDER]
+
+
+def dataset_directory(rec):
+    """Directory of an example relative to the root of its dataset with /
+    separators, the absolute directory when no root is known."""
+    directory = rec['directory']
+    if rec.get('root'):
+        directory = os.path.relpath(directory, rec['root'])
+    return os.path.normpath(directory).replace(os.path.sep, '/')
+
+
+def split_key(rec, group=False):
+    """Stable name of an example, or of its folder when examples from the
+    same camera folder are kept together. Paths are relative to the root
+    of the dataset, or only the last folder name is used, so the split is
+    the same on every machine and mount point."""
+    directory = dataset_directory(rec)
+    if not rec.get('root'):
+        directory = directory.rsplit('/', 1)[-1]
+    if group:
+        return directory
+    return directory + '/' + rec['file_name']
+
+
+def is_validation(rec, validation_split, split_mode=HASHED):
+    """Decide from a hash of its name whether an example is for validation.
+
+    The same example always lands in the same set for a given ratio so
+    examples can be exported as a stream, in any order, and splits are
+    repeated by later exports.
+
+    Args:
+        rec (dict): Image record with directory and file_name
+        validation_split (float): Share of examples for validation
+        split_mode (str): HASHED or HASHED_FOLDER
+
+    Returns:
+        bool: True for validation
+    """
+    key = split_key(rec, split_mode == HASHED_FOLDER)
+    digest = hashlib.sha1(key.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') / 2.0 ** 64 < validation_split
@@ -23,13 +23,14 @@
 #
 # --------------------------------------------------------------------------
 import os
-import io
 import random
 import hashlib
-import numpy as np
+import itertools
 import tensorflow as tf
-from PIL import Image
 from PyQt5 import QtCore
+from bboxee.mask import Regions
+from bboxee.exporter import pipeline
+from bboxee.exporter.split import RANDOM, is_validation
 
 
 def int64_feature(value):
@@ -64,30 +65,39 @@ class Exporter(QtCore.QThread):
                  label_map,
                  validation_split,
                  masks={},
-                 strip_metadata=False):
+                 strip_metadata=False,
+                 split_mode=RANDOM):
         """
         Class init function.
 
         Args:
             directory (str): Destination directory
-            image_data (File): Image and Annotation List
+            image_data (File): Image and Annotation List, with a hashed
+                split any iterable, it is read once as examples are written
             labels_map (dict): Class/label names
             validation_split (float): Percent to use for validation
             masks (dict): Binary arrays for masking metadata
             strip_metadata (bool): Flag for stripping metadata
+            split_mode (str): How examples are split, one of
+                split.SPLIT_MODES
         """
         QtCore.QThread.__init__(self)
         self.directory = directory
         self.images = images
         self.label_map = label_map
-        self.train_size = int((1.0 - validation_split) * len(self.images))
+        self.validation_split = validation_split
+        # Hashed splits need neither the count nor the order of examples
+        self.train_size = None
+        if split_mode == RANDOM:
+            self.train_size = int((1.0 - validation_split) * len(self.images))
 
-        self.masks = masks
         self.strip_metadata = strip_metadata
+        self.split_mode = split_mode
 
+        # Reduce each mask to the regions it zeroes
+        self.masks = {}
         for mask in masks:
-            m = np.array(masks[mask], dtype='uint8')
-            self.masks[mask] = np.dstack((m, m, m))
+            self.masks[mask] = Regions(masks[mask])
 
         self.labels = []
         for label in label_map:
@@ -103,38 +113,31 @@ class Exporter(QtCore.QThread):
         After creating and instance of the class, calling start() will call
         this function which exports all of the annotaiton examples to disk.
         """
-        random.shuffle(self.images)
+        if self.split_mode == RANDOM:
+            random.shuffle(self.images)
 
         counter = 0
         train_writer = tf.io.TFRecordWriter(
             os.path.join(self.directory, 'training.record'))
         validation_writer = tf.io.TFRecordWriter(
             os.path.join(self.directory, 'validation.record'))
-        for example in self.images:
+        # Read or strip the images in worker processes, the examples are
+        # taken as the workers are ready for them
+        examples, sources = itertools.tee(self.images)
+        tasks = ({'source': os.path.join(example['directory'], example['file_name']),
+                  'destination': None,
+                  'mask_name': example['mask_name'],
+                  'strip': self.strip_metadata} for example in sources)
+        results = pipeline.run(tasks, self.masks)
+        for example, result in zip(examples, results):
             file_name = os.path.join(
                 example['directory'], example['file_name'])
-
-            with tf.io.gfile.GFile(file_name, 'rb') as fid:
-                encoded_jpg = fid.read()
-            encoded_jpg_io = io.BytesIO(encoded_jpg)
-            image = Image.open(encoded_jpg_io)
-            if image.format != 'JPEG':
+            if result['format'] != 'JPEG':
                 raise ValueError('Image format not JPEG')
 
-            if self.strip_metadata:
-                array = np.array(image)
-                if example['mask_name'] in self.masks:
-                    array = array * self.masks[example['mask_name']]
-                img = Image.fromarray(array)
-                buf = io.BytesIO()
-                img.save(buf, format='JPEG')
-                encoded_jpg = buf.getvalue()
-                buf.close()
-                img.close()
-
+            encoded_jpg = result['encoded']
             key = hashlib.sha256(encoded_jpg).hexdigest()
-            size = image.size  # PIL (width, height)
-            image.close()
+            size = result['size']  # PIL (width, height)
 
             xmins = []
             ymins = []
@@ -188,7 +191,13 @@ class Exporter(QtCore.QThread):
             }
             tf_example = tf.train.Example(
                 features=tf.train.Features(feature=feature_dict))
-            if counter <= self.train_size:
+            if self.split_mode == RANDOM:
+                validation = counter > self.train_size
+            else:
+                # Examples stream in any order, the hash decides their set
+                validation = is_validation(example, self.validation_split,
+                                           self.split_mode)
+            if not validation:
                 train_writer.write(tf_example.SerializeToString())
             else:
                 validation_writer.write(tf_example.SerializeToString())
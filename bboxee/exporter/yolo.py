@@ -23,11 +23,12 @@
 #
 # --------------------------------------------------------------------------
 import os
-import random
-import numpy as np
-from shutil import copyfile
-from PIL import Image
 from PyQt5 import QtCore
+from bboxee.mask import Regions
+from bboxee.exporter import pipeline
+from bboxee.exporter.split import RANDOM
+from bboxee.exporter.manifest import ExportManifest, VALIDATION
+from bboxee.exporter.manifest import annotation_hash, image_key, can_export
 
 
 class Exporter(QtCore.QThread):
@@ -42,7 +43,9 @@ class Exporter(QtCore.QThread):
                  label_map,
                  validation_split,
                  masks={},
-                 strip_metadata=False):
+                 strip_metadata=False,
+                 placement=pipeline.COPY,
+                 split_mode=RANDOM):
         """
         Class init function.
 
@@ -53,19 +56,34 @@ class Exporter(QtCore.QThread):
             validation_split (float): Percent to use for validation
             masks (dict): Binary arrays for masking metadata
             strip_metadata (bool): Flag for stripping metadata
+            placement (str): How images that are not stripped are placed,
+                one of pipeline.PLACEMENTS
+            split_mode (str): How examples are split, one of
+                split.SPLIT_MODES
+
+        Raises:
+            ValueError: The directory is not empty and holds no earlier
+                export
         """
         QtCore.QThread.__init__(self)
+        # Files of an unrelated export or anything else would be
+        # overwritten or left mixed in with the new export
+        if not can_export(directory):
+            raise ValueError('{} is not empty and does not hold an earlier '
+                             'export'.format(directory))
         self.directory = directory
         self.images = images
         self.label_map = label_map
-        self.train_size = int((1.0 - validation_split) * len(self.images))
+        self.validation_split = validation_split
 
-        self.masks = masks
         self.strip_metadata = strip_metadata
+        self.placement = placement
+        self.split_mode = split_mode
 
+        # Reduce each mask to the regions it zeroes
+        self.masks = {}
         for mask in masks:
-            m = np.array(masks[mask], dtype='uint8')
-            self.masks[mask] = np.dstack((m, m, m))
+            self.masks[mask] = Regions(masks[mask])
 
         self.labels = []
         for label in label_map:
@@ -81,54 +99,72 @@ class Exporter(QtCore.QThread):
         After creating and instance of the class, calling start() will call
         this function which exports all of the annotaiton examples to disk.
         """
-        random.shuffle(self.images)
-
-        # Create new directories
+        # Create new directories, or update an earlier export
         cfg_path = os.path.join(self.directory, 'cfg')
-        os.makedirs(cfg_path)
+        os.makedirs(cfg_path, exist_ok=True)
 
         image_path = os.path.join(self.directory, 'images')
-        os.makedirs(image_path)
         image_train_path = os.path.join(image_path, 'train')
         image_val_path = os.path.join(image_path, 'valiation')
-        os.makedirs(image_train_path)
-        os.makedirs(image_val_path)
+        os.makedirs(image_train_path, exist_ok=True)
+        os.makedirs(image_val_path, exist_ok=True)
 
         label_path = os.path.join(self.directory, 'labels')
-        os.makedirs(label_path)
         label_train_path = os.path.join(label_path, 'train')
         label_val_path = os.path.join(label_path, 'valiation')
-        os.makedirs(label_train_path)
-        os.makedirs(label_val_path)
+        os.makedirs(label_train_path, exist_ok=True)
+        os.makedirs(label_val_path, exist_ok=True)
+
+        # Examples keep their id and split across exports into the same
+        # directory
+        export = ExportManifest(self.directory)
+        plan = export.update(self.images, self.validation_split,
+                             self.split_mode)
+        export.save()
 
-        img_path = os.path.join(image_train_path, 'train_')
-        label_path = os.path.join(label_train_path, 'train_')
         train = []
         val = []
-        current = train
-        for count, rec in enumerate(self.images):
-            if count > self.train_size:
-                img_path = os.path.join(image_val_path, 'val_')
-                label_path = os.path.join(label_val_path, 'val_')
-                current = val
-            img_file = img_path + '{:010d}.jpg'.format(count)
-            label_file = label_path + '{:010d}.txt'.format(count)
-            current.append(img_file)
-
-            src_file = os.path.join(rec['directory'], rec['file_name'])
-            if self.strip_metadata:
-                img = Image.open(src_file)
-                array = np.array(img)
-                img.close()
-                if rec['mask_name'] in self.masks:
-                    array = array * self.masks[rec['mask_name']]
-                img = Image.fromarray(array)
-                img.save(img_file)
-                img.close()
+        tasks = []
+        placed = []
+        keys = []
+        label_files = []
+        for rec, entry in plan:
+            if entry['split'] == VALIDATION:
+                img_file = os.path.join(image_val_path, 'val_{:010d}.jpg'.format(entry['id']))
+                label_file = os.path.join(label_val_path, 'val_{:010d}.txt'.format(entry['id']))
+                val.append(img_file)
             else:
-                copyfile(src_file, img_file)
-
-            file = open(label_file, 'w')
+                img_file = os.path.join(image_train_path, 'train_{:010d}.jpg'.format(entry['id']))
+                label_file = os.path.join(label_train_path, 'train_{:010d}.txt'.format(entry['id']))
+                train.append(img_file)
+            task = {'source': os.path.join(rec['directory'], rec['file_name']),
+                    'destination': img_file,
+                    'mask_name': rec['mask_name'],
+                    'strip': self.strip_metadata,
+                    'placement': self.placement}
+            placed.append(task)
+            label_files.append(label_file)
+            entry['files'] = [export.relative(img_file), export.relative(label_file)]
+            keys.append(image_key(rec, self.strip_metadata, self.placement))
+            if entry['image'] != keys[-1]:
+                tasks.append(task)
+
+        # Copy or strip new and changed images in worker processes, labels
+        # are written as each image completes
+        results = pipeline.run(tasks, self.masks)
+        extra = {'labels': self.labels, 'label_map': self.label_map}
+        for count, (rec, entry) in enumerate(plan):
+            if entry['image'] != keys[count]:
+                next(results)
+                entry['image'] = keys[count]
+                export.completed()
+            annotations = annotation_hash(rec, extra)
+            if entry['annotations'] == annotations and os.path.exists(label_files[count]):
+                self.progress.emit(count + 1)
+                continue
+            entry['annotations'] = annotations
+
+            file = open(label_files[count], 'w')
             nl = ""
             for a in rec['annotations']:
                 bbox = a['bbox']
@@ -179,4 +215,7 @@ class Exporter(QtCore.QThread):
         file.write('backup=backup/\n')
         file.write('eval=coco\n')
         file.close()
+        if self.placement == pipeline.MANIFEST and not self.strip_metadata:
+            pipeline.write_manifest(self.directory, placed)
+        export.save()
         self.exported.emit()
@@ -24,6 +24,8 @@
 # --------------------------------------------------------------------------
 from PyQt5 import QtWidgets, QtCore, QtGui
 from enum import Enum
+from bboxee.gui.tiled_image_item import TiledImageItem
+from bboxee.spatial_index import GridIndex
 
 
 # where in the bbox?
@@ -55,6 +57,10 @@ MIN_BOX_SIZE = 3
 # width of line forming bounding box
 BOX_LINE_WIDTH = 2
 
+# milliseconds between geometry updates and before a keyboard edit ends
+FRAME_INTERVAL = 16
+EDIT_IDLE_INTERVAL = 250
+
 # Hover: select a box
 # Click+Drag on box: move box
 # Click+Drag on an edge or corner: resize a box
@@ -79,6 +85,7 @@ class AnnotationGraphicsView(QtWidgets.QGraphicsView):
     select_bbox = QtCore.pyqtSignal(QtCore.QPointF)
     delete_event = QtCore.pyqtSignal()
     zoom_event = QtCore.pyqtSignal()
+    edit_finished = QtCore.pyqtSignal()
 
     def __init__(self, parent=None):
         """Class init function."""
@@ -94,12 +101,36 @@ class AnnotationGraphicsView(QtWidgets.QGraphicsView):
         self.setViewportUpdateMode(QtWidgets.QGraphicsView.FullViewportUpdate)
 
         self.img_size = (0, 0)  # width, height
+        # full resolution pixels per displayed image pixel (draft decode)
+        self.image_scale = 1.0
+        self.image_item = None
+        # bbox graphics items by annotation index and the
+        # (geometry, label, color, details) they were last drawn with
         self.bboxes = []
+        self.bbox_state = []
+        # normalized bbox geometry by annotation index for hit testing
+        self.bbox_index = GridIndex()
+        self.pens = {}
+        self.label_font = QtGui.QFont()
         self.graphics_scene = QtWidgets.QGraphicsScene()
         self.setScene(self.graphics_scene)
         # enable mouse move events when not dragging
         self.setMouseTracking(True)
 
+        # Keyboard nudges and resizes are batched into an edit transaction.
+        # The latest geometry is emitted at most once per frame and the
+        # transaction ends when the key is released or the keyboard is idle.
+        self.editing = False
+        self.pending_edit = None
+        self.frame_timer = QtCore.QTimer(self)
+        self.frame_timer.setSingleShot(True)
+        self.frame_timer.setInterval(FRAME_INTERVAL)
+        self.frame_timer.timeout.connect(self.apply_edit)
+        self.idle_timer = QtCore.QTimer(self)
+        self.idle_timer.setSingleShot(True)
+        self.idle_timer.setInterval(EDIT_IDLE_INTERVAL)
+        self.idle_timer.timeout.connect(self.end_edit)
+
     @staticmethod
     def _get_region_and_cursor(point, rect, edge_width):
         """Are we on an edge or corner of a bounding box? Return the right cursor and Region enum."""
@@ -163,13 +194,9 @@ class AnnotationGraphicsView(QtWidgets.QGraphicsView):
         if(bbox is None):
             # nothing selected, see if cursor is inside any box
             # select box when hovering over it
-            for graphic in self.scene().items():
-                if type(graphic) == QtWidgets.QGraphicsRectItem and graphic.sceneBoundingRect().contains(point):
-
-                    # this activates select_bbox in annotation_widget
-                    self.select_bbox.emit(point)
-
-                    break
+            if self.bboxes_at(point):
+                # this activates select_bbox in annotation_widget
+                self.select_bbox.emit(point)
 
         elif (self.mode == Mode.Move):
             # box is selected and Move mode is active
@@ -223,14 +250,9 @@ class AnnotationGraphicsView(QtWidgets.QGraphicsView):
         elif(bbox.sceneBoundingRect().contains(point)):
             # Check to see if we should a different box when overlap occurs
             if not self.sticky_bbox:
-                distance = 10000000.0
-                candidate = None
-                for graphic in self.scene().items():
-                    if type(graphic) == QtWidgets.QGraphicsRectItem and graphic.sceneBoundingRect().contains(point):
-                        line = QtCore.QLineF(point, graphic.sceneBoundingRect().center())
-                        if line.length() < distance:
-                            candidate = graphic
-                            distance = line.length()
+                candidate = self.nearest_bbox(point)
+                if candidate is not None:
+                    candidate = self.bboxes[candidate]
                 if candidate != bbox:
                     self.select_bbox.emit(point)
                     return
@@ -254,6 +276,7 @@ class AnnotationGraphicsView(QtWidgets.QGraphicsView):
 
     def mousePressEvent(self, event):
         """Overload of the mousePressEvent that stores mouse click positions in a list."""
+        self.end_edit()
 
         button = event.button()
         # redirect middle click to shift click
@@ -297,12 +320,8 @@ class AnnotationGraphicsView(QtWidgets.QGraphicsView):
                 self.region = None
                 self.sticky_bbox = False
                 # are we inside another box?
-                for graphic in self.scene().items():
-                    if type(graphic) == QtWidgets.QGraphicsRectItem and graphic.sceneBoundingRect().contains(point):
-
-                        self.sticky_bbox = True
-
-                        break
+                if self.bboxes_at(point):
+                    self.sticky_bbox = True
 
                 # this activates select_bbox in annotation_widget
                 self.select_bbox.emit(point)
@@ -379,6 +398,7 @@ class AnnotationGraphicsView(QtWidgets.QGraphicsView):
                 # do opposite of these
                 self.graphics_scene.removeItem(bbox)
                 self.bboxes.pop()
+                self.bbox_state.pop()
 
                 # just a click on background after sticky?
                 # if(self.sticky_bbox):
@@ -430,80 +450,182 @@ class AnnotationGraphicsView(QtWidgets.QGraphicsView):
         self.fitInView(bounding_rect, QtCore.Qt.KeepAspectRatio)
         self.setSceneRect(bounding_rect)
 
-    def load_image(self, array):
-        self.point = None
-        self.graphics_items = []
-        self.selected_bbox = None
-        self.graphics_scene.clear()
-        self.bboxes = []
-        h, w, c = array.shape
-        self.img_size = (w, h)
-
-        bpl = int(array.nbytes / array.shape[0])
+    @staticmethod
+    def image_to_pixmap(array):
+        """Wrap the array in a QImage, without copying, and upload it."""
+        bpl = array.strides[0]
         if array.shape[2] == 4:
-            self.qt_image = QtGui.QImage(array.data,
-                                         array.shape[1],
-                                         array.shape[0],
-                                         QtGui.QImage.Format_RGBA8888)
+            img_format = QtGui.QImage.Format_RGBA8888
         else:
-            self.qt_image = QtGui.QImage(array.data,
-                                         array.shape[1],
-                                         array.shape[0],
-                                         bpl,
-                                         QtGui.QImage.Format_RGB888)
+            img_format = QtGui.QImage.Format_RGB888
+        image = QtGui.QImage(array.data,
+                             array.shape[1],
+                             array.shape[0],
+                             bpl,
+                             img_format)
+        return QtGui.QPixmap.fromImage(image)
+
+    def is_draft(self):
+        """Is the displayed image a reduced resolution draft that is
+        now being magnified on screen?"""
+        if self.image_item is None or self.image_scale <= 1.0:
+            return False
+        return self.transform().m11() * self.image_scale > 1.0
 
-        self.graphics_scene.addPixmap(QtGui.QPixmap.fromImage(self.qt_image))
+    def load_image(self, array, size=None):
+        """Display an image.
+
+        Args:
+            array (ndarray): (height, width, channels) uint8 array
+            size (tuple): Full resolution (width, height) when the array
+                is a draft, scene coordinates always use the full size
+        """
+        h, w, c = array.shape
+        if size is None:
+            size = (w, h)
+        self.prepare(size)
+        self.set_image(array)
 
         self.resize()
         self.sticky_bbox = False
 
-    def add_bbox(self, rect, annotation, color, display_details=False):
-        brush = QtGui.QBrush(color, QtCore.Qt.SolidPattern)
-        pen = QtGui.QPen(brush, BOX_LINE_WIDTH)
+    def load_tiled_image(self, size, pyramid=None):
+        """Display a very large image from its tile pyramid. The image
+        is drawn blank until set_pyramid() when the pyramid is not built
+        yet.
+
+        Args:
+            size (tuple): Full resolution (width, height)
+            pyramid (TilePyramid): Tile source or None
+        """
+        self.prepare(size)
+        self.remove_image()
+        self.image_item = TiledImageItem(size[0], size[1], pyramid)
+        self.graphics_scene.addItem(self.image_item)
+        self.image_item.setZValue(-1)
+        self.image_scale = 1.0
+
+        self.resize()
+        self.sticky_bbox = False
+
+    def prepare(self, size):
+        """Clear the bboxes and set up the scene for an image of size."""
+        self.point = None
+        self.graphics_items = []
+        self.selected_bbox = None
+        # The scene and the image item are long lived, only the bboxes
+        # are removed and the image is swapped
+        self.remove_bboxes()
+        if size[1] != self.img_size[1]:
+            # scale font size based on image resolution
+            LABEL_FONT_SIZE = 7  # at 640
+            self.label_font = QtGui.QFont()
+            self.label_font.setPointSize(int(LABEL_FONT_SIZE * size[1] / 640))
+        self.img_size = size
+
+    def refine_image(self, array):
+        """Swap the displayed draft for the full resolution image
+        without disturbing the bboxes or the current zoom."""
+        if self.image_item is not None:
+            self.set_image(array)
+
+    def remove_image(self):
+        """Remove the image item from the scene."""
+        if self.image_item is not None:
+            if isinstance(self.image_item, TiledImageItem):
+                self.image_item.release()
+            self.graphics_scene.removeItem(self.image_item)
+            self.image_item = None
+
+    def set_image(self, array):
+        """Create or replace the image item. A draft is stretched over
+        the full resolution scene coordinates."""
+        h, w, c = array.shape
+        if isinstance(self.image_item, QtWidgets.QGraphicsPixmapItem):
+            self.image_item.setPixmap(self.image_to_pixmap(array))
+        else:
+            self.remove_image()
+            self.image_item = self.graphics_scene.addPixmap(
+                self.image_to_pixmap(array))
+            self.image_item.setTransformationMode(
+                QtCore.Qt.SmoothTransformation)
+            # keep the image below the bboxes
+            self.image_item.setZValue(-1)
+
+        scale_x = self.img_size[0] / w
+        scale_y = self.img_size[1] / h
+        self.image_scale = scale_x
+        self.image_item.setTransform(QtGui.QTransform.fromScale(scale_x,
+                                                                scale_y))
+
+    def set_pyramid(self, pyramid):
+        """Draw the displayed tiled image from its finished pyramid."""
+        if isinstance(self.image_item, TiledImageItem):
+            self.image_item.set_pyramid(pyramid)
 
-        graphics_item = self.graphics_scene.addRect(rect, pen)
+    def add_bbox(self, rect, annotation, color, display_details=False):
+        graphics_item = self.graphics_scene.addRect(rect, self.pen(color))
 
         # https://doc.qt.io/qt-5/qt.html#CursorShape-enum
         # graphics_item.setCursor(QtCore.Qt.OpenHandCursor)
 
-        # scale font size based on image resolution
-        height = self.img_size[1]
-        LABEL_FONT_SIZE = 7  # at 640
-        LABEL_FONT_SIZE = int(LABEL_FONT_SIZE * height / 640)
-        # display label at top left
         if display_details and annotation is not None:
-
-            font = QtGui.QFont()
-            font.setPointSize(int(LABEL_FONT_SIZE))
-
-            text = QtWidgets.QGraphicsTextItem(annotation['label'])
-            text.setFont(font)
-            text_color = QtCore.Qt.white if color == QtCore.Qt.red else QtCore.Qt.black
-            text.setDefaultTextColor(text_color)
-
-            # position above bbox top left corner
-            top = rect.top()
-            left = rect.left()
-            width = text.boundingRect().width()
-            height = text.boundingRect().height()  # sceneBoundingRect
-
-            text_background = self.graphics_scene.addRect(left, top - height + 8, width - 4, height - 8, pen, brush)
-            text_background.setParentItem(graphics_item)
-
-            text.setPos(left - 2, top - height + 3)
-            text.setParentItem(text_background)
+            self.set_label(graphics_item, annotation['label'], color)
 
         self.bboxes.append(graphics_item)
+        self.bbox_state.append(None)
 
         return graphics_item
 
+    def pen(self, color):
+        """Cached pen for a bbox color."""
+        if color not in self.pens:
+            brush = QtGui.QBrush(color, QtCore.Qt.SolidPattern)
+            self.pens[color] = QtGui.QPen(brush, BOX_LINE_WIDTH)
+        return self.pens[color]
+
+    def remove_label(self, graphics_item):
+        for child in graphics_item.childItems():
+            self.graphics_scene.removeItem(child)
+
+    def set_label(self, graphics_item, label, color):
+        """Create or update the label displayed above a bbox. The text
+        item is reused so only changed text has to be laid out again."""
+        children = graphics_item.childItems()
+        if children:
+            text_background = children[0]
+            text = text_background.childItems()[0]
+            if text.toPlainText() != label:
+                text.setPlainText(label)
+        else:
+            text_background = QtWidgets.QGraphicsRectItem(graphics_item)
+            text = QtWidgets.QGraphicsTextItem(label, text_background)
+            text.setFont(self.label_font)
+
+        pen = self.pen(color)
+        text_background.setPen(pen)
+        text_background.setBrush(pen.brush())
+        text_color = QtCore.Qt.white if color == QtCore.Qt.red else QtCore.Qt.black
+        text.setDefaultTextColor(text_color)
+
+        # position above bbox top left corner
+        rect = graphics_item.rect()
+        top = rect.top()
+        left = rect.left()
+        width = text.boundingRect().width()
+        height = text.boundingRect().height()  # sceneBoundingRect
+
+        text_background.setPos(0, 0)
+        text_background.setRect(left, top - height + 8, width - 4, height - 8)
+        text.setPos(left - 2, top - height + 3)
+
     def nudge_right(self):
         bbox = self.selected_bbox
         if bbox is None or bbox.sceneBoundingRect().right() >= self.img_size[0]:
             return False
 
         self.selected_bbox.moveBy(1, 0)
-        self.moved.emit(AnnotationGraphicsView.sceneRectTransform(bbox))
+        self.queue_edit(self.moved)
         return True
 
     def nudge_left(self):
@@ -512,7 +634,7 @@ class AnnotationGraphicsView(QtWidgets.QGraphicsView):
             return False
 
         self.selected_bbox.moveBy(-1, 0)
-        self.moved.emit(AnnotationGraphicsView.sceneRectTransform(bbox))
+        self.queue_edit(self.moved)
         return True
 
     def nudge_up(self):
@@ -521,7 +643,7 @@ class AnnotationGraphicsView(QtWidgets.QGraphicsView):
             return False
 
         self.selected_bbox.moveBy(0, -1)
-        self.moved.emit(AnnotationGraphicsView.sceneRectTransform(bbox))
+        self.queue_edit(self.moved)
         return True
 
     def nudge_down(self):
@@ -530,7 +652,7 @@ class AnnotationGraphicsView(QtWidgets.QGraphicsView):
             return False
 
         self.selected_bbox.moveBy(0, 1)
-        self.moved.emit(AnnotationGraphicsView.sceneRectTransform(bbox))
+        self.queue_edit(self.moved)
         return True
 
     def expand_right(self):
@@ -541,7 +663,7 @@ class AnnotationGraphicsView(QtWidgets.QGraphicsView):
         rect = bbox.rect()
         rect.setRight(rect.right() + 1)
         self.selected_bbox.setRect(rect)
-        self.resized.emit(AnnotationGraphicsView.sceneRectTransform(bbox))
+        self.queue_edit(self.resized)
         return True
 
     def shrink_left(self):
@@ -552,7 +674,7 @@ class AnnotationGraphicsView(QtWidgets.QGraphicsView):
         rect = bbox.rect()
         rect.setRight(rect.right() - 1)
         self.selected_bbox.setRect(rect)
-        self.resized.emit(AnnotationGraphicsView.sceneRectTransform(bbox))
+        self.queue_edit(self.resized)
         return True
 
     def expand_up(self):
@@ -565,7 +687,7 @@ class AnnotationGraphicsView(QtWidgets.QGraphicsView):
         self.selected_bbox.setRect(rect)
 
         AnnotationGraphicsView.move_label(bbox, 0, -1)
-        self.resized.emit(AnnotationGraphicsView.sceneRectTransform(bbox))
+        self.queue_edit(self.resized)
         return True
 
     def shrink_down(self):
@@ -577,9 +699,47 @@ class AnnotationGraphicsView(QtWidgets.QGraphicsView):
         rect.setTop(rect.top() + 1)
         self.selected_bbox.setRect(rect)
         AnnotationGraphicsView.move_label(bbox, 0, 1)
-        self.resized.emit(AnnotationGraphicsView.sceneRectTransform(bbox))
+        self.queue_edit(self.resized)
         return True
 
+    def queue_edit(self, signal):
+        """Add a keyboard edit of the selected bbox to the transaction."""
+        self.editing = True
+        self.pending_edit = signal
+        if not self.frame_timer.isActive():
+            self.frame_timer.start()
+        self.idle_timer.start()
+
+    def apply_edit(self):
+        """Emit the latest geometry of the selected bbox and move it in the
+        hit test index."""
+        self.frame_timer.stop()
+        signal = self.pending_edit
+        self.pending_edit = None
+        if signal is not None and self.selected_bbox is not None:
+            rect = AnnotationGraphicsView.sceneRectTransform(self.selected_bbox)
+            if self.img_size[0] > 0 and self.img_size[1] > 0:
+                index = self.bboxes.index(self.selected_bbox)
+                self.bbox_index.insert(index, (rect.left() / self.img_size[0],
+                                               rect.top() / self.img_size[1],
+                                               rect.right() / self.img_size[0],
+                                               rect.bottom() / self.img_size[1]))
+            signal.emit(rect)
+
+    def end_edit(self):
+        """Apply any pending edit and close the transaction."""
+        self.idle_timer.stop()
+        if self.editing:
+            self.apply_edit()
+            self.editing = False
+            self.edit_finished.emit()
+
+    def keyReleaseEvent(self, event):
+        """Overload of the keyReleaseEvent that ends a keyboard edit."""
+        if not event.isAutoRepeat():
+            self.end_edit()
+        QtWidgets.QGraphicsView.keyReleaseEvent(self, event)
+
     def toggle_visibility(self):
 
         self.visible = not self.visible
@@ -587,34 +747,58 @@ class AnnotationGraphicsView(QtWidgets.QGraphicsView):
             for bbox in self.bboxes:
                 bbox.setVisible(self.visible)
 
-    def display_bboxes(self, annotations, selected_row, display_details=False):
+    def bboxes_at(self, point):
+        """Indexes of the displayed bboxes containing a scene point."""
+        if self.img_size[0] == 0 or self.img_size[1] == 0:
+            return []
+        if self.pending_edit is not None:
+            # Hit test against where a nudged bbox is drawn
+            self.apply_edit()
+        return self.bbox_index.query(point.x() / self.img_size[0],
+                                     point.y() / self.img_size[1])
+
+    def nearest_bbox(self, point):
+        """Index of the bbox containing a scene point with the closest
+        center, None when the point is not inside any bbox."""
+        if self.img_size[0] == 0 or self.img_size[1] == 0:
+            return None
+        if self.pending_edit is not None:
+            self.apply_edit()
+        return self.bbox_index.nearest(point.x() / self.img_size[0],
+                                       point.y() / self.img_size[1],
+                                       self.img_size[0],
+                                       self.img_size[1])
+
+    def remove_bboxes(self):
+        for bbox in self.bboxes:
+            self.graphics_scene.removeItem(bbox)
+        self.bboxes = []
+        self.bbox_state = []
+        self.bbox_index.clear()
 
-        if self.bboxes:
-            for bbox in self.bboxes:
-                self.graphics_scene.removeItem(bbox)
-            self.bboxes = []
+    def display_bboxes(self, annotations, selected_row, display_details=False):
+        """Synchronize the bbox items with the annotations. Items are kept
+        by annotation index and only those whose geometry, label, color or
+        detail display changed are updated."""
 
         if(annotations is None):
+            self.remove_bboxes()
             return
 
+        # Drop items for annotations that no longer exist
+        while len(self.bboxes) > len(annotations):
+            self.graphics_scene.removeItem(self.bboxes.pop())
+            self.bbox_state.pop()
+            self.bbox_index.remove(len(self.bboxes))
+
         width = self.img_size[0]
         height = self.img_size[1]
 
         for index, annotation in enumerate(annotations):
 
             bbox = annotation['bbox']
-
-            x = bbox['xmin'] * width
-            y = bbox['ymin'] * height
-
-            top_left = QtCore.QPointF(x, y)
-
-            x = bbox['xmax'] * width
-            y = bbox['ymax'] * height
-
-            bottom_right = QtCore.QPointF(x, y)
-
-            rect = QtCore.QRectF(top_left, bottom_right)
+            geometry = (bbox['xmin'] * width, bbox['ymin'] * height,
+                        bbox['xmax'] * width, bbox['ymax'] * height)
 
             if index == selected_row:
                 color = QtCore.Qt.red
@@ -623,8 +807,35 @@ class AnnotationGraphicsView(QtWidgets.QGraphicsView):
             else:
                 color = QtCore.Qt.yellow
 
-            graphics_item = self.add_bbox(rect, annotation, color, display_details)
-            graphics_item.setVisible(self.visible)
+            state = (geometry, annotation['label'], color, display_details)
+            if index >= len(self.bboxes):
+                rect = QtCore.QRectF(QtCore.QPointF(geometry[0], geometry[1]),
+                                     QtCore.QPointF(geometry[2], geometry[3]))
+                graphics_item = self.add_bbox(rect, annotation, color, display_details)
+                graphics_item.setVisible(self.visible)
+                self.bbox_state[index] = state
+                self.bbox_index.insert(index, (bbox['xmin'], bbox['ymin'], bbox['xmax'], bbox['ymax']))
+            else:
+                graphics_item = self.bboxes[index]
+                old_state = self.bbox_state[index]
+                if old_state != state:
+                    self.update_bbox(graphics_item, geometry, annotation, color, display_details)
+                    self.bbox_state[index] = state
+                    if old_state is None or old_state[0] != geometry:
+                        self.bbox_index.insert(index, (bbox['xmin'], bbox['ymin'], bbox['xmax'], bbox['ymax']))
 
             if index == selected_row:
                 self.selected_bbox = graphics_item
+
+    def update_bbox(self, graphics_item, geometry, annotation, color, display_details):
+        """Update an existing bbox item in place."""
+        rect = QtCore.QRectF(QtCore.QPointF(geometry[0], geometry[1]),
+                             QtCore.QPointF(geometry[2], geometry[3]))
+        # Moves and nudges offset the item position, fold it back into the rect
+        graphics_item.setPos(0, 0)
+        graphics_item.setRect(rect)
+        graphics_item.setPen(self.pen(color))
+        if display_details:
+            self.set_label(graphics_item, annotation['label'], color)
+        else:
+            self.remove_label(graphics_item)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+# Bounding Box Editor and Exporter (BBoxEE)
+# Author: Peter Ersts (ersts@amnh.org)
+#
+# --------------------------------------------------------------------------
+#
+# This file is part of Animal Detection Network's (Andenet)
+# Bounding Box Editor and Exporter (BBoxEE)
+#
+# BBoxEE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BBoxEE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# --------------------------------------------------------------------------
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+LABEL = 0
+DIMENSIONS = 1
+DELETE = 5
+# column -> annotation key for the check box columns
+FLAGS = {2: 'truncated', 3: 'occluded', 4: 'difficult'}
+
+
+class AnnotationTableModel(QtCore.QAbstractTableModel):
+    """Table model over the annotation list of the current image.
+
+    The model edits the annotation dictionaries in place. User edits are
+    reported through the edited signal, programmatic changes to a single
+    annotation are announced with row_changed() so views only repaint
+    that row.
+    """
+
+    edited = QtCore.pyqtSignal(int, int)
+
+    HEADERS = ['Label', 'Dimensions', 'T', 'O', 'D', '']
+    TOOLTIPS = ['', '', 'Truncated', 'Occluded', 'Difficult', '']
+
+    def __init__(self, parent=None):
+        """Class init function."""
+        QtCore.QAbstractTableModel.__init__(self, parent)
+        self.annotations = []
+        self.img_size = (0, 0)
+
+    def append(self, annotation):
+        """Append an annotation to the list and the table."""
+        row = len(self.annotations)
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        self.annotations.append(annotation)
+        self.endInsertRows()
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.HEADERS)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        annotation = self.annotations[index.row()]
+        column = index.column()
+        if column == LABEL:
+            if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+                return annotation['label']
+        elif column == DIMENSIONS:
+            if role == QtCore.Qt.DisplayRole:
+                bbox = annotation['bbox']
+                width = int((bbox['xmax'] - bbox['xmin']) * self.img_size[0])
+                height = int((bbox['ymax'] - bbox['ymin']) * self.img_size[1])
+                return "{:d} x {:d}".format(width, height)
+        elif column in FLAGS:
+            if role == QtCore.Qt.CheckStateRole:
+                if annotation[FLAGS[column]] == 'Y':
+                    return QtCore.Qt.Checked
+                return QtCore.Qt.Unchecked
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return QtCore.Qt.NoItemFlags
+        flags = QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+        if index.column() == LABEL:
+            flags |= QtCore.Qt.ItemIsEditable
+        elif index.column() in FLAGS:
+            flags |= QtCore.Qt.ItemIsUserCheckable
+        return flags
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal:
+            if role == QtCore.Qt.DisplayRole:
+                return self.HEADERS[section]
+            if role == QtCore.Qt.ToolTipRole and self.TOOLTIPS[section]:
+                return self.TOOLTIPS[section]
+        elif role == QtCore.Qt.DisplayRole:
+            return section + 1
+        return None
+
+    def remove(self, row):
+        """Remove an annotation from the list and the table."""
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        del self.annotations[row]
+        self.endRemoveRows()
+
+    def row_changed(self, row):
+        """Announce that the annotation in row was modified."""
+        if row >= 0 and row < len(self.annotations):
+            self.dataChanged.emit(self.index(row, 0),
+                                  self.index(row, len(self.HEADERS) - 1))
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.annotations)
+
+    def set_annotations(self, annotations, img_size=None):
+        """Display a new annotation list, the list is edited in place."""
+        self.beginResetModel()
+        self.annotations = annotations
+        if img_size is not None:
+            self.img_size = img_size
+        self.endResetModel()
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if not index.isValid():
+            return False
+        annotation = self.annotations[index.row()]
+        column = index.column()
+        if column == LABEL and role == QtCore.Qt.EditRole:
+            if annotation['label'] == value:
+                return False
+            annotation['label'] = value
+        elif column in FLAGS and role == QtCore.Qt.CheckStateRole:
+            checked = value == QtCore.Qt.Checked
+            annotation[FLAGS[column]] = "Y" if checked else "N"
+        else:
+            return False
+        self.dataChanged.emit(index, index, [role])
+        self.edited.emit(index.row(), column)
+        return True
+
+
+class LabelDelegate(QtWidgets.QStyledItemDelegate):
+    """Draws the label cell as a combo box and edits it with a combo box
+    that shares a single label model across all rows."""
+
+    def __init__(self, label_model, parent=None):
+        """Class init function."""
+        QtWidgets.QStyledItemDelegate.__init__(self, parent)
+        self.label_model = label_model
+
+    def createEditor(self, parent, option, index):
+        editor = QtWidgets.QComboBox(parent)
+        editor.setModel(self.label_model)
+        # Commit as soon as a label is picked, like the old cell widgets
+        editor.activated.connect(lambda: self.commitData.emit(editor))
+        return editor
+
+    def paint(self, painter, option, index):
+        combo = QtWidgets.QStyleOptionComboBox()
+        combo.rect = option.rect
+        combo.state = option.state | QtWidgets.QStyle.State_Enabled
+        combo.currentText = index.data()
+        style = QtWidgets.QApplication.style()
+        style.drawComplexControl(QtWidgets.QStyle.CC_ComboBox, combo, painter)
+        style.drawControl(QtWidgets.QStyle.CE_ComboBoxLabel, combo, painter)
+
+    def setEditorData(self, editor, index):
+        row = editor.findText(index.data(), QtCore.Qt.MatchFixedString)
+        editor.setCurrentIndex(row if row >= 0 else 0)
+        editor.showPopup()
+
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.currentText())
+
+
+class DeleteDelegate(QtWidgets.QStyledItemDelegate):
+    """Draws a delete button in each row, clicks are handled by the view."""
+
+    def __init__(self, parent=None):
+        """Class init function."""
+        QtWidgets.QStyledItemDelegate.__init__(self, parent)
+        self.icon = QtGui.QIcon(':/icons/delete.svg')
+
+    def paint(self, painter, option, index):
+        button = QtWidgets.QStyleOptionButton()
+        button.rect = option.rect
+        button.state = QtWidgets.QStyle.State_Enabled | QtWidgets.QStyle.State_Raised
+        button.icon = self.icon
+        button.iconSize = QtCore.QSize(24, 24)
+        style = QtWidgets.QApplication.style()
+        style.drawControl(QtWidgets.QStyle.CE_PushButton, button, painter)
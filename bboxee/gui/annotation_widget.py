@@ -24,21 +24,105 @@
 # --------------------------------------------------------------------------
 import os
 import sys
-import glob
+import copy
+import time
 import json
+import bisect
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from PIL import Image
 from PyQt5 import QtCore, QtGui, QtWidgets, uic
+from bboxee import bbx
 from bboxee import schema
+from bboxee import mask
+from bboxee import tile_pyramid
+from bboxee.image_loader import ImageLoader, TILE_THRESHOLD
+from bboxee.thumbnail_cache import ThumbnailCache
+from bboxee.image_metadata import MetadataIndex, read as read_metadata
+from bboxee.journal import Journal, Compactor, recover
 from bboxee.gui import AnnotationAssistant
 from bboxee.gui import AnnotatorDialog
 from bboxee.gui import AnalystDialog
+from bboxee.gui.annotation_table_model import AnnotationTableModel
+from bboxee.gui.annotation_table_model import LabelDelegate
+from bboxee.gui.annotation_table_model import DeleteDelegate
+from bboxee.gui.annotation_table_model import LABEL, DELETE
+from bboxee.gui.filmstrip import ThumbnailModel, ThumbnailDelegate
+from bboxee.gui.filmstrip import insertion_runs
+from bboxee.gui.tiled_image_item import PyramidBuilder
 
 if getattr(sys, 'frozen', False):
     bundle_dir = sys._MEIPASS
 else:
     bundle_dir = os.path.dirname(__file__)
 WIDGET, _ = uic.loadUiType(os.path.join(bundle_dir, 'annotation_widget.ui'))
+IMAGE_FORMATS = ['.jpg', '.jpeg', '.png']
+# milliseconds between journal flushes
+JOURNAL_INTERVAL = 1000
+BBX_FILTER = 'BBoxEE (*.bbx)'
+LINES_FILTER = 'BBoxEE JSON Lines (*.bbx)'
+
+
+class DirectoryScanner(QtCore.QThread):
+    """Threaded worker that streams the image file names of a directory
+    in batches so the first image can be displayed before a large or
+    remote directory has been fully listed."""
+
+    found = QtCore.pyqtSignal(int, list)
+    scanned = QtCore.pyqtSignal(int)
+
+    def __init__(self, interval=0.25):
+        """Class init function.
+
+        Args:
+            interval (float): Seconds between batches
+        """
+        QtCore.QThread.__init__(self)
+        self.directory = ''
+        self.interval = interval
+        self.scan_id = 0
+        self.stopped = False
+
+    def run(self):
+        """The starting point for the thread."""
+        scan_id = self.scan_id
+        batch = []
+        last = None
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if self.stopped:
+                        return
+                    # Match glob('*'), hidden files are skipped
+                    if entry.name.startswith('.'):
+                        continue
+                    if os.path.splitext(entry.name)[1].lower() in IMAGE_FORMATS:
+                        batch.append(entry.name)
+                        # Send the very first image right away
+                        if last is None or time.time() - last > self.interval:
+                            self.found.emit(scan_id, batch)
+                            batch = []
+                            last = time.time()
+        except OSError:
+            pass
+        if batch:
+            self.found.emit(scan_id, batch)
+        self.scanned.emit(scan_id)
+
+    def scan(self, directory):
+        """Stop any scan in progress and start scanning directory."""
+        self.stop()
+        self.directory = directory
+        self.scan_id += 1
+        self.stopped = False
+        self.start()
+
+    def stop(self):
+        if self.isRunning():
+            self.stopped = True
+            self.wait()
+
+
 # TODO: Break this class / widget up into multiple widgets / components.
 
 
@@ -55,10 +139,54 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
         self.selected_row = -1
         self.current_image = 1
         self.image_list = []
+        # sorted positions of the images that have annotations
+        self.annotated = []
         self.mask = None
         self.data = None
         self.labels = None
         self.dirty = False
+        self.image_loader = ImageLoader()
+        self.pyramid_builder = PyramidBuilder()
+        self.pyramid_builder.finished.connect(self.pyramid_built)
+        self.pyramid_builder.failed.connect(self.pyramid_failed)
+        self.scanner = DirectoryScanner()
+        self.scanner.found.connect(self.images_found)
+        self.scanner.scanned.connect(self.scan_complete)
+        self.scanning = False
+
+        self.annotation_file = ''
+        self.lines_format = False
+        self.journal = Journal()
+        self.compactor = Compactor()
+        self.compactor.failed.connect(self.compaction_failed)
+        self.compactor.finished.connect(self.compaction_complete)
+        self.compact_pending = False
+        self.saver = bbx.Saver()
+        self.saver.finished.connect(self.save_complete)
+        self.save_pending = False
+        self.save_source = None
+        self.journal_timer = QtCore.QTimer(self)
+        self.journal_timer.setInterval(JOURNAL_INTERVAL)
+        self.journal_timer.timeout.connect(self.flush_journal)
+        self.journal_timer.start()
+        self.progressive = True
+        # New and opened files are written with bit packed masks
+        self.packed_masks = False
+
+        cache_dir = QtCore.QStandardPaths.writableLocation(
+            QtCore.QStandardPaths.GenericCacheLocation)
+        cache = ThumbnailCache(os.path.join(cache_dir, 'bboxee', 'thumbnails'))
+        # Header metadata of the image directory, filled in the background
+        # once the directory scan completes
+        self.metadata = None
+        self.metadata_executor = ThreadPoolExecutor(max_workers=1)
+        self.thumbnail_model = ThumbnailModel(cache, parent=self)
+        self.thumbnail_delegate = ThumbnailDelegate(cache.size, self.filmstrip)
+        self.filmstrip.setModel(self.thumbnail_model)
+        self.filmstrip.setItemDelegate(self.thumbnail_delegate)
+        scroll_bar = self.style().pixelMetric(QtWidgets.QStyle.PM_ScrollBarExtent)
+        self.filmstrip.setFixedWidth(cache.size + 4 * self.filmstrip.frameWidth() + scroll_bar + 8)
+        self.filmstrip.clicked.connect(self.filmstrip_clicked)
         self.assistant = AnnotationAssistant(self)
         self.assistant.submitted.connect(self.update_annotation)
         self.qt_image = None
@@ -70,8 +198,10 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
         self.graphicsView.created.connect(self.bbox_created)
         self.graphicsView.resized.connect(self.update_bbox)
         self.graphicsView.moved.connect(self.update_bbox)
+        self.graphicsView.edit_finished.connect(self.edit_finished)
         self.graphicsView.select_bbox.connect(self.select_bbox)
         self.graphicsView.delete_event.connect(self.delete_selected_row)
+        self.graphicsView.zoom_event.connect(self.refine_image)
 
         self.pb_directory.clicked.connect(self.load_from_directory)
         self.pb_directory.setIconSize(QtCore.QSize(icon_size, icon_size))
@@ -123,10 +253,19 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
         self.pb_save.clicked.connect(self.save)
         self.pb_mask.clicked.connect(self.select_mask)
         self.lineEditCurrentImage.editingFinished.connect(self.jump_to_image)
-        self.tw_labels.selectionModel().selectionChanged.connect(self.selection_changed)
-        self.tw_labels.cellChanged.connect(self.cell_changed)
         self.checkBoxDisplayAnnotationData.clicked.connect(self.display_bboxes)
 
+        self.annotation_model = AnnotationTableModel(self)
+        self.annotation_model.edited.connect(self.cell_changed)
+        self.label_model = QtCore.QStringListModel(self)
+        self.tw_labels.setModel(self.annotation_model)
+        self.tw_labels.setItemDelegateForColumn(LABEL, LabelDelegate(self.label_model, self))
+        self.tw_labels.setItemDelegateForColumn(DELETE, DeleteDelegate(self))
+        self.tw_labels.setEditTriggers(QtWidgets.QAbstractItemView.SelectedClicked |
+                                       QtWidgets.QAbstractItemView.DoubleClicked)
+        self.tw_labels.clicked.connect(self.table_clicked)
+        self.tw_labels.selectionModel().selectionChanged.connect(self.selection_changed)
+
         (self.tw_labels.
          setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows))
         (self.tw_labels.
@@ -243,10 +382,12 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
             last_index = len(self.data['analysts']) - 1
             if name not in self.data['analysts']:
                 self.data['analysts'].append(name)
+                self.journal.touch('analysts')
                 self.set_dirty(True)
             # Ignore add request of name is the same as the last entry
             elif self.data['analysts'][last_index] != name:
                 self.data['analysts'].append(name)
+                self.journal.touch('analysts')
                 self.set_dirty(True)
             self.display_analysts()
 
@@ -276,7 +417,11 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
         """(SLOT) Automatic annotation complete, reenable gui and
         reset current image to 1."""
         self.data = data
+        for image in self.data['images']:
+            self.journal.touch_image(image)
+        self.index_annotated()
         self.display_analysts()
+        self.journal.touch('analysts')
         self.current_image = 0
         self.next_image()
         self.license.setEnabled(True)
@@ -294,6 +439,8 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
             self.current_image = 0
         self.progressBar.setValue(progress)
         self.data['images'][image] = annotations
+        self.journal.touch_image(image)
+        self.mark_annotated(image, len(annotations['annotations']) > 0)
         self.next_image()
 
     def annotator_selected(self, annotator):
@@ -301,17 +448,22 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
         self.annotator = annotator
         self.annotator.progress.connect(self.annotation_progress)
         self.annotator.finished.connect(self.annotation_complete)
-        self.pb_annotate.setEnabled(True)
+        self.pb_annotate.setEnabled(not self.scanning)
 
     def apply_license(self, license):
+        """(Slot) Apply a license to every image with annotations."""
         if self.data is not None:
-            for image in self.data['images']:
-                if ('annotations' in self.data['images'][image] and
-                        self.data['images'][image]['annotations']):
-                    rec = self.combodata['images'][image]
+            # Entries are edited in place, they must not be shared with
+            # a snapshot being saved
+            self.finish_saving()
+            images = self.data['images']
+            for image in list(images):
+                if bbx.annotation_count(images, image) > 0:
+                    rec = images[image]
                     rec['attribution'] = license['attribution']
                     rec['license'] = license['license']
                     rec['license_url'] = license['license_url']
+                    self.journal.touch_image(image)
                     self.set_dirty(True)
 
     def bbox_created(self, rect, show_assistant=True, meta=None):
@@ -321,7 +473,7 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
             if self.current_file_name not in self.data['images']:
                 template = schema.annotation_file_entry()
                 self.data['images'][self.current_file_name] = template
-            rec = self.data['images'][self.current_file_name]
+                self.annotation_model.set_annotations(template['annotations'])
             metadata = schema.annotation()
             metadata['created_by'] = 'human'
             metadata['bbox']['xmin'] = rect.left() / self.graphicsView.img_size[0]
@@ -334,9 +486,9 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
                 metadata['truncated'] = meta['truncated']
                 metadata['occluded'] = meta['occluded']
                 metadata['difficult'] = meta['difficult']
-            rec['annotations'].append(metadata)
-            self.display_annotation_data()
-            self.selected_row = self.tw_labels.rowCount() - 1
+            self.annotation_model.append(metadata)
+            self.mark_annotated(self.current_file_name, True)
+            self.selected_row = self.annotation_model.rowCount() - 1
             self.tw_labels.selectRow(self.selected_row)
 
             self.license.request()
@@ -345,56 +497,65 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
             self.assistant.show()
 
     def cell_changed(self, row, column):
-        """(Slot) Update annotation data on change."""
-        table = self.tw_labels
-        # get text
-        header = table.horizontalHeaderItem(column).text().lower()
-        if column == 0:
-            text = table.cellWidget(row, 0).currentText()
-        elif header in ('o', 't', 'd'):
-            checked = table.item(row, column).checkState() == QtCore.Qt.Checked
-            text = "Y" if checked else "N"
-            mapping = {'o': 'occluded', 't': 'truncated', 'd': 'difficult'}
-            header = mapping[header]
-        else:
-            print("Got unexpected header: {}".format(header))
-
-        # update annotations
-        rec = self.data['images'][self.current_file_name]
-        rec['annotations'][row][header] = text
+        """(Slot) Annotation data was edited in the table."""
         self.set_dirty(True)
-        if column == 0:
+        if column == LABEL:
             self.display_bboxes()
 
     def clear_annotations(self):
         """(SLOT) Clear all annotations for the current image."""
+        self.graphicsView.end_edit()
         self.tw_labels.selectionModel().blockSignals(True)
-        self.tw_labels.setRowCount(0)
+        self.annotation_model.set_annotations([])
         self.tw_labels.selectionModel().blockSignals(False)
         self.tw_labels.clearSelection()
         if (self.data is not None and
                 self.current_file_name in self.data['images']):
             del self.data['images'][self.current_file_name]
+            self.mark_annotated(self.current_file_name, False)
         self.display_bboxes()
         self.set_dirty(True)
 
-    def delete_click_handler(self):
-        """(SLOT) Handle delete button click."""
-        # Get button that was clicked
-        button = self.sender()
-        # Find location in table
-        row = self.tw_labels.indexAt(button.pos()).row()
-        # Select row and call delete
-        self.tw_labels.selectRow(row)
-        self.delete_selected_row()
+    def close_journal(self):
+        """Wait for saving to finish and close the journal. Edits the
+        user chose not to save are dropped."""
+        self.finish_saving()
+        if self.dirty:
+            self.journal.discard()
+        else:
+            self.journal.close()
+        self.close_data()
+
+    def close_data(self):
+        """Release the annotation file lazily read image entries come
+        from, a file that is open can not be replaced on Windows."""
+        if self.data is not None and isinstance(self.data['images'],
+                                                bbx.LazyImages):
+            self.data['images'].close()
+
+    def compaction_complete(self):
+        """(Slot) The compactor thread finished."""
+        self.compact_pending = False
+        self.display_saving()
+
+    def compaction_failed(self, error):
+        """(Slot) Saved edits could not be written to the annotation file,
+        they stay in the journal and are retried on the next save."""
+        QtWidgets.QMessageBox.warning(self.parent(),
+                                      'ERROR',
+                                      'Unable to update {}\n{}'.format(
+                                          self.compactor.annotation_file,
+                                          error),
+                                      QtWidgets.QMessageBox.Ok)
 
     def delete_row(self, row, column=None):
         """Delete row from table and associated metadata."""
+        self.graphicsView.end_edit()
         self.tw_labels.selectionModel().blockSignals(True)
-        self.tw_labels.removeRow(row)
-        del self.data['images'][self.current_file_name]['annotations'][row]
-        if self.tw_labels.rowCount() == 0:
+        self.annotation_model.remove(row)
+        if self.annotation_model.rowCount() == 0:
             del self.data['images'][self.current_file_name]
+            self.mark_annotated(self.current_file_name, False)
         self.tw_labels.selectionModel().blockSignals(False)
         self.tw_labels.clearSelection()
         self.display_bboxes()
@@ -408,7 +569,7 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
         next_row = self.selected_row
 
         # last row selected?
-        if(next_row == self.tw_labels.rowCount() - 1):
+        if(next_row == self.annotation_model.rowCount() - 1):
             # next selection will be previous row
             next_row -= 1
 
@@ -451,56 +612,31 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
     def display_annotation_data(self):
         """Display annotation data in table."""
         self.tw_labels.selectionModel().blockSignals(True)
-        self.tw_labels.setRowCount(0)
-        self.tw_labels.blockSignals(True)
+        annotations = []
         if self.current_file_name in self.data['images']:
-            rec = self.data['images'][self.current_file_name]
-            rows = len(rec['annotations'])
-            self.tw_labels.setRowCount(rows)
-            for row, annotation in enumerate(rec['annotations']):
-
-                text = annotation['label']
-                combo = QtWidgets.QComboBox()
-                combo.addItems(self.labels)
-                index = combo.findText(text, QtCore.Qt.MatchFixedString)
-                if index >= 0:
-                    combo.setCurrentIndex(index)
-                else:
-                    combo.setCurrentIndex(0)
-
-                combo.currentIndexChanged.connect(self.label_change_handler)
-                self.tw_labels.setCellWidget(row, 0, combo)
-
-                width = int((annotation['bbox']['xmax'] - annotation['bbox']['xmin']) * self.graphicsView.img_size[0])
-                height = int((annotation['bbox']['ymax'] - annotation['bbox']['ymin']) * self.graphicsView.img_size[1])
-                item = QtWidgets.QTableWidgetItem("{:d} x {:d}".format(width, height))
-                self.tw_labels.setItem(row, 1, item)
-
-                item = QtWidgets.QTableWidgetItem()
-                item.setFlags(QtCore.Qt.ItemIsUserCheckable | QtCore.Qt.ItemIsEnabled)
-                item.setCheckState(QtCore.Qt.Checked if annotation['truncated'] == "Y" else QtCore.Qt.Unchecked)
-                self.tw_labels.setItem(row, 2, item)
-
-                item = QtWidgets.QTableWidgetItem()
-                item.setFlags(QtCore.Qt.ItemIsUserCheckable | QtCore.Qt.ItemIsEnabled)
-                item.setCheckState(QtCore.Qt.Checked if annotation['occluded'] == "Y" else QtCore.Qt.Unchecked)
-                self.tw_labels.setItem(row, 3, item)
-
-                item = QtWidgets.QTableWidgetItem()
-                item.setFlags(QtCore.Qt.ItemIsUserCheckable | QtCore.Qt.ItemIsEnabled)
-                item.setCheckState(QtCore.Qt.Checked if annotation['difficult'] == "Y" else QtCore.Qt.Unchecked)
-                self.tw_labels.setItem(row, 4, item)
-
-                delete = QtWidgets.QPushButton()
-                delete.setIconSize(QtCore.QSize(24, 24))
-                delete.setIcon(QtGui.QIcon(':/icons/delete.svg'))
-                delete.clicked.connect(self.delete_click_handler)
-                self.tw_labels.setCellWidget(row, 5, delete)
-
-        self.tw_labels.blockSignals(False)
+            annotations = self.data['images'][self.current_file_name]['annotations']
+        self.annotation_model.set_annotations(annotations,
+                                              self.graphicsView.img_size)
         self.tw_labels.selectionModel().blockSignals(False)
         self.tw_labels.selectRow(self.selected_row)
 
+    def display_image_count(self):
+        template = 'of {}{} ({} annotated)'
+        more = '+' if self.scanning else ''
+        self.labelImages.setText(template.format(len(self.image_list),
+                                                 more,
+                                                 len(self.annotated)))
+
+    def display_saving(self):
+        """Show a busy progress bar while annotations are written."""
+        if self.save_pending or self.compact_pending:
+            self.progressBar.setRange(0, 0)
+            self.progressBar.setFormat('Saving...')
+        else:
+            self.progressBar.setRange(0, 100)
+            self.progressBar.setValue(0)
+            self.progressBar.setFormat('%p%')
+
     def display_bboxes(self):
         """Display bboxes in graphics scene."""
 
@@ -513,6 +649,15 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
 
         # forward to graphicsView
         self.graphicsView.display_bboxes(annotations, self.selected_row, self.checkBoxDisplayAnnotationData.isChecked())
+        self.thumbnail_model.refresh(self.current_file_name)
+
+    def display_filmstrip(self):
+        """Show the image list in the filmstrip and select the current image."""
+        images = {} if self.data is None else self.data['images']
+        self.thumbnail_model.set_images(self.image_directory,
+                                        self.image_list,
+                                        images)
+        self.select_thumbnail()
 
     def display_license(self):
         lic = {'license': '', 'license_url': '', 'attribution': ''}
@@ -524,9 +669,23 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
             lic['attribution'] = rec['attribution']
         self.license.display_license(lic)
 
+    def draft_size(self):
+        """Size of the graphics view in device pixels, used to decode a
+        reduced resolution draft. None when progressive mode is off or the
+        view is collapsed."""
+        if not self.progressive:
+            return None
+        viewport = self.graphicsView.viewport()
+        ratio = viewport.devicePixelRatioF()
+        size = (int(viewport.width() * ratio), int(viewport.height() * ratio))
+        if size[0] < 1 or size[1] < 1:
+            return None
+        return size
+
     def duplicate_selected_row(self):
         if self.selected_row is None or self.selected_row < 0:
             return
+        self.graphicsView.end_edit()
 
         self.selected_row
         # get metadata
@@ -549,6 +708,12 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
 
         self.bbox_created(rect, show_assistant=False, meta=metadata)
 
+    def edit_finished(self):
+        """(Slot) Refresh the table and scene after a keyboard edit."""
+        if self.selected_row >= 0:
+            self.annotation_model.row_changed(self.selected_row)
+        self.display_bboxes()
+
     def enableButtons(self):
         """Enable UI for interacting with the image and annotations"""
         self.pb_zoom_in.setEnabled(True)
@@ -572,14 +737,71 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
         except ValueError:
             self.lineEditCurrentImage.setText(str(self.current_image))
 
-    def label_change_handler(self):
-        """(SLOT) Handle index change from lable combobox."""
-        # Get combobox that changed
-        cbox = self.sender()
-        # Find location in table
-        row = self.tw_labels.indexAt(cbox.pos()).row()
-        # Select row and call delete
-        self.cell_changed(row, 0)
+    def filmstrip_clicked(self, index):
+        """(Slot) Load the image of the thumbnail that was clicked."""
+        self.current_image = index.row() + 1
+        self.load_image()
+
+    def finish_saving(self):
+        """Wait for background saving to finish."""
+        self.compactor.wait()
+        self.saver.wait()
+        self.save_complete()
+
+    def flush_journal(self):
+        """(Slot) Write pending edits to the journal."""
+        if self.journal.pending():
+            self.journal.flush(self.data)
+
+    def images_found(self, scan_id, names):
+        """(Slot) Merge a batch of file names from the directory scanner
+        into the sorted image list."""
+        if scan_id != self.scanner.scan_id:
+            return
+        first = len(self.image_list) == 0
+        names = sorted(names)
+        # Annotated positions shift by the names inserted before them
+        self.annotated = [p + bisect.bisect_left(names, self.image_list[p])
+                          for p in self.annotated]
+        runs = insertion_runs(self.image_list, names)
+        for index, run in reversed(runs):
+            self.image_list[index:index] = run
+        self.thumbnail_model.insert_images(runs)
+        if self.data is not None:
+            for image_name in names:
+                if bbx.annotation_count(self.data['images'], image_name) > 0:
+                    bisect.insort(self.annotated, self.image_position(image_name))
+        if first:
+            self.current_image = 1
+        else:
+            # Keep the displayed image, its position may have shifted
+            position = bisect.bisect_left(self.image_list,
+                                          self.current_file_name)
+            self.current_image = position + 1
+        self.display_image_count()
+        self.lineEditCurrentImage.setText(str(self.current_image))
+        if first:
+            self.load_image()
+
+    def image_position(self, image_name):
+        """Zero based position of an image in the sorted image list, None
+        if it is not listed."""
+        position = bisect.bisect_left(self.image_list, image_name)
+        if (position < len(self.image_list) and
+                self.image_list[position] == image_name):
+            return position
+        return None
+
+    def index_annotated(self):
+        """Rebuild the sorted list of annotated image positions used for
+        navigation."""
+        self.annotated = []
+        for position, image_name in enumerate(self.image_list):
+            if (self.data is not None and
+                    bbx.annotation_count(self.data['images'], image_name) > 0):
+                self.annotated.append(position)
+        self.display_image_count()
+        self.display_filmstrip()
 
     def load_config(self, directory):
         dir_name = directory
@@ -597,7 +819,16 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
                         if 'N/A' not in self.labels:
                             self.labels = ['N/A'] + self.labels
                         self.assistant.set_labels(self.labels)
+                        self.label_model.setStringList(self.labels)
                         self.license.set_licenses(config['license'])
+                        if 'progressive_decode' in config:
+                            self.progressive = config['progressive_decode']
+                        if 'packed_masks' in config:
+                            self.packed_masks = config['packed_masks']
+                        if 'frame_cache_mb' in config:
+                            budget = int(config['frame_cache_mb'])
+                            cache = self.image_loader.cache
+                            cache.set_budget(budget * 1024 * 1024)
                         break
                 except json.decoder.JSONDecodeError as error:
                     f.close()
@@ -631,9 +862,17 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
                                               'Select Directory',
                                               self.image_directory))
             if directory != '':
+                self.finish_saving()
+                self.journal.discard()
+                self.annotation_file = ''
+                self.lines_format = False
                 self.load_config(directory)
                 self.image_directory = directory
-                self.data = schema.annotation_file()
+                self.close_data()
+                version = schema.LEGACY_FILE_SCHEMA
+                if self.packed_masks:
+                    version = schema.ANNOTATION_FILE_SCHEMA
+                self.data = schema.annotation_file(version)
                 self.populate_labels()
                 self.mask = None
                 self.load_image_list()
@@ -652,21 +891,38 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
                                          self.image_directory,
                                          'BBoxEE (*.bbx)'))
             if file_name[0] != '':
-                file = open(file_name[0], 'r')
-                self.data = json.load(file)
-                file.close()
+                self.finish_saving()
+                self.journal.discard()
+                self.lines_format = bbx.is_lines(file_name[0])
+                self.close_data()
+                self.data = bbx.load(file_name[0], lazy=True)
+                saved, unsaved = recover(self.data, file_name[0])
+                self.annotation_file = file_name[0]
+                self.journal.open(self.annotation_file)
                 self.image_directory = os.path.split(file_name[0])[0]
                 self.load_config(self.image_directory)
+                if (self.packed_masks and
+                        schema.upgrade_annotation_file(self.data)):
+                    # Written with the next save, journaled so that
+                    # compaction does not mix the versions
+                    self.journal.touch('schema')
+                    self.journal.touch('mask')
 
                 self.populate_labels()
                 if self.data['mask'] is not None:
-                    tmp = np.array(self.data['mask'], dtype='uint8')
-                    self.mask = np.dstack((tmp, tmp, tmp))
+                    self.mask = mask.Regions(mask.decode(self.data['mask']))
                 else:
                     self.mask = None
                 self.display_analysts()
                 self.load_image_list()
-                self.set_dirty(False)
+                self.set_dirty(unsaved > 0)
+                if unsaved > 0:
+                    message = ('Recovered {} unsaved edits from the '
+                               'journal.'.format(unsaved))
+                    QtWidgets.QMessageBox.information(self.parent(),
+                                                      'Recovered',
+                                                      message,
+                                                      QtWidgets.QMessageBox.Ok)
                 self.pb_annotater.setEnabled(True)
                 self.pb_mask.setEnabled(True)
                 self.label_image_directory.setText(self.image_directory)
@@ -674,54 +930,115 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
     def load_image(self):
         """Load image into graphics scene."""
         if len(self.image_list) > 0:
+            self.graphicsView.end_edit()
 
             self.selected_row = -1
             self.current_file_name = self.image_list[self.current_image - 1]
             filename = os.path.join(self.image_directory, self.current_file_name)
-
-            img = Image.open(filename).convert("RGB")
-            array = np.array(img)
-            img.close()
-
-            if self.mask is not None:
-                array = array * self.mask
-
-            self.graphicsView.load_image(array)
-            array = None
+            if self.save_pending and self.current_file_name in self.data['images']:
+                # Edits happen in place, keep them out of the snapshot
+                # being saved
+                entry = self.data['images'][self.current_file_name]
+                self.data['images'][self.current_file_name] = copy.deepcopy(entry)
+
+            size = self.draft_size()
+            full_size = self.image_size(self.current_file_name)
+            if full_size is not None and max(full_size) > TILE_THRESHOLD:
+                self.load_tiled_image(filename, full_size)
+            else:
+                regions, mask_name = self.image_mask(self.current_file_name)
+                array, full_size = self.image_loader.load(filename,
+                                                          regions,
+                                                          mask_name,
+                                                          size)
+                self.graphicsView.load_image(array, full_size)
+                array = None
+            self.image_loader.read_ahead(self.image_directory,
+                                         self.image_list,
+                                         self.current_image - 1,
+                                         self.image_mask,
+                                         size)
+            self.refine_image()
 
             self.enableButtons()
             self.display_bboxes()
             self.display_annotation_data()
+            self.select_thumbnail()
             self.graphicsView.setFocus()
             self.display_license()
 
+    def image_mask(self, file_name):
+        """The mask and its name if the mask matches the dimensions of an
+        image, (None, '') otherwise.
+
+        Args:
+            file_name (str): Image name in the image directory
+        """
+        if self.mask is None:
+            return (None, '')
+        size = self.image_size(file_name)
+        if size is None or self.mask.shape[:2] != (size[1], size[0]):
+            return (None, '')
+        return (self.mask, self.data['mask_name'])
+
+    def image_size(self, file_name):
+        """Image (width, height) read from its header, through the metadata
+        index when the directory has one. None if it can not be read."""
+        info = None
+        if self.metadata is not None:
+            info = self.metadata.get(file_name)
+        else:
+            info = read_metadata(os.path.join(self.image_directory, file_name))
+        if info is None:
+            return None
+        return (info['width'], info['height'])
+
     def load_image_list(self):
-        """Glob the image files and save to image list."""
+        """Start scanning the image directory, the image list is filled
+        in batches by images_found."""
         if self.image_directory != '':
+            self.image_loader.clear()
             self.image_list = []
             self.image_directory += os.path.sep
-            files = glob.glob(self.image_directory + '*')
-            image_format = [".jpg", ".jpeg", ".png"]
-            f = (lambda x: os.path.splitext(x)[1].lower() in image_format)
-            self.image_list = list(filter(f, files))
-            self.image_list = [os.path.basename(x) for x in self.image_list]
-            self.image_list = sorted(self.image_list)
             self.current_image = 1
-            self.labelImages.setText('of ' + str(len(self.image_list)))
+            self.current_file_name = ''
+            self.scanning = True
+            self.pb_annotate.setEnabled(False)
+            self.index_annotated()
             self.lineEditCurrentImage.setText('1')
-            self.load_image()
+            self.metadata = MetadataIndex(self.image_directory)
+            self.scanner.scan(self.image_directory)
+
+    def load_tiled_image(self, file_name, size):
+        """Display a very large image from its tile pyramid, building the
+        pyramid in the background the first time the image is opened."""
+        regions = self.image_mask(self.current_file_name)[0]
+        pyramid = tile_pyramid.cached(file_name, regions)
+        self.graphicsView.load_tiled_image(size, pyramid)
+        if pyramid is None:
+            self.pyramid_builder.build(file_name, regions)
+
+    def mark_annotated(self, image_name, annotated):
+        """Add or remove an image from the sorted annotated positions."""
+        position = self.image_position(image_name)
+        if position is None:
+            return
+        index = bisect.bisect_left(self.annotated, position)
+        present = (index < len(self.annotated) and
+                   self.annotated[index] == position)
+        if annotated and not present:
+            self.annotated.insert(index, position)
+        elif not annotated and present:
+            del self.annotated[index]
+        else:
+            return
+        self.display_image_count()
 
     def next_annotated_image(self):
         """(Slot) Jump to the next image that has been annotated."""
-        index = self.current_image
-        while index < len(self.image_list):
-            image_name = self.image_list[index]
-            if (image_name in self.data['images'] and
-                    self.data['images'][image_name]['annotations']):
-                self.current_image = index + 1
-                break
-            else:
-                index += 1
+        index = bisect.bisect_right(self.annotated, self.current_image - 1)
+        if index < len(self.annotated):
+            self.current_image = self.annotated[index] + 1
         self.lineEditCurrentImage.setText(str(self.current_image))
         self.load_image()
 
@@ -733,30 +1050,24 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
             self.load_image()
 
     def next_row(self):
-        self.tw_labels.selectRow((self.selected_row + 1) % self.tw_labels.rowCount())
+        if self.annotation_model.rowCount() == 0:
+            return
+        self.tw_labels.selectRow((self.selected_row + 1) % self.annotation_model.rowCount())
         self.graphicsView.sticky_bbox = True
 
     def populate_labels(self):
         if self.labels is None:
-            label_set = set()
-            for image_name, annotations in self.data['images'].items():
-                for annotation in annotations['annotations']:
-                    label_set.add(annotation['label'])
+            label_set = bbx.labels(self.data['images'])
 
             self.labels = ['N/A'] + list(label_set)
             self.assistant.set_labels(self.labels)
+            self.label_model.setStringList(self.labels)
 
     def previous_annotated_image(self):
         """(Slot) Jump to the previous image that has been annotated."""
-        index = self.current_image - 2
-        while index >= 0:
-            image_name = self.image_list[index]
-            if (image_name in self.data['images'] and
-                    self.data['images'][image_name]['annotations']):
-                self.current_image = index + 1
-                break
-            else:
-                index -= 1
+        index = bisect.bisect_left(self.annotated, self.current_image - 1) - 1
+        if index >= 0:
+            self.current_image = self.annotated[index] + 1
         self.lineEditCurrentImage.setText(str(self.current_image))
         self.load_image()
 
@@ -768,28 +1079,83 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
             self.load_image()
 
     def prev_row(self):
-        self.tw_labels.selectRow((self.selected_row - 1) % self.tw_labels.rowCount())
+        if self.annotation_model.rowCount() == 0:
+            return
+        self.tw_labels.selectRow((self.selected_row - 1) % self.annotation_model.rowCount())
         self.graphicsView.sticky_bbox = True
 
+    def pyramid_built(self, file_name, pyramid):
+        """(Slot) Draw the current image once its pyramid is built."""
+        current = os.path.join(self.image_directory, self.current_file_name)
+        if file_name == current:
+            self.graphicsView.set_pyramid(pyramid)
+
+    def pyramid_failed(self, file_name, error):
+        """(Slot) Report the current image when it could not be read into
+        a pyramid, the view is left gray."""
+        current = os.path.join(self.image_directory, self.current_file_name)
+        if file_name != current:
+            return
+        QtWidgets.QMessageBox.warning(self.parent(),
+                                      'ERROR',
+                                      'Unable to display {}\n{}'.format(
+                                          file_name,
+                                          error),
+                                      QtWidgets.QMessageBox.Ok)
+
+    def refine_image(self):
+        """(Slot) Swap in the full resolution image once the zoom level
+        magnifies the draft."""
+        if self.graphicsView.is_draft():
+            filename = os.path.join(self.image_directory,
+                                    self.current_file_name)
+            regions, mask_name = self.image_mask(self.current_file_name)
+            array, size = self.image_loader.load(filename, regions, mask_name)
+            self.graphicsView.refine_image(array)
+
     def resizeEvent(self, event):
         """Overload resizeEvent to fit image in graphics view."""
         self.graphicsView.resize()
+        self.refine_image()
 
     def save(self):
         """(Slot) Save the annotations to disk."""
+        self.graphicsView.end_edit()
         saved = False
+        initial_filter = LINES_FILTER if self.lines_format else BBX_FILTER
         file_name = (QtWidgets.
                      QFileDialog.
                      getSaveFileName(self,
                                      'Save Annotations',
                                      self.image_directory + 'untitled.bbx',
-                                     'BBoxEE (*.bbx)'))
+                                     BBX_FILTER + ';;' + LINES_FILTER,
+                                     initial_filter))
         if file_name[0] != '':
             if os.path.samefile(self.image_directory,
                                 os.path.split(file_name[0])[0]):
-                file = open(file_name[0], 'w')
-                json.dump(self.data, file, indent=4)
-                file.close()
+                lines = file_name[1] == LINES_FILTER
+                self.finish_saving()
+                if (self.journal.is_open() and
+                        file_name[0] == self.annotation_file and
+                        lines == self.lines_format and not lines):
+                    # Only the journaled edits need to be written, they are
+                    # folded into the annotation file in the background
+                    self.journal.rotate(self.data)
+                    self.compactor.annotation_file = self.annotation_file
+                    self.compact_pending = True
+                    self.compactor.start()
+                else:
+                    # The snapshot shares entries with the data, the current
+                    # entry and any loaded while saving are copied instead
+                    self.saver.data = bbx.snapshot(self.data,
+                                                   [self.current_file_name])
+                    self.saver.file_name = file_name[0]
+                    self.saver.lines = lines
+                    self.save_source = self.data
+                    self.save_pending = True
+                    self.journal.watch()
+                    self.saver.start()
+                self.display_saving()
                 self.set_dirty(False)
                 saved = True
             else:
@@ -802,60 +1168,98 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
                                               QtWidgets.QMessageBox.Ok)
         return saved
 
+    def save_complete(self):
+        """(Slot) A background save finished, journal further edits
+        against the file that was written."""
+        if not self.save_pending:
+            return
+        self.save_pending = False
+        self.display_saving()
+        changed = self.journal.watched()
+        # Replaced here rather than on the saver thread, the images being
+        # edited may have to release the file first
+        self.saver.commit(self.save_source['images'])
+        if self.save_source is not self.data:
+            # Another project has been loaded since
+            changed = None
+        self.save_source = None
+        if self.saver.error is not None:
+            if changed is not None:
+                self.set_dirty(True)
+            QtWidgets.QMessageBox.warning(self.parent(),
+                                          'ERROR',
+                                          'Unable to save {}\n{}'.format(
+                                              self.saver.file_name,
+                                              self.saver.error),
+                                          QtWidgets.QMessageBox.Ok)
+        elif changed is not None:
+            self.journal.discard()
+            self.annotation_file = self.saver.file_name
+            self.lines_format = self.saver.lines
+            self.journal.open(self.annotation_file, reset=True)
+            # Edits made while saving are not in the file
+            for image_name in changed[0]:
+                self.journal.touch_image(image_name)
+            for key in changed[1]:
+                self.journal.touch(key)
+            self.flush_journal()
+
+    def scan_complete(self, scan_id):
+        """(Slot) The directory scanner has listed every image."""
+        if scan_id == self.scanner.scan_id:
+            self.scanning = False
+            self.display_image_count()
+            if self.annotator is not None:
+                self.pb_annotate.setEnabled(True)
+            self.metadata_executor.submit(self.metadata.scan,
+                                          list(self.image_list))
+
     def select_annotator(self):
         self.annotator_selecter.show()
 
     def select_bbox(self, point):
         if (self.data is not None and
                 self.current_file_name in self.data['images']):
-            width = self.graphicsView.img_size[0]
-            height = self.graphicsView.img_size[1]
-            rec = self.data['images'][self.current_file_name]
-            found = False
-            current_index = 0
-            distance = 10000000.0
-            for index, annotation in enumerate(rec['annotations']):
-                x = annotation['bbox']['xmin'] * width
-                y = annotation['bbox']['ymin'] * height
-                top_left = QtCore.QPointF(x, y)
-
-                x = annotation['bbox']['xmax'] * width
-                y = annotation['bbox']['ymax'] * height
-                bottom_right = QtCore.QPointF(x, y)
-
-                rect = QtCore.QRectF(top_left, bottom_right)
-                if rect.contains(point):
-                    found = True
-                    line = QtCore.QLineF(point, rect.center())
-                    if line.length() < distance:
-                        current_index = index
-                        distance = line.length()
-
-            if found:
-                self.tw_labels.selectRow(current_index)
+            index = self.graphicsView.nearest_bbox(point)
+            if index is not None:
+                self.tw_labels.selectRow(index)
             else:
                 self.tw_labels.clearSelection()
 
+    def select_thumbnail(self):
+        """Select and scroll to the thumbnail of the current image."""
+        if 0 < self.current_image <= self.thumbnail_model.rowCount():
+            index = self.thumbnail_model.index(self.current_image - 1)
+            self.filmstrip.setCurrentIndex(index)
+            self.filmstrip.scrollTo(index)
+
     def select_mask(self):
         """(Slot) Select mask from disk."""
-        filter_string = '{}_{}.png'.format(self.graphicsView.img_size[0],
-                                           self.graphicsView.img_size[1])
+        size = self.image_size(self.current_file_name)
+        if size is None:
+            size = self.graphicsView.img_size
+        filter_string = '{}_{}.png'.format(size[0], size[1])
         file = (QtWidgets.
                 QFileDialog.getOpenFileName(self,
                                             'Select Mask',
                                             './masks/',
                                             'PNG (*' + filter_string + ')'))
         if file[0] != '':
-            img = Image.open(file[0])
-            if self.graphicsView.img_size == img.size:
-                img = np.array(img)
+            info = read_metadata(file[0])
+            if info is not None and (info['width'], info['height']) == size:
+                if self.mask is not None:
+                    cache = self.image_loader.cache
+                    cache.evict_mask(self.data['mask_name'])
+                img = np.array(Image.open(file[0]))
                 img = np.clip(img, 0, 1)
-                self.mask = img
-                mask = np.dsplit(img, 3)
-                mask = mask[0]
-                mask = mask.reshape(mask.shape[:-1])
-                self.data['mask'] = mask.tolist()
+                self.mask = mask.Regions(img)
+                band = np.dsplit(img, 3)
+                band = band[0]
+                band = band.reshape(band.shape[:-1])
+                self.data['mask'] = schema.encode_mask(self.data, band)
                 self.data['mask_name'] = os.path.split(file[0])[1]
+                self.journal.touch('mask')
+                self.journal.touch('mask_name')
                 self.set_dirty(True)
             else:
                 print('TODO: Display Message')
@@ -864,11 +1268,12 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
 
     def selection_changed(self, selected, deselected):
         """(Slot) Listen for selection and deselection of rows."""
+        self.graphicsView.end_edit()
         if selected.indexes():
             self.selected_row = selected.indexes()[0].row()
-            if self.tw_labels.cellWidget(self.selected_row, 0).currentText() != 'N/A':
-                rec = self.data['images'][self.current_file_name]
-                label = rec['annotations'][self.selected_row]['label']
+            rec = self.data['images'][self.current_file_name]
+            label = rec['annotations'][self.selected_row]['label']
+            if label != 'N/A':
                 self.assistant.set_label(label)
         else:
             self.selected_row = -1
@@ -884,6 +1289,8 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
             is_dirty (bool): Is the data dirty.
         """
         if is_dirty:
+            if self.current_file_name != '':
+                self.journal.touch_image(self.current_file_name)
             self.dirty = True
             self.pb_save.setEnabled(True)
         else:
@@ -893,6 +1300,12 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
     def set_sticky(self):
         self.graphicsView.sticky_bbox = True
 
+    def table_clicked(self, index):
+        """(Slot) Delete the row when its delete button is clicked."""
+        if index.column() == DELETE:
+            self.tw_labels.selectRow(index.row())
+            self.delete_selected_row()
+
     def update_annotation(self, annotation_data):
         """(Slot) Update table with data submitted from assistant widget."""
         if self.selected_row >= 0:
@@ -902,7 +1315,8 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
             for key in annotation_data.keys():
                 ann[key] = annotation_data[key]
                 ann['updated_by'] = 'human'
-            self.display_annotation_data()
+            self.annotation_model.row_changed(self.selected_row)
+            self.display_bboxes()
 
     def update_bbox(self, rect):
         """(Slot) Store the new geometry for the active bbox."""
@@ -915,7 +1329,10 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
             ann['bbox']['xmax'] = rect.right() / self.graphicsView.img_size[0]
             ann['bbox']['ymin'] = rect.top() / self.graphicsView.img_size[1]
             ann['bbox']['ymax'] = rect.bottom() / self.graphicsView.img_size[1]
-            self.update_annotation(ann)
+            # The bbox item already shows the new geometry, during a keyboard
+            # edit the table and scene are refreshed when it finishes
+            if not self.graphicsView.editing:
+                self.update_annotation(ann)
 
     def update_license(self, license):
         if (self.data is not None and
@@ -924,3 +1341,5 @@ class AnnotationWidget(QtWidgets.QWidget, WIDGET):
             rec['attribution'] = license['attribution']
             rec['license'] = license['license']
             rec['license_url'] = license['license_url']
+            self.journal.touch_image(self.current_file_name)
+            self.set_dirty(True)
@@ -25,10 +25,15 @@
 import os
 import sys
 import glob
-import json
+import sqlite3
 from PyQt5 import QtCore, QtWidgets, QtGui, uic
 from bboxee.gui import CocoDialog
+from bboxee import bbx
+from bboxee import bbx_summary
 from bboxee import schema
+from bboxee import mask
+from bboxee.exporter.pipeline import PLACEMENTS
+from bboxee.exporter.split import SPLIT_MODES
 
 if getattr(sys, 'frozen', False):
     bundle_dir = sys._MEIPASS
@@ -42,7 +47,7 @@ class Globber(QtCore.QThread):
        for and pre-processing annotation files."""
 
     progress = QtCore.pyqtSignal(int)
-    finished = QtCore.pyqtSignal(dict, dict)
+    finished = QtCore.pyqtSignal(dict)
     init_progress = QtCore.pyqtSignal(int, str)
 
     def __init__(self):
@@ -56,58 +61,116 @@ class Globber(QtCore.QThread):
         file_list = glob.glob(self.directory + os.path.sep + '**/*.bbx',
                               recursive=True)
         self.init_progress.emit(len(file_list), 'Parsing %p%')
+        try:
+            cache = bbx_summary.SummaryCache()
+        except (OSError, sqlite3.Error):
+            cache = None
+        # Serve unchanged files from the cache, parse the rest in parallel
+        summaries = {}
+        stats = {}
+        for bbx_file in file_list:
+            stats[bbx_file] = os.stat(bbx_file)
+            if cache is not None:
+                summary = cache.get(bbx_file, stats[bbx_file])
+                if summary is not None:
+                    summaries[bbx_file] = summary
+        self.progress.emit(len(summaries))
+        changed = [f for f in file_list if f not in summaries]
+        for p, summary in enumerate(bbx_summary.summarize_all(changed)):
+            summaries[changed[p]] = summary
+            if cache is not None:
+                cache.put(changed[p], stats[changed[p]], summary)
+            self.progress.emit(len(file_list) - len(changed) + p + 1)
+        if cache is not None:
+            cache.close()
         data = {}
-        masks = {}
-        for p, bbx_file in enumerate(file_list):
-            # Read labels from original annotaiton file and summarize by file.
-            file = open(bbx_file, 'r')
-            contents = json.load(file)
-            file.close()
-
-            data[bbx_file] = {'summary': '',
-                              'labels': {},
-                              'images': {},
-                              'mask_name': ''}
-            summary = {}
-            # Store mask and set name in data object
-            if contents['mask_name'] != '':
-                if contents['mask_name'] not in masks:
-                    masks[contents['mask_name']] = contents['mask']
-            data[bbx_file]['mask_name'] = contents['mask_name']
-            # Loop through all of the images and summarize
-            for entry in contents['images']:
-                data[bbx_file]['images'][entry] = contents['images'][entry]
-                labels = {}
-                exclusions = {}
-
-                annotations = contents['images'][entry]['annotations']
-                for annotation in annotations:
-                    if annotation['label'] not in labels:
-                        labels[annotation['label']] = 1
-                    else:
-                        labels[annotation['label']] += 1
-
-                    if annotation['label'] not in summary:
-                        summary[annotation['label']] = 1
-                    else:
-                        summary[annotation['label']] += 1
-
-                    if annotation['truncated'] == "Y":
-                        exclusions['truncated'] = True
-                    if annotation['occluded'] == "Y":
-                        exclusions['occluded'] = True
-                    if annotation['difficult'] == "Y":
-                        exclusions['difficult'] = True
-                tmp = contents['images'][entry]
-                tmp['exclusions'] = exclusions
-                tmp['labels'] = labels
-            string = ''
-            data[bbx_file]['labels'] = summary
-            for label in summary:
-                string += label + ': ' + str(summary[label]) + "\n"
-            data[bbx_file]['summary'] = string
-            self.progress.emit(p + 1)
-        self.finished.emit(data, masks)
+        for bbx_file in file_list:
+            data[bbx_file] = summaries[bbx_file]
+        self.finished.emit(data)
+
+
+class Collector(QtCore.QThread):
+    """Threaded worker to keep gui from freezing while the records of the
+       selected annotation files are read and filtered for export."""
+
+    progress = QtCore.pyqtSignal(int)
+    finished = QtCore.pyqtSignal(list)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self):
+        """Class init function."""
+        QtCore.QThread.__init__(self)
+        self.file_list = []
+        self.root = ''
+        self.label_map = {}
+        self.exclusions = []
+        self.masks = {}
+
+    def run(self):
+        """The starting point for the thread."""
+        excludes = []
+        for label in self.label_map:
+            if self.label_map[label].lower() == 'exclude':
+                excludes.append(label)
+        images = []
+        for count, bbx_file in enumerate(self.file_list):
+            try:
+                contents = bbx.load(bbx_file, lazy=bbx.is_lines(bbx_file))
+            except (OSError, ValueError) as error:
+                self.failed.emit('Unable to read {}\n{}'.format(bbx_file, error))
+                return
+            try:
+                packages = self.collect(bbx_file, contents, excludes)
+            finally:
+                if isinstance(contents['images'], bbx.LazyImages):
+                    contents['images'].close()
+            if packages is None:
+                # Labels were added to the file after it was summarized
+                message = '{} changed since it was loaded.\n\nPlease ' \
+                    'load the directory again.'.format(bbx_file)
+                self.failed.emit(message)
+                return
+            images += packages
+            self.progress.emit(count + 1)
+        self.finished.emit(images)
+
+    def collect(self, bbx_file, contents, excludes):
+        """Package the images of an annotation file that are exported,
+        None if it has labels missing from the label map."""
+        mask_name = contents['mask_name']
+        if mask_name != '' and mask_name not in self.masks:
+            self.masks[mask_name] = mask.decode(contents['mask'])
+        directory, bbx_name = os.path.split(bbx_file)
+        packages = []
+        for img_name in contents['images']:
+            record = contents['images'][img_name]
+            process = True
+            # Filter on the file as it is now, not on its summary
+            for annotation in record['annotations']:
+                if annotation['label'] not in self.label_map:
+                    return None
+                if annotation['label'] in excludes:
+                    process = False
+                for flag in self.exclusions:
+                    if annotation[flag] == 'Y':
+                        process = False
+            if process:
+                image = schema.package_entry()
+                image['directory'] = directory
+                image['bbx_file'] = bbx_name
+                image['root'] = self.root
+                image['file_name'] = img_name
+                image['mask_name'] = mask_name
+                image['attribution'] = record['attribution']
+                image['license'] = record['license']
+                try:
+                    url = record['license_url']
+                    image['license_url'] = url
+                except (KeyError):
+                    image['license_url'] = ''
+                image['annotations'] = record['annotations']
+                packages.append(image)
+        return packages
 
 
 class ExportWidget(QtWidgets.QWidget, EXPORT):
@@ -126,6 +189,11 @@ class ExportWidget(QtWidgets.QWidget, EXPORT):
         self.globber.init_progress.connect(self.init_progress_bar)
         self.globber.progress.connect(self.progressBar.setValue)
 
+        self.collector = Collector()
+        self.collector.finished.connect(self.collected)
+        self.collector.failed.connect(self.collect_failed)
+        self.collector.progress.connect(self.progressBar.setValue)
+
         size = QtCore.QSize(icon_size, icon_size)
         self.pb_select_directory.setIconSize(size)
         self.pb_select_directory.setIcon(QtGui.QIcon(':/icons/folder.svg'))
@@ -153,7 +221,11 @@ class ExportWidget(QtWidgets.QWidget, EXPORT):
         self.cb_occluded.stateChanged.connect(self.exclude_changed)
         self.cb_difficult.stateChanged.connect(self.exclude_changed)
 
-    def display(self, data, masks):
+        self.cb_strip_metadata.stateChanged.connect(self.update_placement)
+        self.comboBoxFormat.currentIndexChanged.connect(self.update_placement)
+        self.update_placement()
+
+    def display(self, data):
         """(Slot) Display annotation files in table with summary count
         by label."""
         self.tw_files.setRowCount(len(data))
@@ -171,7 +243,8 @@ class ExportWidget(QtWidgets.QWidget, EXPORT):
         self.pb_export.setEnabled(True)
         self.progressBar.setRange(0, 1)
         self.base_data = data
-        self.masks = masks
+        # Decoded when the files using them are exported
+        self.masks = {}
 
     def exclude_changed(self):
         labels = {}
@@ -230,12 +303,26 @@ class ExportWidget(QtWidgets.QWidget, EXPORT):
                          QFileDialog.
                          getExistingDirectory(self, 'Select destination'))
             if directory != '':
-                self.exporter = Exporter(directory,
-                                         images,
-                                         self.label_map,
-                                         validation_split,
-                                         self.masks,
-                                         self.cb_strip_metadata.isChecked())
+                index = self.comboBoxSplitMode.currentIndex()
+                options = {'split_mode': SPLIT_MODES[index]}
+                if self.comboBoxPlacement.isEnabled():
+                    index = self.comboBoxPlacement.currentIndex()
+                    options['placement'] = PLACEMENTS[index]
+                strip = self.cb_strip_metadata.isChecked()
+                try:
+                    self.exporter = Exporter(directory,
+                                             images,
+                                             self.label_map,
+                                             validation_split,
+                                             self.masks,
+                                             strip,
+                                             **options)
+                except ValueError:
+                    message = 'The destination is not empty and does not ' \
+                        'hold an earlier export.\n\nPlease select an empty ' \
+                        'directory or the directory of an earlier export.'
+                    QtWidgets.QMessageBox.warning(self, 'Export', message)
+                    return
                 if export_to == 'COCO':
                     diag = CocoDialog(self)
                     accepted = diag.exec()
@@ -250,54 +337,50 @@ class ExportWidget(QtWidgets.QWidget, EXPORT):
                 self.exporter.exported.connect(self.exported)
                 self.exporter.start()
 
-    def export_preflight(self):
-        """(Slot) Prepare data and select exporter."""
-        cbt = self.cb_truncated.isChecked()
-        cbo = self.cb_occluded.isChecked()
-        cbd = self.cb_difficult.isChecked()
-        images = []
+    def update_placement(self):
+        """(Slot) Image placement applies to COCO and YOLO exports of
+        images that are not stripped."""
+        export_to = self.comboBoxFormat.currentText()
+        enabled = (export_to in ('COCO', 'Darknet YOLOv3') and
+                   not self.cb_strip_metadata.isChecked())
+        self.comboBoxPlacement.setEnabled(enabled)
 
-        # Build an excluded label list
-        excludes = []
-        for label in self.label_map:
-            if self.label_map[label].lower() == 'exclude':
-                excludes.append(label)
-        # Loop through all of the selected rows
+    def export_preflight(self):
+        """(Slot) Read the selected files and select exporter."""
+        exclusions = []
+        if self.cb_truncated.isChecked():
+            exclusions.append('truncated')
+        if self.cb_occluded.isChecked():
+            exclusions.append('occluded')
+        if self.cb_difficult.isChecked():
+            exclusions.append('difficult')
+        file_list = []
         for index in self.tw_files.selectionModel().selectedRows():
-            bbx_file = self.tw_files.item(index.row(), 0).text()
-            img_list = self.base_data[bbx_file]['images']
-
-            # Loop through images in annotation file
-            directory = os.path.split(bbx_file)[0]
-            for img_name in img_list:
-                process = True
-                entry = img_list[img_name]
-                if cbt or cbo or cbd:
-                    if cbt and 'truncated' in entry['exclusions']:
-                        process = False
-                    if cbo and 'occluded' in entry['exclusions']:
-                        process = False
-                    if cbd and 'difficult' in entry['exclusions']:
-                        process = False
-                for label in excludes:
-                    if label in entry['labels']:
-                        process = False
-                if process:
-                    image = schema.package_entry()
-                    image['directory'] = directory
-                    image['file_name'] = img_name
-                    image['mask_name'] = self.base_data[bbx_file]['mask_name']
-                    image['attribution'] = entry['attribution']
-                    image['license'] = entry['license']
-                    try:
-                        url = entry['license_url']
-                        image['license_url'] = url
-                    except (KeyError):
-                        image['license_url'] = ''
-                    image['annotations'] = entry['annotations']
-                    images.append(image)
+            file_list.append(self.tw_files.item(index.row(), 0).text())
+        self.pb_export.setEnabled(False)
+        self.pb_select_directory.setEnabled(False)
+        self.init_progress_bar(len(file_list), 'Reading %p%')
+        self.collector.file_list = file_list
+        self.collector.root = self.globber.directory
+        self.collector.label_map = dict(self.label_map)
+        self.collector.exclusions = exclusions
+        self.collector.masks = self.masks
+        self.collector.start()
+
+    def collected(self, images):
+        """(Slot) Export the images read by the collector."""
+        self.pb_export.setEnabled(True)
+        self.pb_select_directory.setEnabled(True)
+        self.progressBar.setRange(0, 1)
         self.export(images)
 
+    def collect_failed(self, message):
+        """(Slot) Report a file that could not be exported."""
+        self.pb_export.setEnabled(True)
+        self.pb_select_directory.setEnabled(True)
+        self.progressBar.setRange(0, 1)
+        QtWidgets.QMessageBox.warning(self, 'Export', message)
+
     def exported(self):
         """(Slot) Enable buttons when packaging is completed."""
         self.pb_export.setEnabled(True)
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+#
+# Bounding Box Editor and Exporter (BBoxEE)
+# Author: Peter Ersts (ersts@amnh.org)
+#
+# --------------------------------------------------------------------------
+#
+# This file is part of Animal Detection Network's (Andenet)
+# Bounding Box Editor and Exporter (BBoxEE)
+#
+# BBoxEE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BBoxEE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# --------------------------------------------------------------------------
+import os
+import bisect
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5 import QtCore, QtGui, QtWidgets
+from bboxee import bbx
+from bboxee.thumbnail_cache import THUMBNAIL_SIZE
+
+# Thumbnails kept in memory and requests waiting for a worker
+MEMORY_THUMBNAILS = 1000
+MAX_PENDING = 64
+MARGIN = 4
+ANNOTATIONS_ROLE = QtCore.Qt.UserRole
+
+
+def insertion_runs(image_list, names):
+    """Where sorted names go in a sorted list, as (index, names) runs of
+    names that are inserted together at an index of the list as it is.
+
+    Inserting the runs from the last to the first keeps the indices of
+    the remaining runs valid.
+    """
+    runs = []
+    index = 0
+    for name in names:
+        index = bisect.bisect_left(image_list, name, index)
+        if runs and runs[-1][0] == index:
+            runs[-1][1].append(name)
+        else:
+            runs.append((index, [name]))
+    return runs
+
+
+class ThumbnailModel(QtCore.QAbstractListModel):
+    """List model over the images of a directory.
+
+    Thumbnails are requested from a pool of workers the first time a view
+    asks for them, only the most recent requests are kept so scrolling
+    quickly does not queue work for rows that are no longer visible.
+    """
+
+    loaded = QtCore.pyqtSignal(str, str, QtGui.QImage)
+    load_failed = QtCore.pyqtSignal(str, str)
+
+    def __init__(self, cache, workers=4, parent=None):
+        """Class init function.
+
+        Args:
+            cache (ThumbnailCache): On disk thumbnail cache
+            workers (int): Number of threads creating thumbnails
+        """
+        QtCore.QAbstractListModel.__init__(self, parent)
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.directory = ''
+        self.image_list = []
+        self.images = {}
+        self.thumbnails = OrderedDict()
+        self.pending = OrderedDict()
+        # Images without a thumbnail, they are not requested again
+        self.unreadable = set()
+        # Worker threads hand thumbnails back through a queued signal
+        self.loaded.connect(self.thumbnail_loaded)
+        self.load_failed.connect(self.thumbnail_failed)
+
+    def set_images(self, directory, image_list, images):
+        """Show a new image list.
+
+        Args:
+            directory (str): Image directory
+            image_list (list): Sorted image file names
+            images (dict): Image entries of the annotation data
+        """
+        self.beginResetModel()
+        if directory != self.directory:
+            self.clear()
+            self.directory = directory
+        self.image_list = list(image_list)
+        self.images = images
+        self.endResetModel()
+
+    def insert_images(self, runs):
+        """Add rows for images found after the list was set.
+
+        Args:
+            runs (list): (index, names) from insertion_runs for the list
+                as it was set
+        """
+        for index, names in reversed(runs):
+            self.beginInsertRows(QtCore.QModelIndex(), index, index + len(names) - 1)
+            self.image_list[index:index] = names
+            self.endInsertRows()
+
+    def clear(self):
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+        self.thumbnails.clear()
+        self.unreadable.clear()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.image_list)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        name = self.image_list[index.row()]
+        if role == QtCore.Qt.DisplayRole or role == QtCore.Qt.ToolTipRole:
+            return name
+        if role == QtCore.Qt.DecorationRole:
+            return self.thumbnail(name)
+        if role == ANNOTATIONS_ROLE:
+            if bbx.annotation_count(self.images, name) > 0:
+                return self.images[name]['annotations']
+            return []
+        return None
+
+    def thumbnail(self, name):
+        """The thumbnail of an image, None while it is being loaded."""
+        if name in self.thumbnails:
+            self.thumbnails.move_to_end(name)
+            return self.thumbnails[name]
+        if name in self.unreadable:
+            return None
+        if name in self.pending:
+            self.pending.move_to_end(name)
+        else:
+            while len(self.pending) >= MAX_PENDING:
+                stale, future = self.pending.popitem(last=False)
+                future.cancel()
+            self.pending[name] = self.executor.submit(self.load,
+                                                      self.directory,
+                                                      name)
+        return None
+
+    def load(self, directory, name):
+        """Read or create a thumbnail, runs on a worker thread."""
+        try:
+            img = self.cache.get(os.path.join(directory, name))
+        except Exception:
+            # Anything the decoder raises, the row keeps its placeholder
+            img = None
+        if img is None:
+            self.load_failed.emit(directory, name)
+            return
+        image = QtGui.QImage(img.tobytes(), img.size[0], img.size[1],
+                             img.size[0] * 3, QtGui.QImage.Format_RGB888)
+        # Detach from the PIL buffer before leaving the thread
+        self.loaded.emit(directory, name, image.copy())
+
+    def thumbnail_loaded(self, directory, name, image):
+        """(Slot) Store a thumbnail and repaint its row."""
+        if directory != self.directory:
+            return
+        self.pending.pop(name, None)
+        self.thumbnails[name] = image
+        while len(self.thumbnails) > MEMORY_THUMBNAILS:
+            self.thumbnails.popitem(last=False)
+        self.refresh(name)
+
+    def thumbnail_failed(self, directory, name):
+        """(Slot) Stop waiting for a thumbnail that could not be made."""
+        if directory != self.directory:
+            return
+        self.pending.pop(name, None)
+        self.unreadable.add(name)
+
+    def refresh(self, name):
+        """Repaint the row of an image, e.g. after its boxes changed."""
+        row = bisect.bisect_left(self.image_list, name)
+        if row < len(self.image_list) and self.image_list[row] == name:
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+
+
+class ThumbnailDelegate(QtWidgets.QStyledItemDelegate):
+    """Paints a thumbnail with the boxes of its image and the file name."""
+
+    def __init__(self, size=THUMBNAIL_SIZE, parent=None):
+        """Class init function.
+
+        Args:
+            size (int): Longest side of a thumbnail in pixels
+        """
+        QtWidgets.QStyledItemDelegate.__init__(self, parent)
+        self.size = size
+        self.machine_pen = QtGui.QPen(QtCore.Qt.magenta, 1)
+        self.human_pen = QtGui.QPen(QtCore.Qt.yellow, 1)
+
+    def sizeHint(self, option, index):
+        height = self.size * 3 // 4 + option.fontMetrics.height()
+        return QtCore.QSize(self.size + 2 * MARGIN, height + 3 * MARGIN)
+
+    def paint(self, painter, option, index):
+        painter.save()
+        if option.state & QtWidgets.QStyle.State_Selected:
+            painter.fillRect(option.rect, option.palette.highlight())
+        area = QtCore.QRect(option.rect.x() + MARGIN,
+                            option.rect.y() + MARGIN,
+                            self.size, self.size * 3 // 4)
+        image = index.data(QtCore.Qt.DecorationRole)
+        if image is None:
+            painter.fillRect(area, QtCore.Qt.darkGray)
+        else:
+            size = image.size().scaled(area.size(), QtCore.Qt.KeepAspectRatio)
+            target = QtCore.QRect(QtCore.QPoint(0, 0), size)
+            target.moveCenter(area.center())
+            painter.drawImage(target, image)
+            for annotation in index.data(ANNOTATIONS_ROLE):
+                if (annotation['created_by'] == 'machine' and
+                        annotation['updated_by'] == ''):
+                    painter.setPen(self.machine_pen)
+                else:
+                    painter.setPen(self.human_pen)
+                bbox = annotation['bbox']
+                painter.drawRect(QtCore.QRectF(
+                    target.x() + bbox['xmin'] * target.width(),
+                    target.y() + bbox['ymin'] * target.height(),
+                    (bbox['xmax'] - bbox['xmin']) * target.width(),
+                    (bbox['ymax'] - bbox['ymin']) * target.height()))
+        painter.setPen(option.palette.color(QtGui.QPalette.HighlightedText
+                                            if option.state & QtWidgets.QStyle.State_Selected
+                                            else QtGui.QPalette.Text))
+        text = QtCore.QRect(area.x(), area.bottom() + MARGIN,
+                            area.width(), option.fontMetrics.height())
+        name = option.fontMetrics.elidedText(index.data(QtCore.Qt.DisplayRole),
+                                             QtCore.Qt.ElideMiddle,
+                                             text.width())
+        painter.drawText(text, QtCore.Qt.AlignCenter, name)
+        painter.restore()
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+#
+# Bounding Box Editor and Exporter (BBoxEE)
+# Author: Peter Ersts (ersts@amnh.org)
+#
+# --------------------------------------------------------------------------
+#
+# This file is part of Animal Detection Network's (Andenet)
+# Bounding Box Editor and Exporter (BBoxEE)
+#
+# BBoxEE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BBoxEE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# --------------------------------------------------------------------------
+import math
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5 import QtCore, QtGui, QtWidgets
+from bboxee import tile_pyramid
+from bboxee.tile_pyramid import TILE_SIZE
+
+# Number of tile pixmaps kept before the least recently drawn are evicted
+MAX_TILES = 256
+# Threads reading tiles from the pyramid
+TILE_WORKERS = 2
+
+
+class PyramidBuilder(QtCore.QThread):
+    """Threaded worker that builds tile pyramids so that a very large
+    image is never decoded on the GUI thread. Requests made while a
+    pyramid is being built replace any request still waiting."""
+
+    finished = QtCore.pyqtSignal(str, object)
+    failed = QtCore.pyqtSignal(str, str)
+
+    def __init__(self):
+        """Class init function."""
+        QtCore.QThread.__init__(self)
+        self.lock = threading.Lock()
+        self.request = None
+
+    def build(self, file_name, mask=None):
+        """Queue a pyramid build, finished is emitted with the file name
+        and the pyramid, failed with the file name and the error if the
+        image could not be read."""
+        with self.lock:
+            self.request = (file_name, mask)
+        if not self.isRunning():
+            self.start()
+
+    def run(self):
+        """The starting point for the thread."""
+        while True:
+            with self.lock:
+                if self.request is None:
+                    return
+                file_name, mask = self.request
+                self.request = None
+            try:
+                pyramid = tile_pyramid.load(file_name, mask)
+            except (OSError, ValueError, MemoryError) as error:
+                self.failed.emit(file_name, str(error) or type(error).__name__)
+                continue
+            if pyramid is None:
+                self.failed.emit(file_name, 'The image no longer exists')
+            else:
+                self.finished.emit(file_name, pyramid)
+
+
+class TiledImageItem(QtWidgets.QGraphicsObject):
+    """Graphics item for images too large for a single QPixmap.
+
+    Tiles are read from a tile pyramid on disk at the level of detail of
+    the current zoom. Only the tiles intersecting the exposed area are
+    read, on worker threads, and tiles that have not been drawn recently
+    are evicted. Until a tile arrives the coarsest level is stretched
+    over its area. The item covers (0, 0, width, height) in scene
+    coordinates just like a QGraphicsPixmapItem.
+    """
+
+    tile_ready = QtCore.pyqtSignal()
+
+    def __init__(self, width, height, pyramid=None, parent=None):
+        """
+        Class init function.
+
+        Args:
+            width (int): Full resolution width
+            height (int): Full resolution height
+            pyramid (TilePyramid): Tile source, can be set later
+        """
+        QtWidgets.QGraphicsObject.__init__(self, parent)
+        self.width = width
+        self.height = height
+        self.pyramid = None
+        self.overview = None
+        # (level, column, row) -> QPixmap
+        self.tiles = OrderedDict()
+        # (level, column, row) -> QImage read by a worker
+        self.ready = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=TILE_WORKERS)
+        self.setFlag(QtWidgets.QGraphicsItem.ItemUsesExtendedStyleOption)
+        self.tile_ready.connect(self.update)
+        if pyramid is not None:
+            self.set_pyramid(pyramid)
+
+    def boundingRect(self):
+        return QtCore.QRectF(0, 0, self.width, self.height)
+
+    def level(self, lod):
+        """Coarsest level whose pixels are not magnified on screen."""
+        level = 0
+        while level < self.pyramid.max_level and (2 ** (level + 1)) * lod <= 1.0:
+            level += 1
+        return level
+
+    def paint(self, painter, option, widget=None):
+        exposed = option.exposedRect.intersected(self.boundingRect())
+        if exposed.isEmpty():
+            return
+        if self.pyramid is None:
+            painter.fillRect(exposed, QtCore.Qt.darkGray)
+            return
+        lod = option.levelOfDetailFromTransform(painter.worldTransform())
+        level = self.level(lod)
+        span = TILE_SIZE * 2 ** level
+        first_col = int(exposed.left() // span)
+        last_col = int(math.ceil(exposed.right() / span))
+        first_row = int(exposed.top() // span)
+        last_row = int(math.ceil(exposed.bottom() / span))
+
+        painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform)
+        visible = set()
+        for row in range(first_row, last_row):
+            for col in range(first_col, last_col):
+                visible.add((level, col, row))
+                x = col * span
+                y = row * span
+                target = QtCore.QRectF(x, y,
+                                       min(span, self.width - x),
+                                       min(span, self.height - y))
+                pixmap = self.tile(level, col, row)
+                if pixmap is None:
+                    self.draw_overview(painter, target)
+                else:
+                    painter.drawPixmap(target, pixmap, QtCore.QRectF(pixmap.rect()))
+
+        # Stop reading tiles that scrolled out of view and evict the
+        # tiles that have been out of view the longest
+        for key in [k for k in self.pending if k not in visible]:
+            self.pending.pop(key).cancel()
+        with self.lock:
+            for key in [k for k in self.ready if k not in visible]:
+                del self.ready[key]
+        while len(self.tiles) > MAX_TILES:
+            self.tiles.popitem(last=False)
+
+    def draw_overview(self, painter, target):
+        """Stretch the matching part of the coarsest level over target."""
+        scale_x = self.overview.width() / self.width
+        scale_y = self.overview.height() / self.height
+        source = QtCore.QRectF(target.x() * scale_x,
+                               target.y() * scale_y,
+                               target.width() * scale_x,
+                               target.height() * scale_y)
+        painter.drawPixmap(target, self.overview, source)
+
+    def read_tile(self, pyramid, key):
+        """Read a tile on a worker thread and ask for a repaint."""
+        array = pyramid.tile(*key)
+        h, w = array.shape[:2]
+        image = QtGui.QImage(array.data, w, h, array.strides[0],
+                             QtGui.QImage.Format_RGB888).copy()
+        with self.lock:
+            self.ready[key] = image
+        self.tile_ready.emit()
+
+    def release(self):
+        """Drop the tiles and stop reading, the item is being removed."""
+        for future in self.pending.values():
+            future.cancel()
+        self.executor.shutdown(wait=False)
+        self.pending = {}
+        self.tiles = OrderedDict()
+        self.pyramid = None
+
+    def set_pyramid(self, pyramid):
+        """Start drawing from a pyramid that has finished building."""
+        self.pyramid = pyramid
+        array = pyramid.tile(pyramid.max_level, 0, 0)
+        self.overview = self.image_to_pixmap(array)
+        self.update()
+
+    def tile(self, level, col, row):
+        """Return the pixmap for a tile, None while it is being read."""
+        key = (level, col, row)
+        pixmap = self.tiles.get(key)
+        if pixmap is not None:
+            self.tiles.move_to_end(key)
+            return pixmap
+        with self.lock:
+            image = self.ready.pop(key, None)
+        if image is None:
+            future = self.pending.get(key)
+            if future is not None and future.done():
+                # A read that finished without leaving its image in
+                # ready failed, read it again. Failures do not ask for a
+                # repaint so a tile that keeps failing is not read in a loop.
+                del self.pending[key]
+            if key not in self.pending:
+                self.pending[key] = self.executor.submit(self.read_tile,
+                                                         self.pyramid,
+                                                         key)
+            return None
+        self.pending.pop(key, None)
+        pixmap = QtGui.QPixmap.fromImage(image)
+        self.tiles[key] = pixmap
+        return pixmap
+
+    @staticmethod
+    def image_to_pixmap(array):
+        h, w = array.shape[:2]
+        image = QtGui.QImage(array.data, w, h, array.strides[0],
+                             QtGui.QImage.Format_RGB888)
+        return QtGui.QPixmap.fromImage(image)
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+#
+# Bounding Box Editor and Exporter (BBoxEE)
+# Author: Peter Ersts (ersts@amnh.org)
+#
+# --------------------------------------------------------------------------
+#
+# This file is part of Animal Detection Network's (Andenet)
+# Bounding Box Editor and Exporter (BBoxEE)
+#
+# BBoxEE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BBoxEE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# --------------------------------------------------------------------------
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+# Drone orthomosaics routinely exceed PIL's decompression bomb limit
+Image.MAX_IMAGE_PIXELS = None
+# Images with a side longer than this are not decoded whole for display,
+# they are shown from a tile pyramid
+TILE_THRESHOLD = 8192
+
+
+def decode(file_name, mask=None, size=None):
+    """Decode an image file into an RGB array and apply the mask.
+
+    When a viewport size is given JPEG images are decoded with DCT scaling
+    to the smallest reduction that still covers the image fitted into the
+    viewport.
+
+    Args:
+        file_name (str): Path to the image
+        mask (Regions): Regions to zero for masking metadata
+        size (tuple): Optional viewport (width, height) to draft decode for
+
+    Returns:
+        tuple: (height, width, 3) uint8 array and the full (width, height)
+    """
+    img = Image.open(file_name)
+    full_size = img.size
+    if size is not None:
+        fit = min(size[0] / full_size[0], size[1] / full_size[1])
+        img.draft('RGB', (max(1, int(full_size[0] * fit)),
+                          max(1, int(full_size[1] * fit))))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    array = np.array(img)
+    img.close()
+
+    if mask is not None:
+        mask.apply(array)
+    return (array, full_size)
+
+
+class FrameCache(object):
+    """Least recently used store of decoded frames bounded by a byte budget.
+
+    Frames are (array, full size) tuples keyed on file name, modification
+    time, mask name and draft size so an edited file or a different mask
+    never returns a stale frame.
+    """
+
+    def __init__(self, budget=512 * 1024 * 1024):
+        """
+        Class init function.
+
+        Args:
+            budget (int): Maximum number of bytes held by the cache
+        """
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.frames = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.frames
+
+    def __len__(self):
+        return len(self.frames)
+
+    @staticmethod
+    def key(file_name, mask_name='', size=None):
+        """Build a cache key, None if the file can not be stat'ed."""
+        try:
+            mtime = os.stat(file_name).st_mtime_ns
+        except OSError:
+            return None
+        return (file_name, mtime, mask_name, size)
+
+    def clear(self):
+        """Remove all frames and reset the counters."""
+        with self.lock:
+            self.frames = OrderedDict()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def evict_mask(self, mask_name):
+        """Remove all frames decoded with the named mask."""
+        with self.lock:
+            for key in [k for k in self.frames if k[2] == mask_name]:
+                self.size -= self.frames.pop(key)[0].nbytes
+
+    def get(self, key):
+        """Return the frame stored under key or None, updating the counters."""
+        with self.lock:
+            frame = self.frames.get(key)
+            if frame is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.frames.move_to_end(key)
+            return frame
+
+    def put(self, key, frame):
+        """Store a frame, evicting the least recently used frames as needed."""
+        array = frame[0]
+        if key is None or array.nbytes > self.budget:
+            return
+        # Cached frames are shared with the graphics view
+        array.flags.writeable = False
+        with self.lock:
+            if key in self.frames:
+                self.size -= self.frames.pop(key)[0].nbytes
+            self.frames[key] = frame
+            self.size += array.nbytes
+            while self.size > self.budget:
+                k, evicted = self.frames.popitem(last=False)
+                self.size -= evicted[0].nbytes
+
+    def set_budget(self, budget):
+        """Change the byte budget, evicting frames if it shrinks."""
+        with self.lock:
+            self.budget = budget
+            while self.size > self.budget:
+                k, evicted = self.frames.popitem(last=False)
+                self.size -= evicted[0].nbytes
+
+
+class ImageLoader(object):
+    """Decode the images surrounding the current image on a pool of
+    worker threads so that stepping through a directory only has to
+    hand the already decoded array to the graphics view."""
+
+    def __init__(self, ahead=3, behind=1, workers=2, cache=None):
+        """
+        Class init function.
+
+        Args:
+            ahead (int): Number of images to decode after the current image
+            behind (int): Number of images to decode before the current image
+            workers (int): Number of decoding threads
+            cache (FrameCache): Store for decoded frames
+        """
+        self.ahead = ahead
+        self.behind = behind
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.cache = cache if cache is not None else FrameCache()
+        # cache key -> Future
+        self.pending = {}
+
+    def _decode(self, key, file_name, mask, size):
+        frame = decode(file_name, mask, size)
+        self.cache.put(key, frame)
+        return frame
+
+    def _read_ahead(self, key, file_name, mask, size):
+        # Very large images are shown from a tile pyramid, not decoded whole
+        with Image.open(file_name) as img:
+            if max(img.size) > TILE_THRESHOLD:
+                return None
+        return self._decode(key, file_name, mask, size)
+
+    def clear(self):
+        """Cancel and forget all outstanding read ahead requests."""
+        for future in self.pending.values():
+            future.cancel()
+        self.pending = {}
+
+    def load(self, file_name, mask=None, mask_name='', size=None):
+        """Return the decoded image from the cache, the read ahead result
+        or by decoding it now.
+
+        Args:
+            file_name (str): Path to the image
+            mask (Regions): Regions to zero for masking metadata
+            mask_name (str): Name of the mask, part of the cache key
+            size (tuple): Optional viewport (width, height) to draft decode for
+
+        Returns:
+            tuple: (height, width, 3) uint8 array and the full (width, height)
+        """
+        if mask is None:
+            mask_name = ''
+        key = self.cache.key(file_name, mask_name, size)
+        frame = self.cache.get(key)
+        if frame is not None:
+            return frame
+
+        future = self.pending.pop(key, None)
+        if future is not None and not future.cancelled():
+            try:
+                frame = future.result()
+                if frame is not None:
+                    return frame
+            except Exception:
+                # Decode again below so the error surfaces on the caller
+                pass
+        return self._decode(key, file_name, mask, size)
+
+    def read_ahead(self, directory, image_list, index, masks=None, size=None):
+        """Queue the neighbours of an image for background decoding.
+
+        Args:
+            directory (str): Image directory
+            image_list (list): Sorted image file names
+            index (int): Zero based position of the current image
+            masks (callable): Returns the mask (Regions) and mask name to
+                decode an image name with, the same values load() is given
+            size (tuple): Optional viewport (width, height) to draft decode for
+        """
+        wanted = {}
+        neighbours = [index + x for x in range(1, self.ahead + 1)]
+        neighbours += [index - x for x in range(1, self.behind + 1)]
+        for position in neighbours:
+            if position >= 0 and position < len(image_list):
+                mask, mask_name = (None, '')
+                if masks is not None:
+                    mask, mask_name = masks(image_list[position])
+                if mask is None:
+                    mask_name = ''
+                file_name = os.path.join(directory, image_list[position])
+                key = self.cache.key(file_name, mask_name, size)
+                wanted[key] = (file_name, mask)
+
+        # Drop requests that are no longer near the current image
+        for key in list(self.pending.keys()):
+            if key not in wanted or self.pending[key].done():
+                self.pending.pop(key).cancel()
+
+        for key, (file_name, mask) in wanted.items():
+            if key is None or key in self.pending or key in self.cache:
+                continue
+            self.pending[key] = self.executor.submit(self._read_ahead,
+                                                     key,
+                                                     file_name,
+                                                     mask,
+                                                     size)
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+#
+# Bounding Box Editor and Exporter (BBoxEE)
+# Author: Peter Ersts (ersts@amnh.org)
+#
+# --------------------------------------------------------------------------
+#
+# This file is part of Animal Detection Network's (Andenet)
+# Bounding Box Editor and Exporter (BBoxEE)
+#
+# BBoxEE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BBoxEE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# --------------------------------------------------------------------------
+import os
+import json
+import struct
+import hashlib
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from PyQt5 import QtCore
+
+# Bump when the cached fields change so old caches are ignored
+METADATA_VERSION = 1
+# JPEG start of frame markers, C4 (DHT), C8 (JPG) and CC (DAC) are not frames
+SOF_MARKERS = set([0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                   0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF])
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+ORIENTATION = 0x0112
+DATE_TIME = 0x0132
+EXIF_IFD = 0x8769
+DATE_TIME_ORIGINAL = 0x9003
+
+
+def default_cache_dir():
+    cache_dir = QtCore.QStandardPaths.writableLocation(
+        QtCore.QStandardPaths.GenericCacheLocation)
+    return os.path.join(cache_dir, 'bboxee', 'metadata')
+
+
+def exif_date(value):
+    """Convert an EXIF date (YYYY:MM:DD HH:MM:SS) to the format used in
+    annotation packages, None if it is not a valid date."""
+    try:
+        date = datetime.datetime.strptime(value.strip('\x00 '), '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+    return str(date)
+
+
+def parse_exif(tiff, info):
+    """Read orientation and capture time from the TIFF structure of an
+    EXIF segment."""
+    order = '<' if tiff[:2] == b'II' else '>'
+
+    def entries(offset):
+        count = struct.unpack_from(order + 'H', tiff, offset)[0]
+        for i in range(count):
+            yield struct.unpack_from(order + 'HHII', tiff, offset + 2 + i * 12) + \
+                (offset + 10 + i * 12,)
+
+    def ascii_value(count, value_offset):
+        return tiff[value_offset:value_offset + count].decode('ascii', 'ignore')
+
+    date = None
+    exif_offset = None
+    for tag, kind, count, value, position in entries(struct.unpack_from(order + 'I', tiff, 4)[0]):
+        if tag == ORIENTATION:
+            info['orientation'] = struct.unpack_from(order + 'H', tiff, position)[0]
+        elif tag == DATE_TIME:
+            date = ascii_value(count, value)
+        elif tag == EXIF_IFD:
+            exif_offset = value
+    if exif_offset is not None:
+        for tag, kind, count, value, position in entries(exif_offset):
+            if tag == DATE_TIME_ORIGINAL:
+                date = ascii_value(count, value)
+    if date is not None:
+        info['date_captured'] = exif_date(date)
+
+
+def read_jpeg(file, info):
+    """Walk the JPEG segments up to the start of frame."""
+    while True:
+        byte = file.read(1)
+        while byte == b'\xff':
+            byte = file.read(1)
+        if byte == b'':
+            return False
+        marker = byte[0]
+        if marker == 0xD8 or marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            continue
+        if marker == 0xDA or marker == 0xD9:
+            return False
+        length = struct.unpack('>H', file.read(2))[0]
+        if marker in SOF_MARKERS:
+            height, width = struct.unpack('>xHH', file.read(5))
+            info['width'] = width
+            info['height'] = height
+            return True
+        if marker == 0xE1:
+            segment = file.read(length - 2)
+            if segment[:6] == b'Exif\x00\x00':
+                try:
+                    parse_exif(segment[6:], info)
+                except struct.error:
+                    pass
+        else:
+            file.seek(length - 2, os.SEEK_CUR)
+        # Skip the 0xFF that starts the next marker
+        if file.read(1) != b'\xff':
+            return False
+
+
+def read(file_name):
+    """Read image dimensions, capture time and orientation from the file
+    header without decoding pixels.
+
+    Returns:
+        dict: width, height, date_captured (None if unknown) and
+            orientation (EXIF value, 1 is upright) or None if the file
+            can not be read
+    """
+    info = {'width': 0, 'height': 0, 'date_captured': None, 'orientation': 1}
+    try:
+        with open(file_name, 'rb') as file:
+            head = file.read(8)
+            found = False
+            if head[:2] == b'\xff\xd8':
+                file.seek(2)
+                try:
+                    found = read_jpeg(file, info)
+                except struct.error:
+                    found = False
+            elif head == PNG_SIGNATURE:
+                chunk = file.read(16)
+                if chunk[4:8] == b'IHDR':
+                    info['width'], info['height'] = struct.unpack('>II', chunk[8:16])
+                    found = True
+        if not found:
+            # Unusual layout, let PIL read the header
+            img = Image.open(file_name)
+            info['width'], info['height'] = img.size
+            img.close()
+    except OSError:
+        return None
+    return info
+
+
+class MetadataIndex(object):
+    """Header metadata of the images in a directory, cached on disk and
+    refreshed for files whose modification time or size changed."""
+
+    def __init__(self, directory, cache_dir=None):
+        """Class init function.
+
+        Args:
+            directory (str): Image directory
+            cache_dir (str): Where the index is cached, the user cache
+                directory when None
+        """
+        self.directory = directory
+        if cache_dir is None:
+            cache_dir = default_cache_dir()
+        key = hashlib.sha1(os.path.abspath(directory).encode('utf-8')).hexdigest()
+        self.cache_file = os.path.join(cache_dir, key + '.json')
+        self.entries = {}
+        self.changed = False
+        self.lock = threading.Lock()
+        try:
+            with open(self.cache_file, 'r') as file:
+                cache = json.load(file)
+            if cache['version'] == METADATA_VERSION:
+                self.entries = cache['entries']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def get(self, name):
+        """Metadata of an image, read from its header if not cached.
+
+        Returns:
+            dict: See read(), None if the image can not be read
+        """
+        try:
+            stat = os.stat(os.path.join(self.directory, name))
+        except OSError:
+            return None
+        entry = self.entries.get(name)
+        if (entry is None or entry['mtime'] != stat.st_mtime_ns or
+                entry['size'] != stat.st_size):
+            entry = read(os.path.join(self.directory, name))
+            if entry is None:
+                return None
+            entry['mtime'] = stat.st_mtime_ns
+            entry['size'] = stat.st_size
+            with self.lock:
+                self.entries[name] = entry
+                self.changed = True
+        return entry
+
+    def scan(self, names, workers=8):
+        """Read the metadata of many images in parallel and update the cache."""
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(self.get, names))
+        self.save()
+
+    def save(self):
+        if not self.changed:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            temp_name = self.cache_file + '.tmp'
+            with self.lock:
+                cache = {'version': METADATA_VERSION,
+                         'directory': os.path.abspath(self.directory),
+                         'entries': dict(self.entries)}
+                self.changed = False
+            with open(temp_name, 'w') as file:
+                json.dump(cache, file)
+            os.replace(temp_name, self.cache_file)
+        except OSError:
+            # The index still works without a writable cache
+            pass
+
+
+def index_images(images, cache_dir=None):
+    """Build the metadata indexes for annotation records (as handed to the
+    exporters) spread over any number of directories.
+
+    Returns:
+        dict: MetadataIndex keyed by directory
+    """
+    names = {}
+    for rec in images:
+        names.setdefault(rec['directory'], []).append(rec['file_name'])
+    indexes = {}
+    for directory in names:
+        indexes[directory] = MetadataIndex(directory, cache_dir)
+        indexes[directory].scan(names[directory])
+    return indexes
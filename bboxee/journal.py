@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+#
+# Bounding Box Editor and Exporter (BBoxEE)
+# Author: Peter Ersts (ersts@amnh.org)
+#
+# --------------------------------------------------------------------------
+#
+# This file is part of Animal Detection Network's (Andenet)
+# Bounding Box Editor and Exporter (BBoxEE)
+#
+# BBoxEE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BBoxEE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# --------------------------------------------------------------------------
+import os
+import json
+from PyQt5 import QtCore
+from bboxee import bbx
+
+# Suffixes of the journals kept beside an annotation (.bbx) file. Edits
+# go to the current journal, saving moves them to the saved journal until
+# they have been compacted into the annotation file.
+JOURNAL_SUFFIX = '.journal'
+SAVED_SUFFIX = '.journal.saved'
+
+
+def replay(data, file_name):
+    """Apply the records of a journal to annotation data.
+
+    Args:
+        data (dict): Annotation file data, updated in place
+        file_name (str): Path of the journal
+
+    Returns:
+        int: Number of records applied
+    """
+    count = 0
+    if not os.path.exists(file_name):
+        return count
+    with open(file_name, 'rb') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Partial record from an interrupted write
+                continue
+            if 'image' in record:
+                if record['entry'] is None:
+                    data['images'].pop(record['image'], None)
+                else:
+                    data['images'][record['image']] = record['entry']
+            else:
+                data[record['key']] = record['value']
+            count += 1
+    return count
+
+
+def recover(data, annotation_file):
+    """Apply every journaled edit of annotation_file to its data.
+
+    Returns:
+        tuple: Saved edits not yet compacted, unsaved edits
+    """
+    saved = replay(data, annotation_file + SAVED_SUFFIX)
+    unsaved = replay(data, annotation_file + JOURNAL_SUFFIX)
+    return (saved, unsaved)
+
+
+class Journal(object):
+    """Append only log of annotation edits kept beside a .bbx file.
+
+    Edits are noted with touch_image() and touch(), flush() writes the
+    current state of everything touched since the last flush as one
+    batch followed by a single fsync. Each record is a complete image
+    entry or top level value so replaying is idempotent.
+    """
+
+    def __init__(self):
+        """Class init function."""
+        self.annotation_file = ''
+        self.file = None
+        self.images = set()
+        self.keys = set()
+        # images and keys touched while watching
+        self.changed = None
+
+    def open(self, annotation_file, reset=False):
+        """Start journaling edits of annotation_file.
+
+        Args:
+            annotation_file (str): Path of the .bbx file
+            reset (bool): Delete existing journals, the annotation file
+                was just written in full
+        """
+        self.close()
+        self.annotation_file = annotation_file
+        if reset:
+            for suffix in [JOURNAL_SUFFIX, SAVED_SUFFIX]:
+                if os.path.exists(annotation_file + suffix):
+                    os.remove(annotation_file + suffix)
+        self.file = open(annotation_file + JOURNAL_SUFFIX, 'ab')
+
+    def close(self):
+        if self.file is not None:
+            empty = self.file.tell() == 0
+            self.file.close()
+            if empty:
+                os.remove(self.file.name)
+        self.file = None
+        self.annotation_file = ''
+        self.images.clear()
+        self.keys.clear()
+        self.changed = None
+
+    def discard(self):
+        """Close the journal and drop its unsaved edits."""
+        file_name = self.annotation_file + JOURNAL_SUFFIX
+        is_open = self.file is not None
+        self.close()
+        if is_open and os.path.exists(file_name):
+            os.remove(file_name)
+
+    def is_open(self):
+        return self.file is not None
+
+    def touch_image(self, image_name):
+        """Note that the entry for image_name changed."""
+        if self.changed is not None:
+            self.changed[0].add(image_name)
+        if self.file is not None:
+            self.images.add(image_name)
+
+    def touch(self, key):
+        """Note that a top level value changed."""
+        if self.changed is not None:
+            self.changed[1].add(key)
+        if self.file is not None:
+            self.keys.add(key)
+
+    def watch(self):
+        """Start collecting the edits made while a snapshot is saved."""
+        self.changed = (set(), set())
+
+    def watched(self):
+        """Stop watching.
+
+        Returns:
+            tuple: Images and keys touched, None if the journal was closed
+        """
+        changed = self.changed
+        self.changed = None
+        return changed
+
+    def pending(self):
+        return len(self.images) + len(self.keys) > 0
+
+    def flush(self, data):
+        """Append the touched entries and sync them to disk."""
+        if self.file is None or not self.pending():
+            return
+        lines = []
+        for image_name in sorted(self.images):
+            entry = data['images'].get(image_name)
+            lines.append({'image': image_name, 'entry': entry})
+        for key in sorted(self.keys):
+            lines.append({'key': key, 'value': data[key]})
+        self.images.clear()
+        self.keys.clear()
+        for line in lines:
+            self.file.write(json.dumps(line).encode('utf-8') + b'\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def rotate(self, data):
+        """Mark every journaled edit as saved and start a new journal.
+
+        Saved edits are appended to any left over from a compaction
+        that did not finish.
+        """
+        self.flush(data)
+        file_name = self.annotation_file + JOURNAL_SUFFIX
+        saved_name = self.annotation_file + SAVED_SUFFIX
+        self.file.close()
+        if os.path.exists(saved_name):
+            with open(file_name, 'rb') as file:
+                edits = file.read()
+            with open(saved_name, 'ab') as file:
+                file.write(edits)
+                file.flush()
+                os.fsync(file.fileno())
+            os.remove(file_name)
+        else:
+            os.replace(file_name, saved_name)
+        self.file = open(file_name, 'ab')
+
+
+class Compactor(QtCore.QThread):
+    """Threaded worker that folds saved journal edits into the annotation
+    file without blocking the interface."""
+
+    compacted = QtCore.pyqtSignal(str)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self):
+        """Class init function."""
+        QtCore.QThread.__init__(self)
+        self.annotation_file = ''
+
+    def run(self):
+        """The starting point for the thread."""
+        saved_name = self.annotation_file + SAVED_SUFFIX
+        try:
+            lines = bbx.is_lines(self.annotation_file)
+            data = bbx.load(self.annotation_file, lazy=lines)
+            replay(data, saved_name)
+            bbx.save(data, self.annotation_file, lines)
+            os.remove(saved_name)
+            self.compacted.emit(self.annotation_file)
+        except (OSError, ValueError) as error:
+            self.failed.emit(str(error))
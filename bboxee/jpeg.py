@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+#
+# Bounding Box Editor and Exporter (BBoxEE)
+# Author: Peter Ersts (ersts@amnh.org)
+#
+# --------------------------------------------------------------------------
+#
+# This file is part of Animal Detection Network's (Andenet)
+# Bounding Box Editor and Exporter (BBoxEE)
+#
+# BBoxEE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BBoxEE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# --------------------------------------------------------------------------
+import re
+import struct
+import numpy as np
+
+# Segments kept when stripping metadata, they change how pixels are
+# rendered: APP0 (JFIF), APP2 (ICC profile only) and APP14 (Adobe colour
+# transform)
+KEEP_SEGMENTS = set([0xE0, 0xE2, 0xEE])
+APP2 = 0xE2
+ICC_PROFILE = b'ICC_PROFILE\x00'
+BASELINE_FRAMES = set([0xC0, 0xC1])
+SOS = 0xDA
+EOI = 0xD9
+DRI = 0xDD
+DHT = 0xC4
+DQT = 0xDB
+# Quantized DC level shift of a black 8x8 block before dividing by the
+# quantization step, (0 - 128) * 8
+BLACK_DC = -1024
+# Any marker in entropy coded data, 0xFF00 is a stuffed zero and 0xFFFF fill
+MARKER = re.compile(b'\\xff[^\\x00\\xff]')
+
+
+def segments(data):
+    """Split a JPEG into its marker segments.
+
+    Returns:
+        list: (marker, start, end) of every segment before the first scan,
+            the last entry is the SOS segment whose end is the start of the
+            entropy coded data, None if the file is not a JPEG
+    """
+    if data[:2] != b'\xff\xd8':
+        return None
+    result = []
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:
+            # Fill byte
+            position += 1
+            continue
+        length = struct.unpack_from('>H', data, position + 2)[0]
+        result.append((marker, position, position + 2 + length))
+        if marker == SOS:
+            return result
+        position += 2 + length
+    return None
+
+
+def is_metadata(data, marker, start):
+    """True if the segment starting at start only carries metadata."""
+    if marker == 0xFE:
+        return True
+    if not 0xE0 <= marker <= 0xEF:
+        return False
+    if marker == APP2:
+        # APP2 also carries MPF, the index of appended preview images
+        return data[start + 4:start + 4 + len(ICC_PROFILE)] != ICC_PROFILE
+    return marker not in KEEP_SEGMENTS
+
+
+def scan_data(data, position):
+    """Byte ranges of the entropy coded data and tables from the first
+    scan through EOI, without metadata segments between scans.
+
+    Anything after EOI, such as appended previews, is left out.
+
+    Returns:
+        list: (start, end) ranges, None if there is no EOI
+    """
+    ranges = []
+    start = position
+    while True:
+        match = MARKER.search(data, position)
+        if match is None:
+            return None
+        marker = data[match.end() - 1]
+        if marker == EOI:
+            ranges.append((start, match.end()))
+            return ranges
+        if 0xD0 <= marker <= 0xD7:
+            position = match.end()
+            continue
+        # A segment between scans (DHT, SOS, DNL...), skip its payload
+        if match.end() + 2 > len(data):
+            return None
+        end = match.end() + struct.unpack_from('>H', data, match.end())[0]
+        if is_metadata(data, marker, match.start()):
+            ranges.append((start, match.start()))
+            start = end
+        position = end
+
+
+def huffman_codes(segment):
+    """Canonical Huffman codes of the tables in a DHT segment.
+
+    Returns:
+        dict: {(class, id): {symbol: (code, length)}}
+    """
+    tables = {}
+    position = 4
+    while position < len(segment):
+        table_class = segment[position] >> 4
+        table_id = segment[position] & 15
+        counts = segment[position + 1:position + 17]
+        position += 17
+        codes = {}
+        code = 0
+        for length in range(1, 17):
+            for i in range(counts[length - 1]):
+                codes[segment[position]] = (code, length)
+                position += 1
+                code += 1
+            code <<= 1
+        tables[(table_class, table_id)] = codes
+    return tables
+
+
+def dc_steps(segment):
+    """DC quantization step of each table in a DQT segment."""
+    steps = {}
+    position = 4
+    while position < len(segment):
+        precision = segment[position] >> 4
+        table_id = segment[position] & 15
+        if precision == 0:
+            steps[table_id] = segment[position + 1]
+            position += 65
+        else:
+            steps[table_id] = struct.unpack_from('>H', segment, position + 1)[0]
+            position += 129
+    return steps
+
+
+def blank_interval(components, mcus):
+    """Entropy code a restart interval of uniform black MCUs.
+
+    Args:
+        components (list): (blocks per MCU, quantized DC, DC codes, AC codes)
+        mcus (int): MCUs in the interval
+
+    Returns:
+        bytes: Entropy coded data, None if a needed code is missing
+    """
+    def bits(code):
+        return format(code[0], '0{}b'.format(code[1]))
+
+    first = ''
+    other = ''
+    for blocks, dc, dc_codes, ac_codes in components:
+        # The predictor restarts at zero with each interval so only the
+        # first block of each component has a DC difference
+        size = abs(dc).bit_length()
+        if size not in dc_codes or 0 not in dc_codes or 0 not in ac_codes:
+            return None
+        # End of block, every AC coefficient is zero
+        block = bits(dc_codes[0]) + bits(ac_codes[0])
+        first += bits(dc_codes[size])
+        if size > 0:
+            first += format(dc if dc > 0 else dc + (1 << size) - 1,
+                            '0{}b'.format(size))
+        first += bits(ac_codes[0]) + block * (blocks - 1)
+        other += block * blocks
+    stream = first + other * (mcus - 1)
+    # Pad the last byte with ones
+    stream += '1' * (-len(stream) % 8)
+    data = int(stream, 2).to_bytes(len(stream) // 8, 'big')
+    return data.replace(b'\xff', b'\xff\x00')
+
+
+def blank_regions(data, header, regions):
+    """Replace the restart intervals covered by the mask regions with
+    black intervals.
+
+    Args:
+        data (bytes): JPEG file
+        header (list): Segments as returned by segments()
+        regions (Regions): Rectangles to blank
+
+    Returns:
+        bytes: Entropy coded data of the first scan through EOI, None when
+            the image is not a baseline, single scan JPEG with restart
+            intervals the regions align with
+    """
+    frame = None
+    interval = 0
+    tables = {}
+    steps = {}
+    for marker, start, end in header:
+        segment = data[start:end]
+        if marker in BASELINE_FRAMES:
+            frame = segment
+        elif 0xC2 <= marker <= 0xCF and marker not in (DHT, 0xC8, 0xCC):
+            # Progressive, lossless or arithmetic coded
+            return None
+        elif marker == DRI:
+            interval = struct.unpack_from('>H', segment, 4)[0]
+        elif marker == DHT:
+            tables.update(huffman_codes(segment))
+        elif marker == DQT:
+            steps.update(dc_steps(segment))
+    if frame is None or interval == 0:
+        return None
+    height, width = struct.unpack_from('>HH', frame, 5)
+    if regions.shape != (height, width):
+        return None
+    sampling = {}
+    for i in range(frame[9]):
+        component_id, factors, table = frame[10 + i * 3:13 + i * 3]
+        sampling[component_id] = (factors >> 4, factors & 15, table)
+    h_max = max(s[0] for s in sampling.values())
+    v_max = max(s[1] for s in sampling.values())
+    mcu_width = 8 * h_max
+    mcu_height = 8 * v_max
+    mcu_columns = -(-width // mcu_width)
+    mcu_rows = -(-height // mcu_height)
+
+    # The scan must interleave every component
+    sos = data[header[-1][1]:header[-1][2]]
+    if sos[4] != len(sampling):
+        return None
+    components = []
+    for i in range(sos[4]):
+        component_id, selectors = sos[5 + i * 2:7 + i * 2]
+        h, v, table = sampling[component_id]
+        dc = 0
+        if i == 0:
+            dc = int(round(BLACK_DC / steps[table]))
+        components.append((h * v, dc,
+                           tables.get((0, selectors >> 4), {}),
+                           tables.get((1, selectors & 15), {})))
+
+    # MCUs to blank, every region must cover whole MCUs
+    blank = np.zeros((mcu_rows, mcu_columns), dtype='bool')
+    for row_start, row_end, col_start, col_end in regions.rectangles:
+        if row_start % mcu_height or col_start % mcu_width:
+            return None
+        if (row_end % mcu_height and row_end != height) or \
+                (col_end % mcu_width and col_end != width):
+            return None
+        blank[row_start // mcu_height:-(-row_end // mcu_height),
+              col_start // mcu_width:-(-col_end // mcu_width)] = True
+
+    # Split the entropy coded data on restart markers
+    pieces = []
+    start = header[-1][2]
+    for match in MARKER.finditer(data, start):
+        marker = data[match.end() - 1]
+        pieces.append(data[start:match.start()])
+        start = match.end()
+        if marker == EOI:
+            break
+        if not 0xD0 <= marker <= 0xD7:
+            # A second scan or unexpected marker
+            return None
+    else:
+        return None
+    total = mcu_columns * mcu_rows
+    if len(pieces) != -(-total // interval):
+        return None
+
+    # Blanked MCUs per interval, intervals are blanked whole or not at all
+    covered = np.add.reduceat(blank.ravel(), np.arange(0, total, interval))
+    encoded = {}
+    for index in np.flatnonzero(covered):
+        first = index * interval
+        last = min(first + interval, total)
+        if covered[index] != last - first:
+            return None
+        if last - first not in encoded:
+            encoded[last - first] = blank_interval(components, last - first)
+            if encoded[last - first] is None:
+                return None
+        pieces[index] = encoded[last - first]
+
+    result = bytearray()
+    for index, piece in enumerate(pieces):
+        if index > 0:
+            result += bytes([0xFF, 0xD0 + (index - 1) % 8])
+        result += piece
+    result += b'\xff\xd9'
+    return bytes(result)
+
+
+def strip(data, regions=None):
+    """Remove metadata from a JPEG without decoding it.
+
+    APP and COM segments other than those needed to render the image are
+    dropped. Mask regions are blanked by replacing the restart intervals
+    they cover, which needs a baseline JPEG with restart markers and
+    regions on MCU boundaries.
+
+    Args:
+        data (bytes): JPEG file
+        regions (Regions): Mask regions or None
+
+    Returns:
+        bytes: The stripped JPEG, None if it has to be decoded instead
+    """
+    header = segments(data)
+    if header is None:
+        return None
+    result = bytearray(b'\xff\xd8')
+    for marker, start, end in header:
+        if is_metadata(data, marker, start):
+            continue
+        result += data[start:end]
+    if regions is None or (regions.dense is None and not regions.rectangles):
+        ranges = scan_data(data, header[-1][2])
+        if ranges is None:
+            return None
+        for start, end in ranges:
+            result += data[start:end]
+        return bytes(result)
+    if regions.dense is not None:
+        return None
+    scan = blank_regions(data, header, regions)
+    if scan is None:
+        return None
+    result += scan
+    return bytes(result)
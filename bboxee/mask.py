@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#
+# Bounding Box Editor and Exporter (BBoxEE)
+# Author: Peter Ersts (ersts@amnh.org)
+#
+# --------------------------------------------------------------------------
+#
+# This file is part of Animal Detection Network's (Andenet)
+# Bounding Box Editor and Exporter (BBoxEE)
+#
+# BBoxEE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BBoxEE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# --------------------------------------------------------------------------
+import zlib
+import base64
+import numpy as np
+
+# Encoding of masks stored in annotation files with schema 1.1.0 or later
+PACKED = 'zlib-packbits'
+
+
+def encode(mask):
+    """Encode a binary mask for storage in an annotation file.
+
+    The mask is packed to one bit per pixel, compressed and stored as
+    base64 text, a 2048x1536 mask takes a few kilobytes instead of
+    several megabytes of nested JSON lists.
+
+    Args:
+        mask (numpy.ndarray): 2D array of 0 and 1 values
+
+    Returns:
+        dict: Encoded mask
+    """
+    mask = np.asarray(mask, dtype='uint8')
+    bits = np.packbits(mask.ravel() > 0)
+    data = zlib.compress(bits.tobytes(), 9)
+    return {'encoding': PACKED,
+            'shape': list(mask.shape),
+            'data': base64.b64encode(data).decode('ascii')}
+
+
+def decode(value):
+    """Decode a mask from an annotation file.
+
+    Args:
+        value (dict | list | None): Encoded mask or the nested lists
+            written by schema 1.0.0
+
+    Returns:
+        numpy.ndarray: 2D uint8 array or None when there is no mask
+    """
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        if value['encoding'] != PACKED:
+            raise ValueError('Unknown mask encoding: {}'.format(value['encoding']))
+        rows, cols = value['shape']
+        bits = np.frombuffer(zlib.decompress(base64.b64decode(value['data'])),
+                             dtype='uint8')
+        mask = np.unpackbits(bits, count=rows * cols)
+        return mask.reshape((rows, cols))
+    return np.array(value, dtype='uint8')
+
+
+# Masks that do not reduce to this many rectangles are applied densely
+MAX_RECTANGLES = 64
+
+
+class Regions(object):
+    """A binary mask reduced to the rectangles it zeroes.
+
+    Metadata masks usually black out a few strips of the frame, zeroing
+    those regions in place touches only their pixels instead of
+    multiplying the whole frame by a full size, three band mask. Masks
+    too irregular to describe with a few rectangles keep a single band
+    dense copy which is broadcast over the bands.
+    """
+
+    def __init__(self, mask):
+        """Class init function.
+
+        Args:
+            mask (numpy.ndarray): 2D binary array or an image array whose
+                first band is used
+        """
+        mask = np.asarray(mask)
+        if mask.ndim == 3:
+            mask = mask[:, :, 0]
+        mask = (mask > 0).astype('uint8')
+        self.shape = mask.shape
+        self.rectangles = []
+        self.dense = None
+
+        # Rows with the same pattern form bands, every zero run in a band is
+        # one rectangle (row_start, row_end, col_start, col_end)
+        changes = np.flatnonzero(np.any(mask[1:] != mask[:-1], axis=1)) + 1
+        starts = np.concatenate(([0], changes))
+        ends = np.concatenate((changes, [self.shape[0]]))
+        for row_start, row_end in zip(starts, ends):
+            edges = np.diff(np.concatenate(([1], mask[row_start], [1])).astype('int8'))
+            for col_start, col_end in zip(np.flatnonzero(edges == -1),
+                                          np.flatnonzero(edges == 1)):
+                self.rectangles.append((int(row_start), int(row_end),
+                                        int(col_start), int(col_end)))
+            if len(self.rectangles) > MAX_RECTANGLES:
+                self.rectangles = []
+                self.dense = mask
+                break
+
+    def apply(self, array):
+        """Zero the masked regions of an image array in place.
+
+        Args:
+            array (numpy.ndarray): (height, width) or (height, width, bands)
+                array, when smaller or larger than the mask, as with a
+                draft decode, the regions are scaled to it
+
+        Returns:
+            numpy.ndarray: The same array
+        """
+        height, width = array.shape[:2]
+        if self.dense is not None:
+            mask = self.dense
+            if mask.shape != (height, width):
+                rows = np.arange(height) * mask.shape[0] // height
+                cols = np.arange(width) * mask.shape[1] // width
+                mask = mask[rows][:, cols]
+            if array.ndim == 3:
+                mask = mask[:, :, None]
+            np.multiply(array, mask, out=array)
+            return array
+
+        # Map each region to the pixels a nearest neighbour resample of the
+        # mask would zero
+        mask_height, mask_width = self.shape
+        for row_start, row_end, col_start, col_end in self.rectangles:
+            array[-(-row_start * height // mask_height):-(-row_end * height // mask_height),
+                  -(-col_start * width // mask_width):-(-col_end * width // mask_width)] = 0
+        return array
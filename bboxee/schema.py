@@ -22,15 +22,51 @@
 # along with this software.  If not, see <http://www.gnu.org/licenses/>.
 #
 # --------------------------------------------------------------------------
+import numpy as np
+from bboxee import mask
 
+# Version 1.1.0 stores the mask with mask.encode() rather than as nested lists
+ANNOTATION_FILE_SCHEMA = '1.1.0'
+# Files older releases of BBoxEE can read, new files use it unless packed
+# masks are asked for
+LEGACY_FILE_SCHEMA = '1.0.0'
 
-def annotation_file():
-    """Factory for the Animal Detection Network annotation file."""
+
+def annotation_file(version=ANNOTATION_FILE_SCHEMA):
+    """Factory for the Animal Detection Network annotation file.
+
+    Args:
+        version (str): Schema version, LEGACY_FILE_SCHEMA for files that
+            older releases of BBoxEE can read
+    """
     return {'mask': None,
             'mask_name': '',
             'images': {},
             'analysts': [],
-            'schema': '1.0.0'}
+            'schema': version}
+
+
+def encode_mask(data, array):
+    """Encode a mask for the schema version of an annotation file."""
+    if data.get('schema', LEGACY_FILE_SCHEMA) == LEGACY_FILE_SCHEMA:
+        return np.asarray(array).tolist()
+    return mask.encode(array)
+
+
+def upgrade_annotation_file(data):
+    """Bring annotation file data up to the current schema. Files keep
+    their version unless the user asks for packed masks, older releases
+    of BBoxEE can not read the files once they are upgraded.
+
+    Returns:
+        bool: True if the data was upgraded
+    """
+    if data.get('schema', LEGACY_FILE_SCHEMA) != LEGACY_FILE_SCHEMA:
+        return False
+    data['schema'] = ANNOTATION_FILE_SCHEMA
+    if data['mask'] is not None:
+        data['mask'] = mask.encode(mask.decode(data['mask']))
+    return True
 
 
 def annotation_file_entry():
@@ -70,4 +106,6 @@ def package_entry():
             'file_name': '',
             'mask_name': '',
             'directory': '',
+            'bbx_file': '',
+            'root': '',
             'annotations': []}
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+#
+# Bounding Box Editor and Exporter (BBoxEE)
+# Author: Peter Ersts (ersts@amnh.org)
+#
+# --------------------------------------------------------------------------
+#
+# This file is part of Animal Detection Network's (Andenet)
+# Bounding Box Editor and Exporter (BBoxEE)
+#
+# BBoxEE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BBoxEE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# --------------------------------------------------------------------------
+import math
+
+
+class GridIndex(object):
+    """Uniform grid over normalized [0, 1] image coordinates for finding
+    the bounding boxes under a point without testing every box.
+
+    Boxes are stored under a key (the annotation's row) as
+    (xmin, ymin, xmax, ymax) and registered in every cell they overlap,
+    so a point lookup only tests the boxes sharing its cell.
+    """
+
+    def __init__(self, cells=32):
+        """
+        Class init function.
+
+        Args:
+            cells (int): Number of grid cells along each axis
+        """
+        self.cells = cells
+        self.grid = {}
+        self.boxes = {}
+
+    def __contains__(self, key):
+        return key in self.boxes
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def _cell(self, value):
+        return min(max(int(value * self.cells), 0), self.cells - 1)
+
+    def _cells(self, box):
+        for col in range(self._cell(box[0]), self._cell(box[2]) + 1):
+            for row in range(self._cell(box[1]), self._cell(box[3]) + 1):
+                yield (col, row)
+
+    def clear(self):
+        self.grid = {}
+        self.boxes = {}
+
+    def insert(self, key, box):
+        """Add a box, replacing any box already stored under key."""
+        if key in self.boxes:
+            self.remove(key)
+        self.boxes[key] = box
+        for cell in self._cells(box):
+            self.grid.setdefault(cell, set()).add(key)
+
+    def nearest(self, x, y, width=1.0, height=1.0):
+        """Key of the box containing the point whose center is closest,
+        None if no box contains the point. Distances are measured after
+        scaling by width and height so they match the displayed image.
+        """
+        found = None
+        distance = None
+        for key in self.query(x, y):
+            box = self.boxes[key]
+            dx = (x - (box[0] + box[2]) / 2.0) * width
+            dy = (y - (box[1] + box[3]) / 2.0) * height
+            length = math.hypot(dx, dy)
+            if distance is None or length < distance:
+                found = key
+                distance = length
+        return found
+
+    def query(self, x, y):
+        """Keys of all boxes containing the point."""
+        keys = self.grid.get((self._cell(x), self._cell(y)), ())
+        found = []
+        for key in keys:
+            box = self.boxes[key]
+            if box[0] <= x <= box[2] and box[1] <= y <= box[3]:
+                found.append(key)
+        return sorted(found)
+
+    def remove(self, key):
+        box = self.boxes.pop(key, None)
+        if box is not None:
+            for cell in self._cells(box):
+                entries = self.grid[cell]
+                entries.discard(key)
+                if not entries:
+                    del self.grid[cell]
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+# Bounding Box Editor and Exporter (BBoxEE)
+# Author: Peter Ersts (ersts@amnh.org)
+#
+# --------------------------------------------------------------------------
+#
+# This file is part of Animal Detection Network's (Andenet)
+# Bounding Box Editor and Exporter (BBoxEE)
+#
+# BBoxEE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BBoxEE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# --------------------------------------------------------------------------
+import os
+import hashlib
+import threading
+from PIL import Image
+
+Image.MAX_IMAGE_PIXELS = None
+
+# Longest side of a thumbnail in pixels
+THUMBNAIL_SIZE = 160
+
+
+class ThumbnailCache(object):
+    """Thumbnails stored on disk and keyed by image path, modification
+    time and file size so that a changed image gets a new thumbnail."""
+
+    def __init__(self, directory, size=THUMBNAIL_SIZE):
+        """Class init function.
+
+        Args:
+            directory (str): Where thumbnails are stored
+            size (int): Longest side of a thumbnail in pixels
+        """
+        self.directory = directory
+        self.size = size
+
+    def path(self, file_name):
+        """Path of the cached thumbnail for an image, None if the image
+        can not be read."""
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            return None
+        key = '{}|{}|{}|{}'.format(os.path.abspath(file_name),
+                                   stat.st_mtime_ns,
+                                   stat.st_size,
+                                   self.size)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + '.jpg')
+
+    def get(self, file_name):
+        """Load the thumbnail for an image, creating it if needed.
+
+        Returns:
+            PIL.Image: RGB thumbnail or None if the image can not be read
+        """
+        path = self.path(file_name)
+        if path is None:
+            return None
+        try:
+            img = Image.open(path)
+            img.load()
+            return img
+        except OSError:
+            pass
+        try:
+            img = Image.open(file_name)
+            # Let the JPEG decoder scale down by up to 8x
+            img.draft('RGB', (self.size, self.size))
+            img = img.convert('RGB')
+            img.thumbnail((self.size, self.size))
+        except OSError:
+            return None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_name = '{}.{}.tmp'.format(path, threading.get_ident())
+            img.save(temp_name, 'JPEG', quality=85)
+            os.replace(temp_name, path)
+        except OSError:
+            # Thumbnails still work without a writable cache
+            pass
+        return img
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+#
+# Bounding Box Editor and Exporter (BBoxEE)
+# Author: Peter Ersts (ersts@amnh.org)
+#
+# --------------------------------------------------------------------------
+#
+# This file is part of Animal Detection Network's (Andenet)
+# Bounding Box Editor and Exporter (BBoxEE)
+#
+# BBoxEE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BBoxEE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# --------------------------------------------------------------------------
+import os
+import shutil
+import hashlib
+import numpy as np
+from PIL import Image
+from PyQt5 import QtCore
+
+# Drone orthomosaics routinely exceed PIL's decompression bomb limit
+Image.MAX_IMAGE_PIXELS = None
+# Bump when the layout of the levels changes so old pyramids are ignored
+PYRAMID_VERSION = 1
+# Edge length of a tile in (level) pixels, the coarsest level fits one tile
+TILE_SIZE = 512
+# Output rows averaged at a time when building a coarser level
+STRIP_ROWS = 256
+# Disk space used by cached pyramids before the least recently opened go
+PYRAMID_BUDGET = 16 * 1024 * 1024 * 1024
+
+
+def default_cache_dir():
+    cache_dir = QtCore.QStandardPaths.writableLocation(
+        QtCore.QStandardPaths.GenericCacheLocation)
+    return os.path.join(cache_dir, 'bboxee', 'pyramids')
+
+
+def pyramid_path(file_name, mask=None, cache_dir=None):
+    """Directory of the pyramid of an image, keyed by path, modification
+    time, size and mask regions. None if the image can not be stat'ed."""
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return None
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    key = hashlib.sha1('{}|{}|{}|{}'.format(os.path.abspath(file_name),
+                                            stat.st_mtime_ns,
+                                            stat.st_size,
+                                            PYRAMID_VERSION).encode('utf-8'))
+    if mask is not None:
+        key.update(repr((mask.shape, mask.rectangles)).encode('utf-8'))
+        if mask.dense is not None:
+            key.update(np.ascontiguousarray(mask.dense).tobytes())
+    return os.path.join(cache_dir, key.hexdigest())
+
+
+class TilePyramid(object):
+    """Power of two levels of detail of an image stored as memory mapped
+    arrays, level n is 1 / 2**n of the full resolution. Only the pages
+    of the tiles that are read are brought into memory."""
+
+    def __init__(self, path):
+        """
+        Class init function.
+
+        Args:
+            path (str): Directory holding level_0.npy, level_1.npy...
+        """
+        self.path = path
+        self.levels = []
+        while True:
+            level_file = os.path.join(path, 'level_{}.npy'.format(len(self.levels)))
+            if not os.path.exists(level_file):
+                break
+            self.levels.append(np.load(level_file, mmap_mode='r'))
+        if not self.levels:
+            raise ValueError('No levels in ' + path)
+        self.height, self.width = self.levels[0].shape[:2]
+
+    @property
+    def max_level(self):
+        return len(self.levels) - 1
+
+    def tile(self, level, col, row):
+        """Copy of a tile of a level, edge tiles are smaller."""
+        y = row * TILE_SIZE
+        x = col * TILE_SIZE
+        array = self.levels[level][y:y + TILE_SIZE, x:x + TILE_SIZE]
+        return np.ascontiguousarray(array)
+
+
+def half(source, destination):
+    """Average 2x2 blocks of source into destination, a strip at a time
+    so memory use does not depend on the image size."""
+    for y in range(0, destination.shape[0], STRIP_ROWS):
+        strip = np.asarray(source[2 * y:2 * (y + STRIP_ROWS)], dtype='uint16')
+        # Repeat the last row and column of odd sized levels
+        if strip.shape[0] % 2:
+            strip = np.concatenate((strip, strip[-1:]))
+        if strip.shape[1] % 2:
+            strip = np.concatenate((strip, strip[:, -1:]), axis=1)
+        total = strip[0::2, 0::2] + strip[1::2, 0::2]
+        total += strip[0::2, 1::2]
+        total += strip[1::2, 1::2]
+        destination[y:y + total.shape[0]] = (total + 2) // 4
+
+
+def moved_tile(tile, extents, offset):
+    """Copy of a PIL tile descriptor with new extents and file offset."""
+    if hasattr(tile, '_replace'):
+        return tile._replace(extents=extents, offset=offset)
+    return (tile[0], extents, offset) + tuple(tile[3:])
+
+
+def tile_bands(img):
+    """Bands of an image that can be decoded on their own, as a list of
+    (top, bottom, tiles) with the PIL tiles of each band moved to its top.
+    None if the image is decoded in one piece.
+
+    Uncompressed images stored as strips or tiles, as orthomosaics often
+    are, and uncompressed images stored in one piece can be. Compressed
+    images are decoded whole by PIL or libtiff.
+    """
+    if getattr(img, 'use_load_libtiff', False) or not img.tile:
+        return None
+    if len(img.tile) == 1:
+        codec, extents, offset, args = tuple(img.tile[0])[:4]
+        # Rows of an 8 bit raw image follow each other from the offset
+        if (codec != 'raw' or extents != (0, 0) + img.size or
+                args != (img.mode, 0, 1) or
+                img.mode not in ('L', 'RGB', 'RGBA', 'RGBX', 'CMYK')):
+            return None
+        row_bytes = img.size[0] * len(img.getbands())
+        bands = []
+        for top in range(0, img.size[1], STRIP_ROWS):
+            bottom = min(top + STRIP_ROWS, img.size[1])
+            tile = moved_tile(img.tile[0],
+                              (0, 0, img.size[0], bottom - top),
+                              offset + top * row_bytes)
+            bands.append((top, bottom, [tile]))
+        return bands
+    rows = sorted({(tile[1][1], tile[1][3]) for tile in img.tile})
+    for (top, bottom), (next_top, _) in zip(rows, rows[1:]):
+        if bottom != next_top:
+            return None
+    # Read enough rows of tiles at a time that a band is STRIP_ROWS high
+    merged = []
+    for top, bottom in rows:
+        if merged and bottom - merged[-1][0] <= STRIP_ROWS:
+            merged[-1] = (merged[-1][0], bottom)
+        else:
+            merged.append((top, bottom))
+    bands = []
+    for top, bottom in merged:
+        tiles = []
+        for tile in img.tile:
+            x0, y0, x1, y1 = tile[1]
+            if y0 >= top and y1 <= bottom:
+                tiles.append(moved_tile(tile, (x0, y0 - top, x1, y1 - top), tile[2]))
+        bands.append((top, bottom, tiles))
+    return bands
+
+
+def read_strips(file_name):
+    """Yield (row, array) strips of an image in RGB from top to bottom.
+
+    Images with bands that can be decoded on their own are read a band
+    at a time so only one band is ever in memory. Others are decoded by
+    PIL in one piece and converted a strip at a time, which still avoids
+    holding converted copies of the whole frame.
+    """
+    with Image.open(file_name) as img:
+        width, height = img.size
+        bands = tile_bands(img)
+    if bands is None:
+        with Image.open(file_name) as img:
+            img.load()
+            for y in range(0, height, STRIP_ROWS):
+                strip = img.crop((0, y, width, min(y + STRIP_ROWS, height)))
+                if strip.mode != 'RGB':
+                    strip = strip.convert('RGB')
+                yield (y, np.asarray(strip))
+        return
+    for top, bottom, tiles in bands:
+        with Image.open(file_name) as img:
+            # Decode only the tiles of the band into an image its size
+            img.tile = tiles
+            img._size = (width, bottom - top)
+            img.load()
+            strip = img if img.mode == 'RGB' else img.convert('RGB')
+            yield (top, np.asarray(strip))
+
+
+def apply_mask(mask, level):
+    """Zero the masked regions of a memory mapped level in place, a dense
+    mask is scaled and applied a strip at a time."""
+    if mask.dense is None:
+        # Touches only the pixels of the regions
+        mask.apply(level)
+        return
+    height, width = level.shape[:2]
+    cols = np.arange(width) * mask.shape[1] // width
+    for y in range(0, height, STRIP_ROWS):
+        rows = np.arange(y, min(y + STRIP_ROWS, height)) * mask.shape[0] // height
+        strip = level[y:y + len(rows)]
+        np.multiply(strip, mask.dense[rows][:, cols][:, :, None], out=strip)
+
+
+def build(file_name, path, mask=None):
+    """Read an image a strip at a time into its pyramid.
+
+    The levels are written to a temporary directory that is renamed into
+    place, a partly written pyramid is never opened.
+
+    Returns:
+        TilePyramid: The new pyramid
+    """
+    with Image.open(file_name) as img:
+        width, height = img.size
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    try:
+        level = np.lib.format.open_memmap(os.path.join(temporary, 'level_0.npy'),
+                                          mode='w+',
+                                          dtype='uint8',
+                                          shape=(height, width, 3))
+        for y, strip in read_strips(file_name):
+            # Bands of edge tiles can reach past the image
+            level[y:y + strip.shape[0]] = strip[:height - y]
+        if mask is not None:
+            apply_mask(mask, level)
+        count = 1
+        while max(level.shape[:2]) > TILE_SIZE:
+            shape = (-(-level.shape[0] // 2), -(-level.shape[1] // 2), level.shape[2])
+            coarser = np.lib.format.open_memmap(
+                os.path.join(temporary, 'level_{}.npy'.format(count)),
+                mode='w+',
+                dtype='uint8',
+                shape=shape)
+            half(level, coarser)
+            level.flush()
+            level = coarser
+            count += 1
+        level.flush()
+    except BaseException:
+        level = None
+        coarser = None
+        shutil.rmtree(temporary, ignore_errors=True)
+        raise
+    # The maps must be closed before the rename on Windows
+    level = None
+    coarser = None
+    try:
+        os.replace(temporary, path)
+    except OSError:
+        # Built by someone else in the meantime
+        shutil.rmtree(temporary, ignore_errors=True)
+    return TilePyramid(path)
+
+
+def prune(cache_dir, budget=PYRAMID_BUDGET, keep=None):
+    """Remove the least recently opened pyramids beyond the budget."""
+    pyramids = []
+    total = 0
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.endswith('.tmp') or path == keep or not os.path.isdir(path):
+            continue
+        try:
+            size = sum(entry.stat().st_size for entry in os.scandir(path))
+            pyramids.append((os.stat(path).st_mtime, size, path))
+        except OSError:
+            continue
+        total += size
+    for mtime, size, path in sorted(pyramids):
+        if total <= budget:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def cached(file_name, mask=None, cache_dir=None):
+    """The pyramid of an image if it has already been built, else None."""
+    path = pyramid_path(file_name, mask, cache_dir)
+    if path is None or not os.path.isdir(path):
+        return None
+    try:
+        pyramid = TilePyramid(path)
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    return pyramid
+
+
+def load(file_name, mask=None, cache_dir=None):
+    """The pyramid of an image, built and cached on first use.
+
+    Args:
+        file_name (str): Path to the image
+        mask (Regions): Regions to zero for masking metadata
+        cache_dir (str): Where pyramids are stored, the user cache when None
+
+    Returns:
+        TilePyramid: The pyramid, None if the image can not be read
+    """
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    pyramid = cached(file_name, mask, cache_dir)
+    if pyramid is not None:
+        return pyramid
+    path = pyramid_path(file_name, mask, cache_dir)
+    if path is None:
+        return None
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(cache_dir, exist_ok=True)
+    pyramid = build(file_name, path, mask)
+    prune(cache_dir, keep=path)
+    return pyramid
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# Bounding Box Editor and Exporter (BBoxEE)
+# Author: Peter Ersts (ersts@amnh.org)
+#
+# --------------------------------------------------------------------------
+#
+# This file is part of Animal Detection Network's (Andenet)
+# Bounding Box Editor and Exporter (BBoxEE)
+#
+# BBoxEE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BBoxEE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# --------------------------------------------------------------------------
+#
+# Compare the single document and JSON Lines annotation file layouts on a
+# synthetic project: time to open, to read one image entry and to save
+# after editing one entry.
+#
+# USAGE: python3 benchmarks/annotation_file.py [--images N] [--directory DIR]
+#
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from bboxee import bbx  # noqa: E402
+from bboxee import schema  # noqa: E402
+
+parser = argparse.ArgumentParser(description='Time annotation file layouts')
+parser.add_argument('--images', type=int, default=200000,
+                    help='Number of images in the synthetic project')
+parser.add_argument('--directory', default=None,
+                    help='Where to write the files, a temporary directory by default')
+args = parser.parse_args()
+
+random.seed(0)
+data = schema.annotation_file()
+data['analysts'].append('Benchmark')
+for i in range(args.images):
+    entry = schema.annotation_file_entry()
+    for b in range(random.randint(0, 3)):
+        annotation = schema.annotation()
+        annotation['created_by'] = 'human'
+        annotation['label'] = random.choice(['Human', 'Whitetail Deer', 'Coyote'])
+        annotation['bbox']['xmin'] = random.random() * 0.5
+        annotation['bbox']['xmax'] = annotation['bbox']['xmin'] + 0.25
+        annotation['bbox']['ymin'] = random.random() * 0.5
+        annotation['bbox']['ymax'] = annotation['bbox']['ymin'] + 0.25
+        entry['annotations'].append(annotation)
+    data['images']['IMG_{:07d}.JPG'.format(i)] = entry
+
+directory = args.directory or tempfile.mkdtemp()
+name = 'IMG_{:07d}.JPG'.format(args.images // 2)
+
+
+def timed(function, *arguments, **keywords):
+    start = time.perf_counter()
+    result = function(*arguments, **keywords)
+    return result, (time.perf_counter() - start) * 1000
+
+
+print('images: {}'.format(args.images))
+print('{:<12}{:>10}{:>12}{:>12}{:>12}'.format('layout', 'size (MB)', 'open (ms)',
+                                              'entry (ms)', 'save (ms)'))
+for layout, lines in [('document', False), ('json lines', True)]:
+    file_name = os.path.join(directory, 'benchmark_{}.bbx'.format(int(lines)))
+    bbx.save(data, file_name, lines)
+    size = os.path.getsize(file_name) / 1048576
+    loaded, open_time = timed(bbx.load, file_name, lazy=True)
+    entry, entry_time = timed(loaded['images'].__getitem__, name)
+    entry['annotations'] = []
+    _, save_time = timed(bbx.save, loaded, file_name, lines)
+    print('{:<12}{:>10.1f}{:>12.1f}{:>12.2f}{:>12.1f}'.format(layout, size, open_time,
+                                                          entry_time, save_time))
+    os.remove(file_name)
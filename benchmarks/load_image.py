@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#
+# Bounding Box Editor and Exporter (BBoxEE)
+# Author: Peter Ersts (ersts@amnh.org)
+#
+# --------------------------------------------------------------------------
+#
+# This file is part of Animal Detection Network's (Andenet)
+# Bounding Box Editor and Exporter (BBoxEE)
+#
+# BBoxEE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BBoxEE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# --------------------------------------------------------------------------
+#
+# Measure the per-image latency and the peak resident memory of
+# AnnotationWidget.load_image while stepping through a directory.
+#
+# USAGE: python3 benchmarks/load_image.py [--passes N] [--full] [--mask PNG]
+#                                        IMAGE_DIRECTORY
+#
+import os
+import sys
+import time
+import argparse
+import resource
+import statistics
+import numpy as np
+from PIL import Image
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from PyQt5 import QtWidgets  # noqa: E402
+
+parser = argparse.ArgumentParser(description='Time AnnotationWidget.load_image')
+parser.add_argument('directory', help='Directory of images')
+parser.add_argument('--passes', type=int, default=2,
+                    help='Number of passes through the directory')
+parser.add_argument('--full', action='store_true',
+                    help='Disable progressive (draft) decoding')
+parser.add_argument('--mask', default=None,
+                    help='Metadata mask (PNG) to apply to every image')
+args = parser.parse_args()
+
+APP = QtWidgets.QApplication(sys.argv[:1])
+from bboxee import schema  # noqa: E402
+from bboxee.mask import Regions  # noqa: E402
+from bboxee.gui import AnnotationWidget  # noqa: E402
+
+widget = AnnotationWidget()
+if args.full:
+    widget.progressive = False
+widget.resize(1280, 800)
+widget.show()
+APP.processEvents()
+
+widget.image_directory = args.directory
+widget.data = schema.annotation_file()
+widget.labels = ['N/A']
+if args.mask is not None:
+    widget.mask = Regions(np.clip(np.array(Image.open(args.mask)), 0, 1))
+    widget.data['mask_name'] = os.path.basename(args.mask)
+widget.load_image_list()
+widget.scanner.wait()
+APP.processEvents()
+
+timings = []
+for p in range(args.passes):
+    widget.current_image = 0
+    while widget.current_image < len(widget.image_list):
+        start = time.perf_counter()
+        widget.next_image()
+        APP.processEvents()
+        timings.append(time.perf_counter() - start)
+
+# ru_maxrss is reported in KB on Linux and bytes on macOS
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == 'darwin':
+    peak = peak / 1024
+print('images:      {}'.format(len(widget.image_list)))
+print('loads:       {}'.format(len(timings)))
+print('mean (ms):   {:.1f}'.format(statistics.mean(timings) * 1000))
+print('median (ms): {:.1f}'.format(statistics.median(timings) * 1000))
+print('max (ms):    {:.1f}'.format(max(timings) * 1000))
+print('peak RSS (MB): {:.1f}'.format(peak / 1024))
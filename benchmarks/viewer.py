@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+#
+# Bounding Box Editor and Exporter (BBoxEE)
+# Author: Peter Ersts (ersts@amnh.org)
+#
+# --------------------------------------------------------------------------
+#
+# This file is part of Animal Detection Network's (Andenet)
+# Bounding Box Editor and Exporter (BBoxEE)
+#
+# BBoxEE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BBoxEE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# --------------------------------------------------------------------------
+#
+# Time the annotation viewer hot path on synthetic image folders under the
+# offscreen Qt platform: load_image, display_bboxes, display_annotation_data,
+# select_bbox and stepping to the next image. Each scenario combines an image
+# resolution, a box count per image and an optional metadata mask.
+#
+# Results are written to a JSON file which can be passed back as a baseline
+# on a later run to report the change of every median timing.
+#
+# USAGE: python3 benchmarks/viewer.py [--images N] [--repeat N] [--quick]
+#                                     [--directory DIR] [--output JSON]
+#                                     [--baseline JSON] [--threshold PCT]
+#                                     [--floor MS]
+#
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+import numpy as np
+from PIL import Image
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from PyQt5 import QtCore, QtWidgets  # noqa: E402
+
+RESOLUTIONS = [(640, 480), (1920, 1080), (4000, 3000)]
+BOX_COUNTS = [0, 10, 100, 1000]
+QUICK_RESOLUTIONS = [(640, 480), (1920, 1080)]
+QUICK_BOX_COUNTS = [0, 100]
+LABELS = ['Human', 'Whitetail Deer', 'Coyote', 'Raccoon']
+
+parser = argparse.ArgumentParser(description='Benchmark the annotation viewer')
+parser.add_argument('--images', type=int, default=8,
+                    help='Images per synthetic folder')
+parser.add_argument('--repeat', type=int, default=3,
+                    help='Number of passes through each folder')
+parser.add_argument('--quick', action='store_true',
+                    help='Fewer resolutions and box counts')
+parser.add_argument('--directory', default=None,
+                    help='Where to generate the folders, a temporary directory by default')
+parser.add_argument('--output', default=None,
+                    help='Write the results to this JSON file')
+parser.add_argument('--baseline', default=None,
+                    help='Results of an earlier run to compare against')
+parser.add_argument('--threshold', type=float, default=10.0,
+                    help='Percent slowdown of a median reported as a regression')
+parser.add_argument('--floor', type=float, default=0.5,
+                    help='Slowdowns under this many milliseconds are treated as noise')
+args = parser.parse_args()
+
+APP = QtWidgets.QApplication(sys.argv[:1])
+from bboxee import schema  # noqa: E402
+from bboxee.mask import Regions  # noqa: E402
+from bboxee.gui import AnnotationWidget  # noqa: E402
+
+
+def make_folder(directory, width, height, count):
+    """Write count JPEG images and, in a sibling masks folder, a mask of
+    the given size. Images are a noisy gradient so they compress and
+    decode like photographs."""
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(width * height)
+    x = np.linspace(0, 255, width, dtype='float32')
+    y = np.linspace(0, 255, height, dtype='float32')[:, None]
+    for i in range(count):
+        name = os.path.join(directory, 'IMG_{:04d}.jpg'.format(i))
+        if os.path.exists(name):
+            continue
+        base = (x + y * ((i % 3) + 1)) / ((i % 3) + 2)
+        noise = rng.normal(0, 12, (height, width, 1)).astype('float32')
+        array = np.clip(np.dstack((base, base[::-1], 255 - base)) + noise, 0, 255)
+        Image.fromarray(array.astype('uint8')).save(name, quality=90)
+    # Mask out an information bar along the bottom, as trail cameras stamp.
+    # The mask goes beside the image folder, inside it would be scanned
+    # as one of the images.
+    mask = np.ones((height, width, 3), dtype='uint8')
+    mask[int(height * 0.93):, :, :] = 0
+    file_name = 'mask_{}_{}.png'.format(width, height)
+    mask_dir = os.path.join(os.path.dirname(directory), 'masks')
+    os.makedirs(mask_dir, exist_ok=True)
+    mask_name = os.path.join(mask_dir, file_name)
+    if not os.path.exists(mask_name):
+        Image.fromarray(mask * 255).save(mask_name)
+    # Left in the image folder by earlier runs
+    if os.path.exists(os.path.join(directory, file_name)):
+        os.remove(os.path.join(directory, file_name))
+    return mask
+
+
+def make_annotations(image_list, boxes):
+    data = schema.annotation_file()
+    data['analysts'].append('Benchmark')
+    rng = random.Random(boxes)
+    for name in image_list:
+        entry = schema.annotation_file_entry()
+        for b in range(boxes):
+            annotation = schema.annotation()
+            annotation['created_by'] = 'human'
+            annotation['label'] = rng.choice(LABELS)
+            xmin = rng.random() * 0.9
+            ymin = rng.random() * 0.9
+            annotation['bbox']['xmin'] = xmin
+            annotation['bbox']['xmax'] = xmin + rng.random() * (1.0 - xmin)
+            annotation['bbox']['ymin'] = ymin
+            annotation['bbox']['ymax'] = ymin + rng.random() * (1.0 - ymin)
+            entry['annotations'].append(annotation)
+        data['images'][name] = entry
+    return data
+
+
+def summarize(timings):
+    return {'n': len(timings),
+            'median_ms': statistics.median(timings) * 1000,
+            'mean_ms': statistics.mean(timings) * 1000,
+            'max_ms': max(timings) * 1000}
+
+
+def timed(function, *arguments):
+    start = time.perf_counter()
+    function(*arguments)
+    APP.processEvents()
+    return time.perf_counter() - start
+
+
+def run_scenario(widget, directory, mask, boxes, width, height):
+    widget.image_directory = directory
+    widget.data = make_annotations([], 0)
+    widget.labels = LABELS
+    widget.mask = None if mask is None else Regions(mask)
+    widget.data['mask_name'] = '' if mask is None else 'mask.png'
+    widget.load_image_list()
+    widget.scanner.wait()
+    APP.processEvents()
+    widget.data = make_annotations(widget.image_list, boxes)
+    if mask is not None:
+        widget.data['mask_name'] = 'mask.png'
+    widget.index_annotated()
+
+    rng = random.Random(0)
+    results = {'load_image': [], 'display_bboxes': [],
+               'display_annotation_data': [], 'select_bbox': [],
+               'next_image': []}
+    for r in range(args.repeat):
+        for i in range(len(widget.image_list)):
+            widget.current_image = i + 1
+            # Cold load, nothing decoded ahead
+            widget.image_loader.clear()
+            results['load_image'].append(timed(widget.load_image))
+            results['display_bboxes'].append(timed(widget.display_bboxes))
+            results['display_annotation_data'].append(
+                timed(widget.display_annotation_data))
+            for c in range(10):
+                point = QtCore.QPointF(rng.random() * width, rng.random() * height)
+                results['select_bbox'].append(timed(widget.select_bbox, point))
+        # Step through the folder as a user holding the next key would,
+        # read ahead included
+        widget.image_loader.clear()
+        widget.current_image = 1
+        widget.load_image()
+        APP.processEvents()
+        while widget.current_image < len(widget.image_list):
+            results['next_image'].append(timed(widget.next_image))
+    return dict((name, summarize(results[name])) for name in results)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare(results, baseline):
+    """Print the change of every median against the baseline and return the
+    number of regressions."""
+    regressions = 0
+    print('\n{:<32} {:<24} {:>10} {:>10} {:>8}'.format(
+        'scenario', 'operation', 'base (ms)', 'now (ms)', 'change'))
+    for scenario in results:
+        if scenario not in baseline:
+            continue
+        for operation in results[scenario]:
+            if operation not in baseline[scenario]:
+                continue
+            before = baseline[scenario][operation]['median_ms']
+            after = results[scenario][operation]['median_ms']
+            change = (after - before) / before * 100 if before > 0 else 0.0
+            flag = ''
+            if change > args.threshold and after - before > args.floor:
+                flag = ' REGRESSION'
+                regressions += 1
+            print('{:<32} {:<24} {:>10.2f} {:>10.2f} {:>+7.1f}%{}'.format(
+                scenario, operation, before, after, change, flag))
+    return regressions
+
+
+if args.directory is None:
+    root = tempfile.mkdtemp(prefix='bboxee_benchmark_')
+else:
+    root = args.directory
+
+widget = AnnotationWidget()
+widget.resize(1280, 800)
+widget.show()
+APP.processEvents()
+
+resolutions = QUICK_RESOLUTIONS if args.quick else RESOLUTIONS
+box_counts = QUICK_BOX_COUNTS if args.quick else BOX_COUNTS
+results = {}
+for width, height in resolutions:
+    directory = os.path.join(root, '{}x{}'.format(width, height))
+    mask = make_folder(directory, width, height, args.images)
+    for boxes in box_counts:
+        for masked in (False, True):
+            scenario = '{}x{} {} boxes{}'.format(width, height, boxes,
+                                                 ' masked' if masked else '')
+            results[scenario] = run_scenario(widget, directory,
+                                             mask if masked else None,
+                                             boxes, width, height)
+            print('{:<32} '.format(scenario) + '  '.join(
+                '{} {:.2f}'.format(op, results[scenario][op]['median_ms'])
+                for op in results[scenario]))
+
+report = {'commit': git_commit(),
+          'python': platform.python_version(),
+          'qt': QtCore.QT_VERSION_STR,
+          'platform': platform.platform(),
+          'images': args.images,
+          'repeat': args.repeat,
+          'results': results}
+if args.output is not None:
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+regressions = 0
+if args.baseline is not None:
+    with open(args.baseline, 'r') as file:
+        regressions = compare(results, json.load(file)['results'])
+    print('\n{} regression(s) above {:.0f}%'.format(regressions, args.threshold))
+widget.close_journal()
+sys.exit(1 if regressions > 0 else 0)
@@ -23,11 +23,14 @@
 #
 # --------------------------------------------------------------------------
 import sys
+import multiprocessing
 from PyQt5 import QtWidgets
 
 from bboxee.gui import MainWindow
 
 if __name__ == "__main__":
+    # Export workers re-enter the frozen executable
+    multiprocessing.freeze_support()
     APP = QtWidgets.QApplication(sys.argv)
     screen = APP.desktop().availableGeometry()
     icon_size = int(screen.height() * 0.03)